@@ -1,4 +1,5 @@
 # --- FIX: Import the necessary functions ---
+import click
 from flask import Flask, redirect, url_for, request
 # --- FIX: Import current_user ---
 from flask_login import LoginManager, current_user
@@ -7,7 +8,7 @@ from routes.accounts import accounts_bp
 
 from models import db, User, CompanyProfile, Account
 from config import Config
-from datetime import datetime
+from datetime import datetime, timedelta
 from flask_limiter import Limiter
 from flask_limiter.util import get_remote_address
 from extensions import limiter
@@ -84,8 +85,153 @@ def create_app():
     app.register_blueprint(consignment_bp)
     app.register_blueprint(void_bp)
 
+    # --- CLI Commands ---
+    @app.cli.command('backfill-journal-lines')
+    def backfill_journal_lines_command():
+        """Build JournalLine rows for journal entries posted before the table existed."""
+        from routes.ledger_utils import backfill_journal_lines
+        count = backfill_journal_lines()
+        print(f"✅ Backfilled journal lines for {count} journal entries.")
+
+    @app.cli.command('backfill-consignment-counters')
+    def backfill_consignment_counters_command():
+        """Rebuild the running consignment counters from the consignment items."""
+        from models import ConsignmentCounters
+        count = ConsignmentCounters.rebuild()
+        print(f"✅ Rebuilt counters for {count} consignments.")
+
+    @app.cli.command('check-consignment-availability')
+    @click.option('--repair', is_flag=True, help='Rewrite the stored availability that does not match.')
+    def check_consignment_availability_command(repair):
+        """Verify stored consignment availability against received - sold - returned - damaged."""
+        from routes.catalog_utils import check_consignment_availability
+        mismatches = check_consignment_availability(repair=repair)
+        for item_id, stored, expected in mismatches:
+            print(f"Consignment item {item_id}: stored {stored}, expected {expected}")
+        if not mismatches:
+            print("✅ Stored consignment availability matches the items.")
+        elif repair:
+            print(f"✅ Repaired {len(mismatches)} consignment items.")
+        else:
+            print(f"❌ {len(mismatches)} consignment items do not match; run with --repair to fix them.")
+
+    @app.cli.command('prune-catalog-changes')
+    @click.option('--days', default=30, show_default=True, help='Keep catalog changes from the last N days.')
+    def prune_catalog_changes_command(days):
+        """Delete old POS catalog change log rows; terminals further behind resync in full."""
+        from routes.catalog_utils import prune_catalog_changes
+        count = prune_catalog_changes(datetime.utcnow() - timedelta(days=days))
+        print(f"✅ Pruned {count} catalog changes older than {days} days.")
+
+    @app.cli.command('set-costing-method')
+    @click.argument('method', type=click.Choice(['fifo', 'average'], case_sensitive=False))
+    @click.option('--category', 'categories', multiple=True,
+                  help='Product category, e.g. CEM, SND, NAL for construction commodities. Repeatable.')
+    @click.option('--product', 'skus', multiple=True, help='Product SKU. Repeatable.')
+    def set_costing_method_command(method, categories, skus):
+        """Cost products or whole categories FIFO or at moving weighted average, converting their stock."""
+        from models import db, Product
+        from routes.costing_utils import set_costing_method
+        if not categories and not skus:
+            raise click.UsageError('Give at least one --category or --product.')
+        converted = 0
+        for category in categories:
+            converted += len(set_costing_method(method.upper(), category=category))
+        for sku in skus:
+            product = Product.query.filter_by(sku=sku).first()
+            if not product:
+                raise click.BadParameter(f'No product with SKU {sku}', param_hint='--product')
+            converted += len(set_costing_method(method.upper(), product_id=product.id))
+        db.session.commit()
+        print(f"✅ Costing method set to {method.upper()}; converted the stock of {converted} products.")
+
+    @app.cli.command('archive-inventory')
+    @click.option('--days', type=int, default=None,
+                  help='Archive lots with no activity in the last N days [default: INVENTORY_ARCHIVE_DAYS].')
+    @click.option('--batch-size', default=1000, show_default=True, help='Lots moved per transaction.')
+    def archive_inventory_command(days, batch_size):
+        """Move depleted FIFO lots and their consumption records to the archive tables."""
+        from routes.archive_utils import archive_inventory_history
+        days = app.config['INVENTORY_ARCHIVE_DAYS'] if days is None else days
+        lots, records = archive_inventory_history(datetime.utcnow() - timedelta(days=days), batch_size)
+        print(f"✅ Archived {lots} depleted lots and {records} consumption records older than {days} days.")
+
+    @app.cli.command('reconcile-inventory')
+    @click.option('--chunk-size', default=20000, show_default=True, help='Products per grouped query.')
+    @click.option('--workers', default=1, show_default=True, help='Processes to check chunks in parallel.')
+    @click.option('--report', type=click.Path(dir_okay=False, writable=True),
+                  help='Write the discrepancies to this CSV file.')
+    @click.option('--repair', is_flag=True,
+                  help="Set each mismatched product's quantity to the units in its lots.")
+    def reconcile_inventory_command(chunk_size, workers, report, repair):
+        """Check every product's quantity against its lots, and the stock value against the GL Inventory balance."""
+        import csv
+        from concurrent.futures import ProcessPoolExecutor
+        from sqlalchemy import func
+        from models import AuditLog, Product
+        from routes.fifo_utils import inventory_gl_balance, reconcile_inventory, repair_inventory_quantities
+
+        first_id, last_id = db.session.query(func.min(Product.id), func.max(Product.id)).one()
+        chunks = [(start, min(start + chunk_size - 1, last_id))
+                  for start in range(first_id, last_id + 1, chunk_size)] if first_id is not None else []
+        if workers > 1 and len(chunks) > 1:
+            db.session.remove()  # Each worker opens its own connections
+            with ProcessPoolExecutor(max_workers=workers, initializer=_init_reconcile_worker) as pool:
+                results = list(pool.map(_reconcile_chunk, chunks))
+        else:
+            results = [reconcile_inventory(start, end) for start, end in chunks]
+
+        checked = sum(result['products'] for result in results)
+        stock_value = round(sum(result['stock_value'] for result in results), 2)
+        discrepancies = [row for result in results for row in result['discrepancies']]
+        gl_balance = round(inventory_gl_balance(), 2)
+
+        for row in discrepancies[:50]:
+            print(f"{row['sku']}: quantity {row['product_quantity']}, lots {row['lot_total']} "
+                  f"({row['discrepancy']:+d})")
+        if len(discrepancies) > 50:
+            print(f"... and {len(discrepancies) - 50} more")
+        if report:
+            fields = ['product_id', 'sku', 'name', 'product_quantity', 'lot_total', 'discrepancy', 'lot_value']
+            with open(report, 'w', newline='') as f:
+                writer = csv.DictWriter(f, fieldnames=fields, extrasaction='ignore')
+                writer.writeheader()
+                writer.writerows(discrepancies)
+            print(f"Wrote {len(discrepancies)} discrepancies to {report}")
+
+        print(f"Checked {checked} products: {len(discrepancies)} quantities do not match their lots.")
+        gl_difference = round(gl_balance - stock_value, 2)
+        print(f"Stock value {stock_value:,.2f} vs GL Inventory {gl_balance:,.2f} (difference {gl_difference:,.2f}).")
+
+        if repair and discrepancies:
+            updated = repair_inventory_quantities(discrepancies)
+            db.session.add(AuditLog(action=f'Inventory reconciliation: set the quantity of {updated} '
+                                           f'products to their lot totals'))
+            db.session.commit()
+            print(f"✅ Repaired the quantity of {updated} products.")
+        elif discrepancies:
+            print("❌ Run with --repair to set the quantities to the lot totals.")
+        if gl_difference:
+            print("❌ The GL difference is not repaired automatically; post an adjusting entry after review.")
+
     return app
 
+
+_reconcile_app = None
+
+
+def _init_reconcile_worker():
+    global _reconcile_app
+    _reconcile_app = create_app()
+
+
+def _reconcile_chunk(bounds):
+    """One product-id range of reconcile-inventory, in a worker process with its own app."""
+    from routes.fifo_utils import reconcile_inventory
+    with _reconcile_app.app_context():
+        return reconcile_inventory(*bounds)
+
+
 def seed_essential_data(app):
     """Seeds essential data (Admin user and COA) if the database is empty."""
     
@@ -142,5 +288,22 @@ if __name__ == '__main__':
         
         # 2. Seed the essential data (Pass the app object to the function)
         seed_essential_data(app)
+
+        # 3. Make sure every journal entry has its JournalLine rows
+        from routes.ledger_utils import backfill_journal_lines
+        backfill_journal_lines()
+
+        # 4. create_all() only builds indexes with new tables; add the ones since defined on existing tables
+        for table in db.metadata.sorted_tables:
+            for index in table.indexes:
+                index.create(db.engine, checkfirst=True)
+
+        # 5. Store the availability of consignment items received before it was stored
+        from routes.catalog_utils import check_consignment_availability
+        check_consignment_availability(repair=True)
+
+        # 6. Point every product at its oldest open lot
+        from routes.fifo_utils import rebuild_fifo_heads
+        rebuild_fifo_heads()
         
     app.run(debug=True)
\ No newline at end of file
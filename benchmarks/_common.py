@@ -0,0 +1,82 @@
+"""
+Shared Benchmark Setup
+
+QueryCounter; throwaway_app(), which gives each benchmark an app on a
+temporary SQLite file instead of instance/app.db; and the admin user, company
+profile and logged-in client the benchmarks that go through the routes need.
+"""
+import os
+import sys
+import tempfile
+from contextlib import contextmanager
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from sqlalchemy import event
+
+from config import Config
+
+
+class QueryCounter:
+    """Counts statements executed on an engine while active."""
+
+    def __init__(self, engine):
+        self.engine = engine
+        self.count = 0
+
+    def _on_execute(self, *args):
+        self.count += 1
+
+    def __enter__(self):
+        self.count = 0
+        event.listen(self.engine, 'before_cursor_execute', self._on_execute)
+        return self
+
+    def __exit__(self, *exc):
+        event.remove(self.engine, 'before_cursor_execute', self._on_execute)
+
+
+@contextmanager
+def throwaway_app(seed_essentials=False, **config):
+    """
+    An app on a new temporary SQLite file with all tables created, and the chart
+    of accounts seeded if asked. `config` overrides app settings. The database is
+    deleted on exit.
+    """
+    db_file = tempfile.NamedTemporaryFile(suffix='.db', delete=False).name
+    Config.SQLALCHEMY_DATABASE_URI = 'sqlite:///' + db_file
+    # Benchmark clients all log in from 127.0.0.1; the limiter reads this when the app is created
+    Config.RATELIMIT_ENABLED = False
+
+    from app import create_app, seed_essential_data
+    from models import db
+
+    app = create_app()
+    app.config.update(config)
+    try:
+        with app.app_context():
+            db.create_all()
+        if seed_essentials:
+            seed_essential_data(app)
+        yield app
+    finally:
+        with app.app_context():
+            db.session.remove()
+            db.engine.dispose()
+        os.remove(db_file)
+
+
+def seed_admin_and_profile():
+    """Add the benchmark's Admin user (bench/bench) and a company profile to the session. The caller commits."""
+    from passlib.hash import pbkdf2_sha256
+    from models import db, User, CompanyProfile
+
+    db.session.add(User(username='bench', password_hash=pbkdf2_sha256.hash('bench'), role='Admin'))
+    db.session.add(CompanyProfile(name='Benchmark Co', tin='000', address='-'))
+
+
+def logged_in_client(app):
+    """A test client logged in as the user seed_admin_and_profile adds."""
+    client = app.test_client()
+    client.post('/login', data={'username': 'bench', 'password': 'bench'})
+    return client
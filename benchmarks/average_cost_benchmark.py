@@ -0,0 +1,91 @@
+"""
+Moving Average Costing Benchmark
+
+Seeds two identical groups of commodity products received in many small lots,
+one of them in a category costed at moving weighted average, then records the same
+sales of both through /api/sale and compares the time per sale and the
+InventoryLot / InventoryTransaction rows each group leaves behind.
+
+    python benchmarks/average_cost_benchmark.py --products 50 --receipts 200 --sales 500
+"""
+import argparse
+import random
+import time
+
+from _common import throwaway_app, seed_admin_and_profile, logged_in_client
+
+GROUPS = (('FIFO', 'SAN'), ('AVERAGE', 'CEM'))
+
+
+def seed(db, products, receipts):
+    from models import Product
+    from routes.fifo_utils import create_inventory_lot
+    from routes.costing_utils import set_costing_method
+
+    seed_admin_and_profile()
+    set_costing_method('AVERAGE', category='CEM')  # Before any stock arrives, so no lots are ever made
+    costs = [[round(random.uniform(200, 260), 2) for _ in range(receipts)] for _ in range(products)]
+    for _, category in GROUPS:
+        for i in range(products):
+            product = Product(sku=f'{category}-{i:05d}', name=f'{category} {i}', category=category,
+                              sale_price=300.0, cost_price=230.0, quantity=receipts * 5)
+            db.session.add(product)
+            db.session.flush()
+            for unit_cost in costs[i]:
+                create_inventory_lot(product.id, 5, unit_cost)
+    db.session.commit()
+
+
+def table_rows(db, category):
+    from sqlalchemy import func, select
+    from models import Product, InventoryLot, InventoryTransaction
+    lots = db.session.execute(
+        select(func.count()).select_from(InventoryLot).join(Product).where(Product.category == category)
+    ).scalar()
+    transactions = db.session.execute(
+        select(func.count()).select_from(InventoryTransaction).join(InventoryLot).join(Product)
+        .where(Product.category == category)
+    ).scalar()
+    return lots, transactions
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--products', type=int, default=50, help='products per group')
+    parser.add_argument('--receipts', type=int, default=200, help='receipts of 5 units per product')
+    parser.add_argument('--sales', type=int, default=500, help='sales per group')
+    parser.add_argument('--seed', type=int, default=42)
+    args = parser.parse_args()
+
+    random.seed(args.seed)
+
+    from models import db
+
+    with throwaway_app(seed_essentials=True) as app:
+        with app.app_context():
+            seed(db, args.products, args.receipts)
+
+        client = logged_in_client(app)
+        # Quantities that usually span several 5-unit lots
+        carts = [[(random.randrange(args.products), random.randint(3, 12)) for _ in range(random.randint(1, 4))]
+                 for _ in range(args.sales)]
+        rows = []
+        for method, category in GROUPS:
+            t0 = time.perf_counter()
+            for cart in carts:
+                response = client.post('/api/sale', json={
+                    'items': [{'sku': f'{category}-{i:05d}', 'qty': qty} for i, qty in cart], 'is_vatable': True
+                })
+                assert response.status_code == 200, response.get_json()
+            sale_ms = (time.perf_counter() - t0) * 1000 / len(carts)
+            with app.app_context():
+                rows.append((method, sale_ms, *table_rows(db, category)))
+
+    print(f"{args.products} products per group x {args.receipts} receipts, {args.sales} sales each")
+    print(f"{'method':>8} | {'ms/sale':>8} | {'lots':>8} | {'lot transactions':>16}")
+    for method, sale_ms, lots, transactions in rows:
+        print(f"{method:>8} | {sale_ms:>8.2f} | {lots:>8} | {transactions:>16}")
+
+
+if __name__ == '__main__':
+    main()
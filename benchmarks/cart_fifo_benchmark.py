@@ -0,0 +1,95 @@
+"""
+POS Cart FIFO Benchmark
+
+Posts sales of growing cart sizes through /api/sale and reports the SQL
+statements and wall time per sale. Each product has several open FIFO lots so
+lines span lot boundaries. The "per-line" columns replay the pre-batching
+pattern (a product lookup plus consume_inventory_fifo for every cart line)
+inside a rolled-back transaction for comparison.
+
+    python benchmarks/cart_fifo_benchmark.py --cart-sizes 5 20 40 80
+"""
+import argparse
+import random
+import time
+
+from _common import QueryCounter, throwaway_app, seed_admin_and_profile, logged_in_client
+
+LOTS_PER_PRODUCT = 4
+
+
+def seed(db, Product, n_products):
+    from routes.fifo_utils import create_inventory_lot
+
+    seed_admin_and_profile()
+    for i in range(n_products):
+        product = Product(sku=f'BEN-{i:05d}', name=f'Item {i}', sale_price=100.0, cost_price=50.0,
+                          quantity=LOTS_PER_PRODUCT * 1000)
+        db.session.add(product)
+        db.session.flush()
+        for _ in range(LOTS_PER_PRODUCT):
+            create_inventory_lot(product.id, 1000, round(random.uniform(30, 60), 2))
+    db.session.commit()
+
+
+def cart(skus, size):
+    return [{'sku': random.choice(skus), 'qty': random.randint(1, 3)} for _ in range(size)]
+
+
+def per_line_replay(db, Product, items):
+    """The pre-batching pattern: one product lookup and one FIFO call per cart line."""
+    from routes.fifo_utils import consume_inventory_fifo
+
+    for it in items:
+        product = Product.query.filter_by(sku=it['sku']).first()
+        consume_inventory_fifo(product_id=product.id, quantity_needed=it['qty'])
+    db.session.flush()
+    db.session.rollback()
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--cart-sizes', type=int, nargs='+', default=[5, 20, 40, 80])
+    parser.add_argument('--products', type=int, default=200)
+    parser.add_argument('--sales', type=int, default=20, help='sales per cart size')
+    parser.add_argument('--seed', type=int, default=42)
+    args = parser.parse_args()
+
+    random.seed(args.seed)
+
+    from models import db, Product
+
+    with throwaway_app(seed_essentials=True) as app:
+        with app.app_context():
+            seed(db, Product, args.products)
+            skus = [p.sku for p in Product.query.all()]
+            engine = db.engine
+
+        client = logged_in_client(app)
+
+        print(f"{'lines':>6} | {'api_sale queries':>16} | {'api_sale ms':>11} | {'per-line queries':>16} | {'per-line ms':>11}")
+        for size in args.cart_sizes:
+            carts = [cart(skus, size) for _ in range(args.sales)]
+
+            queries, t0 = 0, time.perf_counter()
+            for items in carts:
+                with QueryCounter(engine) as counter:
+                    response = client.post('/api/sale', json={'items': items, 'is_vatable': True})
+                assert response.status_code == 200, response.get_json()
+                queries += counter.count
+            sale_ms = (time.perf_counter() - t0) * 1000 / len(carts)
+
+            with app.app_context():
+                replay_queries, t0 = 0, time.perf_counter()
+                for items in carts:
+                    with QueryCounter(engine) as counter:
+                        per_line_replay(db, Product, items)
+                    replay_queries += counter.count
+                replay_ms = (time.perf_counter() - t0) * 1000 / len(carts)
+
+            print(f"{size:>6} | {queries / len(carts):>16.1f} | {sale_ms:>11.1f} | "
+                  f"{replay_queries / len(carts):>16.1f} | {replay_ms:>11.1f}")
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,90 @@
+"""
+POS Catalog Sync Benchmark
+
+A terminal keeping a local catalog syncs through /api/pos/catalog/snapshot:
+once in full, then after a few sales with ?since=<version>, then unchanged with
+If-None-Match. Reports response size and time for each, next to paging the
+whole catalog through /api/pos/catalog the way a terminal without a local copy
+would re-download it.
+
+    python benchmarks/catalog_sync_benchmark.py --products 30000 --sales 20
+"""
+import argparse
+import random
+import time
+
+from _common import throwaway_app, seed_admin_and_profile, logged_in_client
+
+
+def seed(db, Product, products):
+    from models import InventoryLot
+
+    seed_admin_and_profile()
+    db.session.execute(Product.__table__.insert(), [{
+        'sku': f'BEN-{i:06d}', 'name': f'Item {i}', 'sale_price': 100.0, 'cost_price': 50.0,
+        'quantity': 1000, 'is_active': True,
+    } for i in range(products)])
+    db.session.execute(InventoryLot.__table__.insert(), [{
+        'product_id': i + 1, 'quantity_remaining': 1000, 'unit_cost': 50.0, 'is_opening_balance': True,
+    } for i in range(products)])
+    db.session.commit()
+
+
+def timed_get(client, url, **kwargs):
+    t0 = time.perf_counter()
+    response = client.get(url, **kwargs)
+    return response, (time.perf_counter() - t0) * 1000
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--products', type=int, default=30000)
+    parser.add_argument('--sales', type=int, default=20)
+    parser.add_argument('--seed', type=int, default=42)
+    args = parser.parse_args()
+
+    random.seed(args.seed)
+
+    from models import db, Product
+
+    with throwaway_app(seed_essentials=True) as app:
+        with app.app_context():
+            seed(db, Product, args.products)
+
+        client = logged_in_client(app)
+        rows = []
+
+        t0 = time.perf_counter()
+        paged_bytes, page = 0, 1
+        while True:
+            response = client.get(f'/api/pos/catalog?page={page}&per_page=100')
+            paged_bytes += len(response.get_data())
+            if not response.get_json()['has_next']:
+                break
+            page += 1
+        rows.append(('page through all', 200, paged_bytes, (time.perf_counter() - t0) * 1000))
+
+        response, ms = timed_get(client, '/api/pos/catalog/snapshot')
+        version = response.get_json()['version']
+        rows.append(('full snapshot', response.status_code, len(response.get_data()), ms))
+
+        for _ in range(args.sales):
+            items = [{'sku': f'BEN-{random.randrange(args.products):06d}', 'qty': 1} for _ in range(3)]
+            client.post('/api/sale', json={'items': items, 'is_vatable': True})
+
+        response, ms = timed_get(client, f'/api/pos/catalog/snapshot?since={version}')
+        body = response.get_json()
+        rows.append((f"delta ({len(body['items'])} items)", response.status_code, len(response.get_data()), ms))
+
+        url = f"/api/pos/catalog/snapshot?since={body['version']}"
+        etag = client.get(url).headers['ETag']
+        response, ms = timed_get(client, url, headers={'If-None-Match': etag})
+        rows.append(('unchanged (304)', response.status_code, len(response.get_data()), ms))
+
+    print(f"{'request':>18} | {'status':>6} | {'bytes':>10} | {'ms':>8}")
+    for label, status, size, ms in rows:
+        print(f"{label:>18} | {status:>6} | {size:>10} | {ms:>8.1f}")
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,95 @@
+"""
+Consignment Availability Benchmark
+
+Seeds many consignment items, most of them sold out, and times finding the
+sellable ones (active with stock) two ways: computing received - sold -
+returned - damaged for every item, and reading the stored availability through
+the partial index. Also times the consistency check over all items.
+
+    python benchmarks/consignment_availability_benchmark.py --items 50000 --sellable 0.1
+"""
+import argparse
+import random
+import time
+
+from _common import throwaway_app
+
+
+def seed(db, items, sellable):
+    from models import ConsignmentSupplier, ConsignmentReceived, ConsignmentItem
+    from routes.catalog_utils import check_consignment_availability
+
+    supplier = ConsignmentSupplier(name='Benchmark Supplier')
+    db.session.add(supplier)
+    db.session.flush()
+    receipts = []
+    for i in range(max(items // 500, 1)):
+        receipt = ConsignmentReceived(supplier_id=supplier.id, receipt_number=f'CON-{i:05d}')
+        db.session.add(receipt)
+        receipts.append(receipt)
+    db.session.flush()
+    db.session.execute(ConsignmentItem.__table__.insert(), [{
+        'consignment_id': receipts[i % len(receipts)].id, 'sku': f'CSG-{i:06d}', 'product_name': f'Consigned {i}',
+        'quantity_received': 10, 'quantity_sold': 10 if random.random() >= sellable else random.randint(0, 9),
+        'quantity_returned': 0, 'quantity_damaged': 0, 'retail_price': 80.0, 'is_active': True,
+    } for i in range(items)])
+    db.session.commit()
+    # Bulk inserts skip the ORM hook, as rows from before the table existed would
+    check_consignment_availability(repair=True)
+
+
+def timed_ms(fn, repeat):
+    t0 = time.perf_counter()
+    for _ in range(repeat):
+        result = fn()
+    return (time.perf_counter() - t0) * 1000 / repeat, result
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--items', type=int, default=50000)
+    parser.add_argument('--sellable', type=float, default=0.1, help='share of items with stock left')
+    parser.add_argument('--repeat', type=int, default=20)
+    parser.add_argument('--seed', type=int, default=42)
+    args = parser.parse_args()
+
+    random.seed(args.seed)
+
+    from sqlalchemy import func, select
+    from models import db, ConsignmentItem
+    from routes.catalog_utils import check_consignment_availability, consignment_available, sellable_consignment_items
+
+    with throwaway_app() as app:
+        with app.app_context():
+            seed(db, args.items, args.sellable)
+
+            computed = (ConsignmentItem.quantity_received
+                        - func.coalesce(ConsignmentItem.quantity_sold, 0)
+                        - func.coalesce(ConsignmentItem.quantity_returned, 0)
+                        - func.coalesce(ConsignmentItem.quantity_damaged, 0))
+
+            def computed_scan():
+                return db.session.execute(
+                    select(ConsignmentItem.id, computed).where(ConsignmentItem.is_active == True, computed > 0)
+                ).all()
+
+            def stored_scan():
+                return db.session.execute(
+                    sellable_consignment_items(select(ConsignmentItem.id, consignment_available()))
+                ).all()
+
+            computed_ms, computed_rows = timed_ms(computed_scan, args.repeat)
+            stored_ms, stored_rows = timed_ms(stored_scan, args.repeat)
+            assert sorted(computed_rows) == sorted(stored_rows)
+            check_ms, mismatches = timed_ms(check_consignment_availability, 1)
+            assert not mismatches
+
+    print(f"{len(stored_rows)} of {args.items} items sellable")
+    print(f"{'query':>24} | {'ms':>8}")
+    print(f"{'computed availability':>24} | {computed_ms:>8.2f}")
+    print(f"{'stored + partial index':>24} | {stored_ms:>8.2f}")
+    print(f"{'consistency check':>24} | {check_ms:>8.2f}")
+
+
+if __name__ == '__main__':
+    main()
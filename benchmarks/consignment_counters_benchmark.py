@@ -0,0 +1,105 @@
+"""
+Consignment Counters Benchmark
+
+Sells consignment items through /api/sale against a consignment with many
+items, checks the running counters against a recount of the items, then times
+the status and commission figures the old way (summing the items in Python and
+the sold-value aggregate query) next to reading the counters, and renders the
+consignment page.
+
+    python benchmarks/consignment_counters_benchmark.py --items 2000 --sales 200
+"""
+import argparse
+import random
+import time
+
+from _common import throwaway_app, seed_admin_and_profile, logged_in_client
+
+
+def seed(db, items):
+    from models import ConsignmentSupplier, ConsignmentReceived, ConsignmentItem
+
+    seed_admin_and_profile()
+    supplier = ConsignmentSupplier(name='Benchmark Supplier')
+    db.session.add(supplier)
+    db.session.flush()
+    receipt = ConsignmentReceived(supplier_id=supplier.id, receipt_number='CON-BENCH', commission_rate=15.0)
+    db.session.add(receipt)
+    db.session.flush()
+    for i in range(items):
+        db.session.add(ConsignmentItem(
+            consignment_id=receipt.id, sku=f'CSG-{i:06d}', product_name=f'Consigned {i}',
+            quantity_received=50, quantity_sold=0, quantity_returned=0, quantity_damaged=0,
+            retail_price=round(random.uniform(20, 200), 2),
+        ))
+    db.session.commit()
+    return receipt.id
+
+
+def timed_ms(fn, repeat):
+    t0 = time.perf_counter()
+    for _ in range(repeat):
+        fn()
+    return (time.perf_counter() - t0) * 1000 / repeat
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--items', type=int, default=2000, help='items on the consignment')
+    parser.add_argument('--sales', type=int, default=200)
+    parser.add_argument('--reads', type=int, default=200)
+    parser.add_argument('--seed', type=int, default=42)
+    args = parser.parse_args()
+
+    random.seed(args.seed)
+
+    from models import db, ConsignmentReceived, ConsignmentCounters
+
+    with throwaway_app(seed_essentials=True) as app:
+        with app.app_context():
+            consignment_id = seed(db, args.items)
+
+        client = logged_in_client(app)
+
+        t0 = time.perf_counter()
+        for _ in range(args.sales):
+            item_id = random.randint(1, args.items)
+            response = client.post('/api/sale', json={'items': [{
+                'sku': f'CSG-{item_id - 1:06d}', 'qty': random.randint(1, 3),
+                'is_consignment': True, 'consignment_item_id': item_id,
+            }], 'is_vatable': True})
+            assert response.status_code == 200, response.get_json()
+        sale_ms = (time.perf_counter() - t0) * 1000 / args.sales
+
+        with app.app_context():
+            consignment = db.session.get(ConsignmentReceived, consignment_id)
+
+            def summed():
+                items = consignment.items.all()
+                received = sum(item.quantity_received for item in items)
+                sold = sum(item.quantity_sold for item in items)
+                returned = sum(item.quantity_returned for item in items)
+                sold_value = ConsignmentCounters.totals(consignment_id)[4]
+                return received, sold, returned, round(sold_value * (consignment.commission_rate / 100), 2)
+
+            def counted():
+                counters = consignment.get_counters()
+                return (counters.units_received, counters.units_sold, counters.units_returned,
+                        counters.commission)
+
+            assert summed() == counted()
+            rows = [
+                ('status + commission: sum items', timed_ms(summed, args.reads)),
+                ('status + commission: counters', timed_ms(counted, args.reads)),
+            ]
+
+        rows.append(('consignment page', timed_ms(lambda: client.get(f'/consignment/view/{consignment_id}'), 20)))
+        rows.insert(0, ('record sale', sale_ms))
+
+    print(f"{'operation':>32} | {'ms each':>10}")
+    for label, ms in rows:
+        print(f"{label:>32} | {ms:>10.3f}")
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,108 @@
+"""
+Document Number Allocation Benchmark
+
+Several threads (standing in for POS terminals) each take document numbers in
+their own transactions, first with the old pattern of incrementing
+CompanyProfile.next_invoice_number inside the transaction, then with
+next_document_number() on a normal and a gap-free series. Reports wall time,
+writes to the counter row, and duplicate numbers handed out.
+
+    python benchmarks/document_sequence_benchmark.py --terminals 8 --numbers 200
+"""
+import argparse
+import threading
+import time
+
+from _common import throwaway_app, seed_admin_and_profile
+from sqlalchemy import event
+
+
+class CounterRowWrites:
+    """Counts UPDATE statements against the given tables while active."""
+
+    def __init__(self, engine, tables):
+        self.engine = engine
+        self.tables = tables
+        self.count = 0
+        self.lock = threading.Lock()
+
+    def _on_execute(self, conn, cursor, statement, *args):
+        if statement.lstrip().upper().startswith('UPDATE') and any(t in statement for t in self.tables):
+            with self.lock:
+                self.count += 1
+
+    def __enter__(self):
+        event.listen(self.engine, 'before_cursor_execute', self._on_execute)
+        return self
+
+    def __exit__(self, *exc):
+        event.remove(self.engine, 'before_cursor_execute', self._on_execute)
+
+
+def run_terminals(app, db, terminals, numbers, take):
+    """Each terminal takes `numbers` numbers, one committed transaction each."""
+    issued, errors = [], []
+    lock = threading.Lock()
+
+    def terminal():
+        for _ in range(numbers):
+            with app.app_context():
+                for attempt in range(20):
+                    try:
+                        number = take()
+                        db.session.commit()
+                        with lock:
+                            issued.append(number)
+                        break
+                    except Exception as e:
+                        db.session.rollback()
+                        if attempt == 19:
+                            errors.append(e)
+                db.session.remove()
+
+    threads = [threading.Thread(target=terminal) for _ in range(terminals)]
+    t0 = time.perf_counter()
+    for t in threads:
+        t.start()
+    for t in threads:
+        t.join()
+    return issued, errors, time.perf_counter() - t0
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--terminals', type=int, default=8)
+    parser.add_argument('--numbers', type=int, default=200, help='numbers taken per terminal')
+    args = parser.parse_args()
+
+    from models import db, CompanyProfile, DocumentSequence
+    from routes.sequence_utils import next_document_number
+
+    with throwaway_app() as app:
+        with app.app_context():
+            seed_admin_and_profile()
+            db.session.add(DocumentSequence(name='bench-gap-free', block_size=20, gap_free=True))
+            db.session.add(DocumentSequence(name='bench-normal', block_size=20, gap_free=False))
+            db.session.commit()
+            engine = db.engine
+
+        def legacy():
+            profile = CompanyProfile.query.first()
+            number = profile.next_invoice_number
+            profile.next_invoice_number += 1
+            db.session.flush()
+            return number
+
+        print(f"{'method':>16} | {'numbers':>8} | {'ms':>9} | {'row writes':>10} | {'duplicates':>10} | {'errors':>6}")
+        for label, take in (('profile counter', legacy),
+                            ('normal series', lambda: next_document_number('bench-normal')),
+                            ('gap-free series', lambda: next_document_number('bench-gap-free'))):
+            with CounterRowWrites(engine, ('company_profile', 'document_sequence')) as writes:
+                issued, errors, elapsed = run_terminals(app, db, args.terminals, args.numbers, take)
+            duplicates = len(issued) - len(set(issued))
+            print(f"{label:>16} | {len(issued):>8} | {elapsed * 1000:>9.1f} | {writes.count:>10} | "
+                  f"{duplicates:>10} | {len(errors):>6}")
+
+
+if __name__ == '__main__':
+    main()
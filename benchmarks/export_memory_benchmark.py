@@ -0,0 +1,119 @@
+"""
+Streaming CSV Export Memory Benchmark
+
+Measures peak Python heap (tracemalloc) while downloading /export/journal-entries
+as the journal grows, next to the pre-streaming approach of query.all() into an
+io.StringIO. The streamed export should stay flat; the buffered one grows with
+the row count. Exits non-zero if the streamed peak grows by more than
+--max-growth between the smallest and largest journal.
+
+    python benchmarks/export_memory_benchmark.py --entries 2000 10000 40000
+"""
+import argparse
+import csv
+import io
+import json
+import random
+import sys
+import time
+import tracemalloc
+from datetime import datetime, timedelta
+
+from _common import throwaway_app, seed_admin_and_profile, logged_in_client
+
+CODES = ['101', '120', '201', '401', '501']
+
+
+def seed(db, Account, JournalEntry, entries):
+    seed_admin_and_profile()
+    db.session.bulk_insert_mappings(Account, [
+        {'code': code, 'name': f'Account {code}', 'type': 'Asset'} for code in CODES
+    ])
+    start = datetime.utcnow() - timedelta(days=365)
+    headers = []
+    for je_id in range(1, entries + 1):
+        amount = round(random.uniform(1, 1000), 2)
+        debit_acc, credit_acc = random.sample(CODES, 2)
+        headers.append({
+            'id': je_id,
+            'created_at': start + timedelta(minutes=random.randint(0, 365 * 24 * 60)),
+            'description': f'Benchmark #{je_id}',
+            'entries_json': json.dumps([
+                {'account_code': debit_acc, 'debit': amount, 'credit': 0},
+                {'account_code': credit_acc, 'debit': 0, 'credit': amount},
+            ]),
+        })
+    db.session.bulk_insert_mappings(JournalEntry, headers)
+    db.session.commit()
+
+
+def buffered_export(Account, JournalEntry):
+    """The pre-streaming export: every entry loaded, the whole file built in memory."""
+    accounts_map = {a.code: a.name for a in Account.query.all()}
+    journals = JournalEntry.query.order_by(JournalEntry.created_at.asc()).all()
+    si = io.StringIO()
+    writer = csv.writer(si)
+    writer.writerow(['Journal_ID', 'Date', 'Description', 'Account_Code', 'Account_Name', 'Debit', 'Credit'])
+    for je in journals:
+        je_date = je.created_at.strftime('%Y-%m-%d %H:%M')
+        for line in je.entries():
+            code = line.get('account_code')
+            writer.writerow([je.id, je_date, je.description, code, accounts_map.get(code, code),
+                             line.get('debit', 0), line.get('credit', 0)])
+    return len(si.getvalue().encode('utf-8'))
+
+
+def measure(fn):
+    """(result, peak heap in MB, elapsed seconds) for one call."""
+    tracemalloc.start()
+    t0 = time.perf_counter()
+    try:
+        result = fn()
+        _, peak = tracemalloc.get_traced_memory()
+    finally:
+        tracemalloc.stop()
+    return result, peak / 2 ** 20, time.perf_counter() - t0
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--entries', type=int, nargs='+', default=[2000, 10000, 40000])
+    parser.add_argument('--max-growth', type=float, default=1.5,
+                        help='allowed ratio of streamed peak memory, largest vs smallest journal')
+    parser.add_argument('--seed', type=int, default=42)
+    args = parser.parse_args()
+
+    print(f"{'entries':>8} | {'bytes':>10} | {'streamed MB':>11} | {'buffered MB':>11} | {'streamed s':>10}")
+    streamed_peaks = []
+    for entries in sorted(args.entries):
+        random.seed(args.seed)
+
+        from models import db, Account, JournalEntry
+
+        with throwaway_app() as app:
+            with app.app_context():
+                seed(db, Account, JournalEntry, entries)
+
+            client = logged_in_client(app)
+
+            def streamed():
+                response = client.get('/export/journal-entries', buffered=False)
+                size = sum(len(chunk) for chunk in response.response)
+                response.close()
+                return size
+
+            size, streamed_mb, streamed_s = measure(streamed)
+            with app.app_context():
+                _, buffered_mb, _ = measure(lambda: buffered_export(Account, JournalEntry))
+
+        streamed_peaks.append(streamed_mb)
+        print(f"{entries:>8} | {size:>10} | {streamed_mb:>11.2f} | {buffered_mb:>11.2f} | {streamed_s:>10.2f}")
+
+    growth = streamed_peaks[-1] / streamed_peaks[0]
+    print(f"streamed peak growth: {growth:.2f}x (limit {args.max_growth}x)")
+    if growth > args.max_growth:
+        sys.exit(1)
+
+
+if __name__ == '__main__':
+    main()
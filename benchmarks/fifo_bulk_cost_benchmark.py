@@ -0,0 +1,108 @@
+"""
+Bulk FIFO Cost Benchmark
+
+Seeds products with several open lots each and costs many carts without
+consuming anything two ways: loading each line's open lots and walking them
+in Python (as get_fifo_cost did), and one get_fifo_costs_by_cart window query
+for all of them. Checks both give the same COGS, then times /api/sale/quote
+for the same carts in one request.
+
+    python benchmarks/fifo_bulk_cost_benchmark.py --products 2000 --lots 8 --carts 500
+"""
+import argparse
+import random
+import time
+from datetime import datetime, timedelta
+
+from _common import throwaway_app, seed_admin_and_profile, logged_in_client
+
+
+def seed(db, products, lots):
+    from models import Product, InventoryLot
+    from routes.fifo_utils import rebuild_fifo_heads
+
+    seed_admin_and_profile()
+    db.session.execute(Product.__table__.insert(), [{
+        'sku': f'BEN-{i:05d}', 'name': f'Item {i}', 'sale_price': 100.0, 'cost_price': 50.0,
+        'quantity': lots * 20, 'is_active': True,
+    } for i in range(products)])
+    start = datetime.utcnow() - timedelta(days=90)
+    db.session.execute(InventoryLot.__table__.insert(), [{
+        'product_id': product_id, 'quantity_remaining': 20, 'unit_cost': round(random.uniform(10, 60), 4),
+        'is_opening_balance': False, 'created_at': start + timedelta(minutes=n),
+    } for n in range(lots) for product_id in range(1, products + 1)])
+    db.session.commit()
+    rebuild_fifo_heads()  # Bulk inserts skip the hook that keeps the heads
+
+
+def walk_cart(cart):
+    """Each line's COGS from its product's open lots, walked in Python one product at a time."""
+    from routes.fifo_utils import load_open_lots
+
+    drawn = {}
+    costs = []
+    for product_id, qty in cart:
+        skip = drawn.get(product_id, 0)
+        drawn[product_id] = skip + qty
+        total = 0.0
+        for lot in load_open_lots([product_id]).get(product_id, []):
+            available = lot.quantity_remaining - min(skip, lot.quantity_remaining)
+            skip -= lot.quantity_remaining - available
+            take = min(available, qty)
+            if take > 0:
+                total += round(take * lot.unit_cost, 2)
+                qty -= take
+            if qty <= 0:
+                break
+        costs.append(round(total, 2))
+    return costs
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--products', type=int, default=2000)
+    parser.add_argument('--lots', type=int, default=8, help='open lots of 20 units per product')
+    parser.add_argument('--carts', type=int, default=500)
+    parser.add_argument('--seed', type=int, default=42)
+    args = parser.parse_args()
+
+    random.seed(args.seed)
+
+    from models import db
+    from routes.fifo_utils import get_fifo_costs_by_cart
+
+    with throwaway_app(seed_essentials=True) as app:
+        with app.app_context():
+            seed(db, args.products, args.lots)
+
+            # Quantities large enough to cross lots; a product may repeat within a cart
+            carts = [[(random.randint(1, args.products), random.randint(1, 50))
+                      for _ in range(random.randint(1, 10))] for _ in range(args.carts)]
+            lines = sum(len(cart) for cart in carts)
+
+            t0 = time.perf_counter()
+            walked = [walk_cart(cart) for cart in carts]
+            walk_ms = (time.perf_counter() - t0) * 1000
+
+            t0 = time.perf_counter()
+            bulk = get_fifo_costs_by_cart(carts)
+            bulk_ms = (time.perf_counter() - t0) * 1000
+            assert bulk == walked
+
+        client = logged_in_client(app)
+        payload = {'carts': [{'items': [{'sku': f'BEN-{product_id - 1:05d}', 'qty': qty} for product_id, qty in cart],
+                              'is_vatable': True} for cart in carts]}
+        t0 = time.perf_counter()
+        quotes = client.post('/api/sale/quote', json=payload).get_json()['quotes']
+        quote_ms = (time.perf_counter() - t0) * 1000
+        assert [[line['cogs_estimate'] for line in quote['lines']] for quote in quotes] == bulk
+
+    print(f"{args.carts} carts, {lines} lines over {args.products} products x {args.lots} open lots")
+    print(f"{'costing':>28} | {'ms total':>10}")
+    print(f"{'per-line lot walk':>28} | {walk_ms:>10.1f}")
+    print(f"{'one window query':>28} | {bulk_ms:>10.1f}")
+    print(f"{'/api/sale/quote, all carts':>28} | {quote_ms:>10.1f}")
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,113 @@
+"""
+FIFO Head Lot Benchmark
+
+Seeds fast-moving products with thousands of depleted lots each and a few open
+ones, then times reading the lots a sale draws from: without the open-lot index
+(every lot of the product filtered on quantity_remaining > 0 and sorted by
+created_at), through the index, and from the head lots; then records sales
+through /api/sale.
+
+    python benchmarks/fifo_head_benchmark.py --products 50 --depleted 5000 --open 5
+"""
+import argparse
+import random
+import time
+from datetime import datetime, timedelta
+
+from _common import throwaway_app, seed_admin_and_profile, logged_in_client
+
+
+def seed(db, products, depleted, open_lots):
+    from models import Product, InventoryLot
+    from routes.fifo_utils import rebuild_fifo_heads
+
+    seed_admin_and_profile()
+    db.session.execute(Product.__table__.insert(), [{
+        'sku': f'BEN-{i:05d}', 'name': f'Item {i}', 'sale_price': 100.0, 'cost_price': 50.0,
+        'quantity': open_lots * 1000, 'is_active': True,
+    } for i in range(products)])
+    start = datetime.utcnow() - timedelta(days=365)
+    rows = []
+    # Interleave products so each product's lots are spread over the table, as they are in practice
+    for n in range(depleted + open_lots):
+        for product_id in range(1, products + 1):
+            rows.append({
+                'product_id': product_id, 'quantity_remaining': 0 if n < depleted else 1000,
+                'unit_cost': round(random.uniform(10, 60), 2), 'is_opening_balance': False,
+                'created_at': start + timedelta(minutes=n),
+            })
+    db.session.execute(InventoryLot.__table__.insert(), rows)
+    db.session.commit()
+    rebuild_fifo_heads()  # Bulk inserts skip the hook that keeps the heads
+
+
+def timed_ms(fn, args):
+    t0 = time.perf_counter()
+    for arg in args:
+        fn(arg)
+    return (time.perf_counter() - t0) * 1000 / len(args)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--products', type=int, default=50)
+    parser.add_argument('--depleted', type=int, default=5000, help='depleted lots per product')
+    parser.add_argument('--open', type=int, default=5, help='open lots per product')
+    parser.add_argument('--sales', type=int, default=200)
+    parser.add_argument('--seed', type=int, default=42)
+    args = parser.parse_args()
+
+    random.seed(args.seed)
+
+    from models import db, InventoryLot
+    from routes.fifo_utils import load_open_lots, load_fifo_lots
+
+    with throwaway_app(seed_essentials=True) as app:
+        with app.app_context():
+            seed(db, args.products, args.depleted, args.open)
+
+            picks = [random.randint(1, args.products) for _ in range(args.sales)]
+
+            def full_scan(product_id):
+                db.session.expunge_all()
+                return InventoryLot.query.filter(
+                    InventoryLot.product_id == product_id, InventoryLot.quantity_remaining > 0
+                ).order_by(InventoryLot.created_at.asc()).all()
+
+            def open_index(product_id):
+                db.session.expunge_all()
+                return load_open_lots([product_id])
+
+            def head(product_id):
+                db.session.expunge_all()
+                return load_fifo_lots({product_id: 2})
+
+            rows = [
+                ('open-lot index', timed_ms(open_index, picks)),
+                ('head lot', timed_ms(head, picks)),
+            ]
+            assert [lot.id for lot in full_scan(1)][:1] == [lot.id for lot in head(1)[1]]
+
+            # Without the open-lot index, as before it existed
+            db.session.execute(db.text('DROP INDEX ix_inventory_lot_open_fifo'))
+            rows.insert(0, ('no index: scan + sort', timed_ms(full_scan, picks)))
+            db.session.execute(db.text('CREATE INDEX ix_inventory_lot_open_fifo ON inventory_lot '
+                                       '(product_id, created_at, id) WHERE quantity_remaining > 0'))
+            db.session.commit()
+
+        client = logged_in_client(app)
+        t0 = time.perf_counter()
+        for product_id in picks:
+            response = client.post('/api/sale', json={'items': [{'sku': f'BEN-{product_id - 1:05d}', 'qty': 2}],
+                                                      'is_vatable': True})
+            assert response.status_code == 200, response.get_json()
+        rows.append(('record sale', (time.perf_counter() - t0) * 1000 / len(picks)))
+
+    print(f"{args.products} products x {args.depleted} depleted + {args.open} open lots")
+    print(f"{'read lots for a sale':>22} | {'ms':>8}")
+    for label, ms in rows:
+        print(f"{label:>22} | {ms:>8.3f}")
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,106 @@
+"""
+POS Group Commit Load Benchmark
+
+Several terminals (threads, each with its own logged-in client) post sales to
+/api/sale as fast as they can, first with every sale committing on its own,
+then with SALE_GROUP_COMMIT on. Reports sales/second, p50/p99 latency and
+failed requests (e.g. "database is locked") for each mode.
+
+    python benchmarks/group_commit_benchmark.py --terminals 16 --sales 50
+"""
+import argparse
+import random
+import threading
+import time
+
+from _common import throwaway_app, seed_admin_and_profile, logged_in_client
+
+PRODUCTS = 100
+
+
+def seed(db, Product):
+    from routes.fifo_utils import create_inventory_lot
+
+    seed_admin_and_profile()
+    for i in range(PRODUCTS):
+        product = Product(sku=f'BEN-{i:05d}', name=f'Item {i}', sale_price=100.0, cost_price=50.0, quantity=100000)
+        db.session.add(product)
+        db.session.flush()
+        create_inventory_lot(product.id, 100000, round(random.uniform(30, 60), 2))
+    db.session.commit()
+
+
+def percentile(values, pct):
+    ordered = sorted(values)
+    return ordered[min(len(ordered) - 1, int(len(ordered) * pct / 100))]
+
+
+def run(group_commit, terminals, sales, seed_value):
+    random.seed(seed_value)
+
+    from models import db, Product, Sale
+
+    with throwaway_app(seed_essentials=True, SALE_GROUP_COMMIT=group_commit) as app:
+        with app.app_context():
+            seed(db, Product)
+
+        latencies, failures = [], []
+        lock = threading.Lock()
+        start = threading.Barrier(terminals + 1)
+
+        def terminal(n):
+            rng = random.Random(n)
+            client = logged_in_client(app)
+            carts = [[{'sku': f'BEN-{rng.randrange(PRODUCTS):05d}', 'qty': rng.randint(1, 3)}
+                      for _ in range(rng.randint(1, 4))] for _ in range(sales)]
+            start.wait()
+            for items in carts:
+                t0 = time.perf_counter()
+                response = client.post('/api/sale', json={'items': items, 'is_vatable': True})
+                elapsed = time.perf_counter() - t0
+                with lock:
+                    if response.status_code == 200:
+                        latencies.append(elapsed)
+                    else:
+                        failures.append((response.get_json(silent=True) or {}).get('error') or f'HTTP {response.status_code}')
+
+        threads = [threading.Thread(target=terminal, args=(n,)) for n in range(terminals)]
+        for t in threads:
+            t.start()
+        start.wait()
+        t0 = time.perf_counter()
+        for t in threads:
+            t.join()
+        wall = time.perf_counter() - t0
+
+        with app.app_context():
+            recorded = Sale.query.count()
+
+    assert recorded == len(latencies), (recorded, len(latencies))
+    return {
+        'sales/s': len(latencies) / wall,
+        'p50 ms': percentile(latencies, 50) * 1000 if latencies else 0.0,
+        'p99 ms': percentile(latencies, 99) * 1000 if latencies else 0.0,
+        'failed': len(failures),
+        'errors': sorted(set(failures)),
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--terminals', type=int, default=16)
+    parser.add_argument('--sales', type=int, default=50, help='sales per terminal')
+    parser.add_argument('--seed', type=int, default=42)
+    args = parser.parse_args()
+
+    print(f"{'group commit':>12} | {'sales/s':>8} | {'p50 ms':>8} | {'p99 ms':>8} | {'failed':>6}")
+    for group_commit in (False, True):
+        result = run(group_commit, args.terminals, args.sales, args.seed)
+        print(f"{'on' if group_commit else 'off':>12} | {result['sales/s']:>8.1f} | {result['p50 ms']:>8.1f} | "
+              f"{result['p99 ms']:>8.1f} | {result['failed']:>6}")
+        for error in result['errors']:
+            print(f"{'':>12}   error: {error}")
+
+
+if __name__ == '__main__':
+    main()
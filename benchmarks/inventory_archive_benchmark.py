@@ -0,0 +1,134 @@
+"""
+Inventory Archive Benchmark
+
+Seeds a catalog with years of depleted lots, each with the consumption records
+that emptied it, and a few open lots per product, then times the reads that
+go through inventory_lot and inventory_transaction (reconcile_inventory_lots
+per product, the grouped reconcile_inventory and /api/sale) before and after
+archive_inventory_history moves the depleted history out. Finally voids some
+of the old sales whose lots were archived and checks their stock comes back.
+
+    python benchmarks/inventory_archive_benchmark.py --products 2000 --depleted 100 --sales 200
+"""
+import argparse
+import random
+import time
+from datetime import datetime, timedelta
+
+from _common import throwaway_app, seed_admin_and_profile, logged_in_client
+from config import Config
+
+
+def seed(db, products, depleted, open_lots):
+    from models import Product, Sale, InventoryLot, InventoryTransaction
+
+    seed_admin_and_profile()
+    db.session.execute(Product.__table__.insert(), [{
+        'sku': f'BEN-{i:06d}', 'name': f'Item {i}', 'sale_price': 100.0, 'cost_price': 50.0,
+        'quantity': open_lots * 10, 'is_active': True,
+    } for i in range(products)])
+    # Each depleted lot was emptied by a sale of its own, years ago
+    old = datetime.utcnow() - timedelta(days=3 * 365)
+    lots, transactions, sales = [], [], []
+    lot_id = 0
+    for i in range(products):
+        for n in range(depleted + open_lots):
+            lot_id += 1
+            created = old + timedelta(minutes=n) if n < depleted else datetime.utcnow()
+            quantity, unit_cost = random.randint(1, 10), round(random.uniform(10, 60), 2)
+            lots.append({'id': lot_id, 'product_id': i + 1, 'quantity_remaining': 0 if n < depleted else 10,
+                         'unit_cost': unit_cost, 'is_opening_balance': False, 'created_at': created})
+            if n < depleted:
+                sales.append({'id': len(sales) + 1, 'document_number': f'OLD-{len(sales) + 1:08d}',
+                              'total': 0.0, 'vat': 0.0, 'is_vatable': True, 'status': 'paid', 'created_at': created})
+                transactions.append({'lot_id': lot_id, 'quantity_used': quantity, 'unit_cost': unit_cost,
+                                     'total_cost': round(quantity * unit_cost, 2), 'sale_id': len(sales),
+                                     'created_at': created})
+    db.session.execute(Sale.__table__.insert(), sales)
+    db.session.execute(InventoryLot.__table__.insert(), lots)
+    db.session.execute(InventoryTransaction.__table__.insert(), transactions)
+    db.session.commit()
+
+
+def time_reads(app, client, db, products, sample, sales):
+    from models import InventoryLot, InventoryTransaction
+    from routes.fifo_utils import reconcile_inventory, reconcile_inventory_lots, rebuild_fifo_heads
+
+    with app.app_context():
+        rebuild_fifo_heads()
+        db.session.commit()
+        rows = InventoryLot.query.count(), InventoryTransaction.query.count()
+        t0 = time.perf_counter()
+        for product_id in random.sample(range(1, products + 1), sample):
+            assert reconcile_inventory_lots(product_id)['is_balanced']
+        per_product_ms = (time.perf_counter() - t0) * 1000 / sample
+        t0 = time.perf_counter()
+        assert not reconcile_inventory()['discrepancies']
+        grouped_ms = (time.perf_counter() - t0) * 1000
+        db.session.remove()
+
+    t0 = time.perf_counter()
+    for _ in range(sales):
+        response = client.post('/api/sale', json={
+            'items': [{'sku': f'BEN-{random.randrange(products):06d}', 'qty': 1}], 'is_vatable': True
+        })
+        assert response.status_code == 200, response.get_json()
+    sale_ms = (time.perf_counter() - t0) * 1000 / sales
+    return rows, per_product_ms, grouped_ms, sale_ms
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--products', type=int, default=2000)
+    parser.add_argument('--depleted', type=int, default=100, help='depleted lots per product')
+    parser.add_argument('--open-lots', type=int, default=3, help='open lots per product')
+    parser.add_argument('--sample', type=int, default=500, help='products reconciled one at a time')
+    parser.add_argument('--sales', type=int, default=200)
+    parser.add_argument('--voids', type=int, default=50, help='archived sales voided')
+    parser.add_argument('--seed', type=int, default=42)
+    args = parser.parse_args()
+
+    random.seed(args.seed)
+
+    from models import db, InventoryLot, InventoryLotArchive, InventoryTransactionArchive
+    from routes.archive_utils import archive_inventory_history
+
+    with throwaway_app(seed_essentials=True) as app:
+        with app.app_context():
+            seed(db, args.products, args.depleted, args.open_lots)
+
+        client = logged_in_client(app)
+        sample = min(args.sample, args.products)
+        before = time_reads(app, client, db, args.products, sample, args.sales)
+
+        with app.app_context():
+            t0 = time.perf_counter()
+            moved = archive_inventory_history(datetime.utcnow() - timedelta(days=Config.INVENTORY_ARCHIVE_DAYS))
+            archive_ms = (time.perf_counter() - t0) * 1000
+        after = time_reads(app, client, db, args.products, sample, args.sales)
+
+        # Voiding an old sale has to find the lot it emptied in the archive
+        voided = random.sample(range(1, moved[1] + 1), min(args.voids, moved[1]))
+        with app.app_context():
+            on_hand = db.session.query(db.func.sum(InventoryLot.quantity_remaining)).scalar()
+            consumed = db.session.query(db.func.sum(InventoryTransactionArchive.quantity_used)).filter(
+                InventoryTransactionArchive.sale_id.in_(voided)).scalar()
+            archived = InventoryLotArchive.query.count()
+        t0 = time.perf_counter()
+        for sale_id in voided:
+            assert client.post(f'/void/sale/{sale_id}', data={'void_reason': 'benchmark'}).status_code == 302
+        void_ms = (time.perf_counter() - t0) * 1000 / len(voided)
+        with app.app_context():
+            assert InventoryLotArchive.query.count() == archived - len(voided)
+            assert db.session.query(db.func.sum(InventoryLot.quantity_remaining)).scalar() == on_hand + consumed
+
+    print(f"{args.products} products x {args.depleted} depleted lots, {args.open_lots} open; "
+          f"archived {moved[0]} lots and {moved[1]} records in {archive_ms:.0f} ms")
+    print(f"{'':>8} | {'lots':>9} | {'records':>9} | {'ms/product':>10} | {'grouped ms':>10} | {'ms/sale':>8}")
+    for label, ((lots, records), per_product_ms, grouped_ms, sale_ms) in (('before', before), ('after', after)):
+        print(f"{label:>8} | {lots:>9} | {records:>9} | {per_product_ms:>10.2f} | {grouped_ms:>10.1f} | {sale_ms:>8.2f}")
+    print(f"void of a sale whose lot was archived: {void_ms:.2f} ms")
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,105 @@
+"""
+Inventory Reconciliation Benchmark
+
+Seeds a catalog with several lots per product and a few quantities knocked out
+of line, then reconciles the whole catalog three ways: reconcile_inventory_lots
+once per product (timed on a sample and projected, as it reads every lot of the
+product each time), reconcile_inventory in one grouped pass, and the same pass
+in product-id chunks across a process pool. Checks they find the same products.
+
+    python benchmarks/inventory_reconcile_benchmark.py --products 20000 --lots 5 --workers 4
+"""
+import argparse
+import random
+import time
+from concurrent.futures import ProcessPoolExecutor
+from datetime import datetime, timedelta
+
+from _common import throwaway_app
+from config import Config
+
+
+def seed(db, products, lots, broken):
+    from models import Product, InventoryLot
+
+    start = datetime.utcnow() - timedelta(days=90)
+    quantities = [[random.randint(0, 20) for _ in range(lots)] for _ in range(products)]
+    db.session.execute(Product.__table__.insert(), [{
+        'sku': f'BEN-{i:06d}', 'name': f'Item {i}', 'sale_price': 100.0, 'cost_price': 50.0,
+        'quantity': sum(quantities[i]), 'is_active': True,
+    } for i in range(products)])
+    db.session.execute(InventoryLot.__table__.insert(), [{
+        'product_id': i + 1, 'quantity_remaining': quantity, 'unit_cost': round(random.uniform(10, 60), 2),
+        'is_opening_balance': False, 'created_at': start + timedelta(minutes=n),
+    } for i in range(products) for n, quantity in enumerate(quantities[i])])
+    off = random.sample(range(1, products + 1), broken)
+    for product_id in off:
+        db.session.get(Product, product_id).quantity += random.choice([-1, 1]) * random.randint(1, 5) + 30
+    db.session.commit()
+    return sorted(off)
+
+
+def init_worker(db_uri):
+    global worker_app
+    Config.SQLALCHEMY_DATABASE_URI = db_uri
+    from app import create_app
+    worker_app = create_app()
+
+
+def reconcile_chunk(bounds):
+    from routes.fifo_utils import reconcile_inventory
+    with worker_app.app_context():
+        return reconcile_inventory(*bounds)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--products', type=int, default=20000)
+    parser.add_argument('--lots', type=int, default=5, help='lots per product')
+    parser.add_argument('--broken', type=int, default=25, help='products with a wrong quantity')
+    parser.add_argument('--workers', type=int, default=4)
+    parser.add_argument('--sample', type=int, default=1000, help='products checked one at a time')
+    parser.add_argument('--seed', type=int, default=42)
+    args = parser.parse_args()
+
+    random.seed(args.seed)
+
+    from models import db
+    from routes.fifo_utils import reconcile_inventory, reconcile_inventory_lots
+
+    with throwaway_app() as app:
+        with app.app_context():
+            off = seed(db, args.products, args.lots, args.broken)
+            db.session.remove()
+
+            sample = min(args.sample, args.products)
+            t0 = time.perf_counter()
+            per_product = [product_id for product_id in range(1, sample + 1)
+                           if not reconcile_inventory_lots(product_id)['is_balanced']]
+            per_product_ms = (time.perf_counter() - t0) * 1000 * args.products / sample
+
+            t0 = time.perf_counter()
+            grouped = [row['product_id'] for row in reconcile_inventory()['discrepancies']]
+            grouped_ms = (time.perf_counter() - t0) * 1000
+            db.session.remove()
+
+        chunk = -(-args.products // args.workers)
+        chunks = [(start, start + chunk - 1) for start in range(1, args.products + 1, chunk)]
+        t0 = time.perf_counter()
+        with ProcessPoolExecutor(max_workers=args.workers, initializer=init_worker,
+                                 initargs=(Config.SQLALCHEMY_DATABASE_URI,)) as pool:
+            pooled = [row['product_id'] for result in pool.map(reconcile_chunk, chunks)
+                      for row in result['discrepancies']]
+        pooled_ms = (time.perf_counter() - t0) * 1000
+        assert grouped == pooled == off
+        assert per_product == [product_id for product_id in off if product_id <= sample]
+
+    print(f"{args.products} products x {args.lots} lots, {len(off)} out of line")
+    print(f"{'reconciliation':>32} | {'ms':>10}")
+    print(f"{'per product (projected)':>32} | {per_product_ms:>10.1f}")
+    print(f"{'one grouped pass':>32} | {grouped_ms:>10.1f}")
+    print(f"{f'{args.workers} chunks, process pool':>32} | {pooled_ms:>10.1f}")
+
+
+if __name__ == '__main__':
+    main()
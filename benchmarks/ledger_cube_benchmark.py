@@ -0,0 +1,94 @@
+"""
+Ledger Cube Benchmark
+
+Compares aggregate_account_balances on the SQL GROUP BY path against the
+in-memory ledger cube for random (start_date, end_date) ranges.
+
+    python benchmarks/ledger_cube_benchmark.py --entries 50000 --queries 200
+"""
+import argparse
+import random
+import time
+from datetime import datetime, timedelta
+
+from _common import throwaway_app
+
+
+def seed_journal(db, JournalEntry, JournalLine, entries, days, accounts):
+    """Bulk insert random two-line journal entries spread over `days` days."""
+    start = datetime.utcnow() - timedelta(days=days)
+    headers, lines = [], []
+    for je_id in range(1, entries + 1):
+        posted_at = start + timedelta(seconds=random.randint(0, days * 86400))
+        amount = round(random.uniform(1, 5000), 2)
+        debit_acc, credit_acc = random.sample(accounts, 2)
+        headers.append({'id': je_id, 'created_at': posted_at, 'description': f'Benchmark #{je_id}', 'entries_json': '[]'})
+        lines.append({'journal_entry_id': je_id, 'account_code': debit_acc, 'debit': amount, 'credit': 0.0, 'posted_at': posted_at})
+        lines.append({'journal_entry_id': je_id, 'account_code': credit_acc, 'debit': 0.0, 'credit': amount, 'posted_at': posted_at})
+    db.session.bulk_insert_mappings(JournalEntry, headers)
+    db.session.bulk_insert_mappings(JournalLine, lines)
+    db.session.commit()
+    return start
+
+
+def random_ranges(origin, days, count):
+    ranges = []
+    for _ in range(count):
+        a, b = sorted(random.sample(range(days + 1), 2))
+        start = origin.replace(hour=0, minute=0, second=0, microsecond=0) + timedelta(days=a)
+        ranges.append((start if random.random() < 0.8 else None, start + timedelta(days=b - a)))
+    return ranges
+
+
+def timed(fn, ranges):
+    results = []
+    t0 = time.perf_counter()
+    for start, end in ranges:
+        results.append(fn(start, end))
+    return time.perf_counter() - t0, results
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--entries', type=int, default=20000)
+    parser.add_argument('--days', type=int, default=3 * 365)
+    parser.add_argument('--accounts', type=int, default=40)
+    parser.add_argument('--queries', type=int, default=100)
+    parser.add_argument('--seed', type=int, default=42)
+    args = parser.parse_args()
+    random.seed(args.seed)
+
+    from models import db, JournalEntry, JournalLine
+    from routes.statements import aggregate_account_balances
+
+    # Measure the aggregation paths themselves, not report cache hits
+    with throwaway_app(REPORT_CACHE_SIZE=0) as app:
+        with app.app_context():
+            accounts = [str(100 + i) for i in range(args.accounts)]
+            origin = seed_journal(db, JournalEntry, JournalLine, args.entries, args.days, accounts)
+            ranges = random_ranges(origin, args.days, args.queries)
+
+            app.config['LEDGER_CUBE_ENABLED'] = False
+            sql_time, sql_results = timed(aggregate_account_balances, ranges)
+
+            app.config['LEDGER_CUBE_ENABLED'] = True
+            t0 = time.perf_counter()
+            app.extensions.pop('ledger_cube', None)
+            aggregate_account_balances(None, None)
+            build_time = time.perf_counter() - t0
+            cube_time, cube_results = timed(aggregate_account_balances, ranges)
+
+            mismatches = 0
+            for sql_res, cube_res in zip(sql_results, cube_results):
+                if set(sql_res) != set(cube_res) or any(abs(sql_res[k] - cube_res[k]) > 0.005 for k in sql_res):
+                    mismatches += 1
+
+        print(f"Journal entries: {args.entries:,} over {args.days} days, {args.accounts} accounts")
+        print(f"SQL GROUP BY : {sql_time / args.queries * 1000:8.2f} ms/query")
+        print(f"Ledger cube  : {cube_time / args.queries * 1000:8.2f} ms/query (build {build_time * 1000:.0f} ms)")
+        print(f"Speed-up     : {sql_time / cube_time:8.1f}x")
+        print(f"Mismatched ranges: {mismatches}")
+
+
+if __name__ == '__main__':
+    main()
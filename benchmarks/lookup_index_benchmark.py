@@ -0,0 +1,104 @@
+"""
+SKU / Barcode Lookup Benchmark
+
+Scans random SKUs and consignment barcodes the old way (ilike over the
+product and consignment tables), as an exact database query, and through
+the in-process LookupIndex; then times prefix typeahead against ilike
+search. Reports microseconds per lookup.
+
+    python benchmarks/lookup_index_benchmark.py --products 30000 --consignment 5000
+"""
+import argparse
+import random
+import time
+
+from _common import throwaway_app
+
+WORDS = ['Rice', 'Soap', 'Coffee', 'Sardines', 'Noodles', 'Shampoo', 'Candle', 'Battery', 'Vinegar', 'Sugar']
+
+
+def seed(db, products, consignment):
+    from models import Product, ConsignmentSupplier, ConsignmentReceived, ConsignmentItem
+    from routes.catalog_utils import check_consignment_availability
+
+    db.session.execute(Product.__table__.insert(), [{
+        'sku': f'BEN-{i:06d}', 'name': f'{random.choice(WORDS)} {i}', 'sale_price': 100.0,
+        'cost_price': 50.0, 'quantity': 100, 'is_active': True,
+    } for i in range(products)])
+    supplier = ConsignmentSupplier(name='Benchmark Supplier')
+    db.session.add(supplier)
+    db.session.flush()
+    receipt = ConsignmentReceived(supplier_id=supplier.id, receipt_number='CON-BENCH')
+    db.session.add(receipt)
+    db.session.flush()
+    db.session.execute(ConsignmentItem.__table__.insert(), [{
+        'consignment_id': receipt.id, 'sku': f'CSG-{i:06d}', 'product_name': f'{random.choice(WORDS)} consigned {i}',
+        'barcode': f'48{i:011d}', 'quantity_received': 10, 'quantity_sold': 0,
+        'quantity_returned': 0, 'quantity_damaged': 0, 'retail_price': 80.0, 'is_active': True,
+    } for i in range(consignment)])
+    db.session.commit()
+    check_consignment_availability(repair=True)  # Bulk inserts skip the ORM hook that stores availability
+
+
+def timed_us(fn, codes):
+    t0 = time.perf_counter()
+    for code in codes:
+        fn(code)
+    return (time.perf_counter() - t0) * 1e6 / len(codes)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--products', type=int, default=30000)
+    parser.add_argument('--consignment', type=int, default=5000)
+    parser.add_argument('--scans', type=int, default=500)
+    parser.add_argument('--seed', type=int, default=42)
+    args = parser.parse_args()
+
+    random.seed(args.seed)
+
+    from models import db, Product, ConsignmentItem
+    from routes.lookup_index import get_lookup_index, lookup_code
+
+    with throwaway_app() as app:
+        with app.test_request_context():
+            seed(db, args.products, args.consignment)
+
+            codes = [f'BEN-{random.randrange(args.products):06d}' if random.random() < 0.7
+                     else f'48{random.randrange(args.consignment):011d}' for _ in range(args.scans)]
+            prefixes = [f'{random.choice(WORDS)[:random.randint(2, 4)]}' for _ in range(args.scans // 10)]
+
+            def ilike_scan(code):
+                return Product.query.filter(Product.sku.ilike(f'%{code}%') | Product.name.ilike(f'%{code}%')).first() \
+                    or ConsignmentItem.query.filter(ConsignmentItem.barcode.ilike(f'%{code}%')).first()
+
+            def exact_scan(code):
+                return Product.query.filter_by(sku=code).first() \
+                    or ConsignmentItem.query.filter_by(barcode=code).first()
+
+            def ilike_search(prefix):
+                return Product.query.filter(Product.sku.ilike(f'%{prefix}%') | Product.name.ilike(f'%{prefix}%')) \
+                    .order_by(Product.name.asc()).limit(20).all()
+
+            t0 = time.perf_counter()
+            index = get_lookup_index()
+            lookup_code(codes[0])
+            build_ms = (time.perf_counter() - t0) * 1000
+
+            rows = [
+                ('scan: ilike', timed_us(ilike_scan, codes)),
+                ('scan: exact query', timed_us(exact_scan, codes)),
+                ('scan: index', timed_us(lookup_code, codes)),
+                ('typeahead: ilike', timed_us(ilike_search, prefixes)),
+                ('typeahead: index', timed_us(index.typeahead, prefixes)),
+            ]
+            assert all(lookup_code(code) for code in codes)
+
+    print(f"index built in {build_ms:.0f} ms")
+    print(f"{'lookup':>18} | {'us each':>10}")
+    for label, us in rows:
+        print(f"{label:>18} | {us:>10.1f}")
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,98 @@
+"""
+POS Catalog Paging Benchmark
+
+Times one POS catalog page the old way (load every active product and
+consignment item, filter and combine in Python, slice 12) against
+catalog_page() and catalog_after(), which do the UNION ALL, ordering and
+paging in SQL. Reports milliseconds per page for the first and a deep page.
+
+    python benchmarks/pos_catalog_benchmark.py --products 30000 --consignment 5000
+"""
+import argparse
+import random
+import time
+
+from _common import throwaway_app
+
+WORDS = ['Rice', 'Soap', 'Coffee', 'Sardines', 'Noodles', 'Shampoo', 'Candle', 'Battery', 'Vinegar', 'Sugar']
+
+
+def seed(db, products, consignment):
+    from models import Product, ConsignmentSupplier, ConsignmentReceived, ConsignmentItem
+    from routes.catalog_utils import check_consignment_availability
+
+    db.session.execute(Product.__table__.insert(), [{
+        'sku': f'BEN-{i:06d}', 'name': f'{random.choice(WORDS)} {i}', 'sale_price': 100.0,
+        'cost_price': 50.0, 'quantity': random.randint(0, 500), 'is_active': i % 20 != 0,
+    } for i in range(products)])
+    supplier = ConsignmentSupplier(name='Benchmark Supplier')
+    db.session.add(supplier)
+    db.session.flush()
+    receipt = ConsignmentReceived(supplier_id=supplier.id, receipt_number='CON-BENCH')
+    db.session.add(receipt)
+    db.session.flush()
+    db.session.execute(ConsignmentItem.__table__.insert(), [{
+        'consignment_id': receipt.id, 'sku': f'CSG-{i:06d}', 'product_name': f'{random.choice(WORDS)} consigned {i}',
+        'barcode': f'48{i:011d}', 'quantity_received': 10, 'quantity_sold': random.randint(0, 10),
+        'quantity_returned': 0, 'quantity_damaged': 0, 'retail_price': 80.0, 'is_active': True,
+    } for i in range(consignment)])
+    db.session.commit()
+    check_consignment_availability(repair=True)  # Bulk inserts skip the ORM hook that stores availability
+
+
+def python_page(Product, ConsignmentItem, search, page, per_page=12):
+    """The catalog as core.pos built it before paging moved into SQL."""
+    product_query = Product.query.filter_by(is_active=True)
+    consignment_query = ConsignmentItem.query.filter_by(is_active=True)
+    if search:
+        product_query = product_query.filter(Product.name.ilike(f"%{search}%") | Product.sku.ilike(f"%{search}%"))
+        consignment_query = consignment_query.filter(
+            ConsignmentItem.product_name.ilike(f"%{search}%") | ConsignmentItem.sku.ilike(f"%{search}%")
+            | ConsignmentItem.barcode.ilike(f"%{search}%"))
+    combined = [{'id': p.id, 'name': p.name} for p in product_query.order_by(Product.name.asc()).all()]
+    combined += [{'id': c.id, 'name': c.product_name} for c in consignment_query.all() if c.quantity_available > 0]
+    return combined[(page - 1) * per_page:page * per_page]
+
+
+def timed(fn, repeat):
+    t0 = time.perf_counter()
+    for _ in range(repeat):
+        fn()
+    return (time.perf_counter() - t0) * 1000 / repeat
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--products', type=int, default=30000)
+    parser.add_argument('--consignment', type=int, default=5000)
+    parser.add_argument('--repeat', type=int, default=5)
+    parser.add_argument('--seed', type=int, default=42)
+    args = parser.parse_args()
+
+    random.seed(args.seed)
+
+    from models import db, Product, ConsignmentItem
+    from routes.catalog_utils import catalog_page, catalog_after
+
+    with throwaway_app() as app:
+        with app.app_context():
+            seed(db, args.products, args.consignment)
+
+            deep = (args.products + args.consignment) // 12 - 1
+            cursor = None
+            for _ in range(deep - 1):
+                _, cursor = catalog_after('', cursor)
+
+            print(f"{'page':>18} | {'python ms':>9} | {'sql page ms':>11} | {'keyset ms':>9}")
+            for label, search, page, after in (('first', '', 1, None),
+                                               (f'deep ({deep})', '', deep, cursor),
+                                               ("search 'soap'", 'soap', 1, None)):
+                python_ms = timed(lambda: python_page(Product, ConsignmentItem, search, page), args.repeat)
+                db.session.expunge_all()
+                sql_ms = timed(lambda: catalog_page(search, page), args.repeat)
+                keyset_ms = timed(lambda: catalog_after(search, after), args.repeat)
+                print(f"{label:>18} | {python_ms:>9.1f} | {sql_ms:>11.1f} | {keyset_ms:>9.1f}")
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,82 @@
+"""
+Journal Posting Benchmark
+
+Posts the same batch of two-line journal entries three ways and reports SQL
+statements and wall time for each:
+
+  per-entry   JournalEntry(...) + flush per entry, the pattern the routes used
+  post_journal  post_journal() for every entry, one flush at the end
+  post_many     post_many(), ordered INSERT ... RETURNING headers plus one executemany for lines
+
+    python benchmarks/posting_benchmark.py --entries 1000 5000
+"""
+import argparse
+import json
+import random
+import time
+
+from _common import QueryCounter, throwaway_app
+
+SYSTEM_ACCOUNTS = [('101', 'Cash', 'Asset'), ('401', 'Sales Revenue', 'Revenue'), ('501', 'COGS', 'Expense')]
+
+
+def make_entries(n):
+    entries = []
+    for i in range(n):
+        amount = round(random.uniform(1, 1000), 2)
+        debit_acc = random.choice(['Cash', 'COGS'])
+        entries.append((
+            [{'system_account': debit_acc, 'debit': amount, 'credit': 0},
+             {'system_account': 'Sales Revenue', 'debit': 0, 'credit': amount}],
+            f'Benchmark #{i}'
+        ))
+    return entries
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--entries', type=int, nargs='+', default=[1000, 5000])
+    parser.add_argument('--seed', type=int, default=42)
+    args = parser.parse_args()
+
+    print(f"{'entries':>8} | {'method':>12} | {'queries':>8} | {'ms':>9}")
+    for n in args.entries:
+        random.seed(args.seed)
+        entries = make_entries(n)
+
+        from models import db, Account, JournalEntry
+        from routes.utils import get_system_account_code
+        from routes.posting_utils import post_journal, post_many
+
+        with throwaway_app() as app:
+            with app.app_context():
+                db.session.add_all([Account(code=code, name=name, type=typ) for code, name, typ in SYSTEM_ACCOUNTS])
+                db.session.commit()
+                engine = db.engine
+
+                def per_entry():
+                    for lines, description in entries:
+                        resolved = [{'account_code': get_system_account_code(line['system_account']),
+                                     'debit': line['debit'], 'credit': line['credit']} for line in lines]
+                        db.session.add(JournalEntry(description=description, entries_json=json.dumps(resolved)))
+                        db.session.flush()
+
+                def one_flush():
+                    for lines, description in entries:
+                        post_journal(lines, description)
+                    db.session.flush()
+
+                def batched():
+                    post_many(entries)
+
+                for label, fn in (('per-entry', per_entry), ('post_journal', one_flush), ('post_many', batched)):
+                    t0 = time.perf_counter()
+                    with QueryCounter(engine) as counter:
+                        fn()
+                        db.session.commit()
+                    elapsed = (time.perf_counter() - t0) * 1000
+                    print(f"{n:>8} | {label:>12} | {counter.count:>8} | {elapsed:>9.1f}")
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,100 @@
+"""
+POS Pricing Benchmark
+
+Times the pricing kernel on its own (price_carts over random carts with
+every discount type), then /api/sale/quote for one cart per request and
+for many carts per request, next to /api/sale recording the same carts.
+
+    python benchmarks/pricing_benchmark.py --carts 10000 --quotes 200
+"""
+import argparse
+import random
+import time
+
+from _common import throwaway_app, seed_admin_and_profile, logged_in_client
+
+PRODUCTS = 100
+DISCOUNTS = [None, {'type': 'percent', 'input_value': 10}, {'type': 'fixed', 'input_value': 25},
+             {'type': 'sc_pwd', 'input_value': 20}]
+
+
+def seed(db, Product):
+    from routes.fifo_utils import create_inventory_lot
+
+    seed_admin_and_profile()
+    for i in range(PRODUCTS):
+        product = Product(sku=f'BEN-{i:05d}', name=f'Item {i}', sale_price=round(random.uniform(20, 200), 2),
+                          cost_price=50.0, quantity=3000)
+        db.session.add(product)
+        db.session.flush()
+        for _ in range(3):
+            create_inventory_lot(product.id, 1000, round(random.uniform(10, 60), 2))
+    db.session.commit()
+
+
+def random_cart(rng):
+    cart = {'items': [{'sku': f'BEN-{rng.randrange(PRODUCTS):05d}', 'qty': rng.randint(1, 3)}
+                      for _ in range(rng.randint(1, 8))],
+            'is_vatable': rng.random() < 0.8}
+    discount = rng.choice(DISCOUNTS)
+    if discount:
+        cart['discount'] = discount
+    return cart
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--carts', type=int, default=10000, help='carts for the kernel-only run')
+    parser.add_argument('--quotes', type=int, default=200, help='carts for the HTTP runs')
+    parser.add_argument('--seed', type=int, default=42)
+    args = parser.parse_args()
+
+    from routes.pricing_utils import price_carts
+
+    rng = random.Random(args.seed)
+    kernel_carts = [{
+        'lines': [(round(rng.uniform(20, 200), 2), rng.randint(1, 3), rng.random() < 0.2)
+                  for _ in range(rng.randint(1, 8))],
+        'is_vatable': rng.random() < 0.8,
+        'discount_type': rng.choice([None, 'percent', 'fixed', 'sc_pwd']),
+        'discount_input': rng.choice([10, 20, 25]),
+    } for _ in range(args.carts)]
+    t0 = time.perf_counter()
+    price_carts(kernel_carts)
+    kernel_us = (time.perf_counter() - t0) * 1e6 / args.carts
+
+    random.seed(args.seed)
+
+    from models import db, Product
+
+    with throwaway_app(seed_essentials=True) as app:
+        with app.app_context():
+            seed(db, Product)
+
+        client = logged_in_client(app)
+        carts = [random_cart(rng) for _ in range(args.quotes)]
+
+        t0 = time.perf_counter()
+        single = [client.post('/api/sale/quote', json=cart).get_json() for cart in carts]
+        single_ms = (time.perf_counter() - t0) * 1000 / len(carts)
+
+        t0 = time.perf_counter()
+        batched = client.post('/api/sale/quote', json={'carts': carts}).get_json()['quotes']
+        batched_ms = (time.perf_counter() - t0) * 1000 / len(carts)
+        assert batched == single
+
+        t0 = time.perf_counter()
+        for cart in carts:
+            response = client.post('/api/sale', json=cart)
+            assert response.status_code == 200, response.get_json()
+        sale_ms = (time.perf_counter() - t0) * 1000 / len(carts)
+
+    print(f"{'path':>24} | {'per cart':>10}")
+    print(f"{'kernel (price_carts)':>24} | {kernel_us:>7.1f} us")
+    print(f"{'quote, 1 cart/request':>24} | {single_ms:>7.2f} ms")
+    print(f"{f'quote, {len(carts)} carts/request':>24} | {batched_ms:>7.2f} ms")
+    print(f"{'record sale':>24} | {sale_ms:>7.2f} ms")
+
+
+if __name__ == '__main__':
+    main()
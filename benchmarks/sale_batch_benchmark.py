@@ -0,0 +1,85 @@
+"""
+Offline Sale Batch Benchmark
+
+Pushes the same queue of sales the way a reconnecting terminal would: once as
+N sequential /api/sale calls, once as a single /api/sales/batch call. The batch
+is then replayed to show that nothing is posted twice.
+
+    python benchmarks/sale_batch_benchmark.py --sales 100 500
+"""
+import argparse
+import random
+import time
+
+from _common import throwaway_app, seed_admin_and_profile, logged_in_client
+
+PRODUCTS = 100
+LOTS_PER_PRODUCT = 3
+
+
+def seed(db, Product):
+    from routes.fifo_utils import create_inventory_lot
+
+    seed_admin_and_profile()
+    for i in range(PRODUCTS):
+        product = Product(sku=f'BEN-{i:05d}', name=f'Item {i}', sale_price=100.0, cost_price=50.0,
+                          quantity=LOTS_PER_PRODUCT * 1000)
+        db.session.add(product)
+        db.session.flush()
+        for _ in range(LOTS_PER_PRODUCT):
+            create_inventory_lot(product.id, 1000, round(random.uniform(30, 60), 2))
+    db.session.commit()
+
+
+def make_queue(n, prefix):
+    return [{
+        'idempotency_key': f'{prefix}-{i:06d}',
+        'items': [{'sku': f'BEN-{random.randrange(PRODUCTS):05d}', 'qty': random.randint(1, 3)}
+                  for _ in range(random.randint(1, 5))],
+        'is_vatable': True,
+    } for i in range(n)]
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--sales', type=int, nargs='+', default=[100, 500])
+    parser.add_argument('--seed', type=int, default=42)
+    args = parser.parse_args()
+
+    print(f"{'sales':>6} | {'sequential ms':>13} | {'batch ms':>9} | {'speedup':>7} | {'replay posted':>13}")
+    for n in args.sales:
+        random.seed(args.seed)
+
+        from models import db, Product, Sale
+
+        with throwaway_app(seed_essentials=True) as app:
+            with app.app_context():
+                seed(db, Product)
+
+            client = logged_in_client(app)
+
+            sequential = make_queue(n, 'seq')
+            t0 = time.perf_counter()
+            for sale in sequential:
+                response = client.post('/api/sale', json=sale)
+                assert response.status_code == 200, response.get_json()
+            sequential_ms = (time.perf_counter() - t0) * 1000
+
+            batch = make_queue(n, 'batch')
+            t0 = time.perf_counter()
+            response = client.post('/api/sales/batch', json={'sales': batch})
+            batch_ms = (time.perf_counter() - t0) * 1000
+            body = response.get_json()
+            assert body['recorded'] == n, {k: v for k, v in body.items() if k != 'results'}
+
+            with app.app_context():
+                before = Sale.query.count()
+            client.post('/api/sales/batch', json={'sales': batch})
+            with app.app_context():
+                replay_posted = Sale.query.count() - before
+
+        print(f"{n:>6} | {sequential_ms:>13.1f} | {batch_ms:>9.1f} | {sequential_ms / batch_ms:>6.1f}x | {replay_posted:>13}")
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,83 @@
+"""
+Statement Engine Query-Count Benchmark
+
+Counts the SQL statements needed to build the trial balance, general ledger
+summary, income statement and balance sheet as the chart of accounts grows.
+The pre-engine routes looked up each account with Account.query.filter_by(code=...),
+which is reproduced here as the "per-account lookups" column for comparison.
+
+    python benchmarks/statement_queries_benchmark.py --accounts 10 50 200
+"""
+import argparse
+import random
+import time
+from datetime import datetime, timedelta
+
+from _common import QueryCounter, throwaway_app
+
+ACCOUNT_TYPES = ['Asset', 'Liability', 'Equity', 'Revenue', 'Expense']
+
+
+def seed(db, Account, JournalEntry, JournalLine, n_accounts, entries):
+    codes = [str(1000 + i) for i in range(n_accounts)]
+    db.session.bulk_insert_mappings(Account, [
+        {'code': code, 'name': f'Account {code}', 'type': ACCOUNT_TYPES[i % len(ACCOUNT_TYPES)]}
+        for i, code in enumerate(codes)
+    ])
+    start = datetime.utcnow() - timedelta(days=365)
+    headers, lines = [], []
+    for je_id in range(1, entries + 1):
+        posted_at = start + timedelta(minutes=random.randint(0, 365 * 24 * 60))
+        amount = round(random.uniform(1, 1000), 2)
+        debit_acc, credit_acc = random.sample(codes, 2)
+        headers.append({'id': je_id, 'created_at': posted_at, 'description': f'Benchmark #{je_id}', 'entries_json': '[]'})
+        lines.append({'journal_entry_id': je_id, 'account_code': debit_acc, 'debit': amount, 'credit': 0.0, 'posted_at': posted_at})
+        lines.append({'journal_entry_id': je_id, 'account_code': credit_acc, 'debit': 0.0, 'credit': amount, 'posted_at': posted_at})
+    db.session.bulk_insert_mappings(JournalEntry, headers)
+    db.session.bulk_insert_mappings(JournalLine, lines)
+    db.session.commit()
+
+
+def legacy_lookups(Account, agg):
+    """The per-account lookup pattern the report routes used before the engine."""
+    for acc_code in agg:
+        Account.query.filter_by(code=acc_code).first()
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--accounts', type=int, nargs='+', default=[10, 50, 200])
+    parser.add_argument('--entries', type=int, default=5000)
+    parser.add_argument('--seed', type=int, default=42)
+    args = parser.parse_args()
+
+    print(f"{'accounts':>8} | {'engine queries':>14} | {'per-account lookups':>19} | {'engine ms':>9}")
+    for n_accounts in args.accounts:
+        random.seed(args.seed)
+
+        from models import db, Account, JournalEntry, JournalLine
+        from routes.statements import aggregate_account_balances, build_statements, build_balance_sheet
+
+        with throwaway_app(REPORT_CACHE_SIZE=0) as app:
+            with app.app_context():
+                seed(db, Account, JournalEntry, JournalLine, n_accounts, args.entries)
+                engine = db.engine
+
+                t0 = time.perf_counter()
+                with QueryCounter(engine) as engine_q:
+                    build_statements(None, None)
+                    build_balance_sheet(None)
+                elapsed = (time.perf_counter() - t0) * 1000
+
+                agg = aggregate_account_balances(None, None)
+                with QueryCounter(engine) as legacy_q:
+                    # trial balance, general ledger, income statement: one lookup per account;
+                    # balance sheet: one plus two for the Revenue/Expense re-check
+                    for _ in range(3 + 3):
+                        legacy_lookups(Account, agg)
+
+            print(f"{n_accounts:>8} | {engine_q.count:>14} | {legacy_q.count:>19} | {elapsed:>9.1f}")
+
+
+if __name__ == '__main__':
+    main()
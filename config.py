@@ -5,3 +5,17 @@ class Config:
     SQLALCHEMY_TRACK_MODIFICATIONS = False
     SQLALCHEMY_DATABASE_URI = 'sqlite:///' + os.path.join(os.path.dirname(__file__), 'instance', 'app.db')
     VAT_RATE = 0.12
+    # Serve date-range balance queries from an in-process NumPy ledger cube
+    LEDGER_CUBE_ENABLED = False
+    # Max entries in the ledger-version-keyed report result cache (0 disables it)
+    REPORT_CACHE_SIZE = 256
+    # Send api_sale through one writer thread that commits the sales arriving within
+    # GROUP_COMMIT_WINDOW_MS of each other (up to GROUP_COMMIT_MAX_BATCH) in one transaction
+    SALE_GROUP_COMMIT = False
+    GROUP_COMMIT_WINDOW_MS = 5
+    GROUP_COMMIT_MAX_BATCH = 50
+    # Seconds between the SKU/barcode lookup index's checks for other workers' catalog changes
+    LOOKUP_REFRESH_SECONDS = 1.0
+    # Depleted FIFO lots, with their consumption records, move to the archive tables once
+    # their last activity is this many days old (flask archive-inventory)
+    INVENTORY_ARCHIVE_DAYS = 365
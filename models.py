@@ -1,9 +1,10 @@
 from flask_sqlalchemy import SQLAlchemy
 from flask_login import UserMixin
-from datetime import datetime
-from sqlalchemy import func
+from datetime import datetime, timedelta
+from sqlalchemy import func, event
 import json
-from sqlalchemy.orm import validates
+from sqlalchemy.orm import validates, Session
+from sqlalchemy.orm.util import identity_key
 
 
 db = SQLAlchemy()
@@ -17,6 +18,7 @@ class CompanyProfile(db.Model):
     license_key = db.Column(db.String(100))
     next_or_number = db.Column(db.Integer, default=1)
     next_si_number = db.Column(db.Integer, default=1)
+    # Legacy counters: only read once, to seed the DocumentSequence series that replaced them
     next_invoice_number = db.Column(db.Integer, default=1)
     next_consignment_number = db.Column(db.Integer, default=1)
     branch = db.Column(db.String(100), nullable=True)
@@ -85,11 +87,58 @@ class InventoryLot(db.Model):
     
     # For tracking initial inventory from bulk uploads
     is_opening_balance = db.Column(db.Boolean, default=False)
+
+    __table_args__ = (
+        # The FIFO queue: open lots only, in consumption order. Queries must use the
+        # literal `quantity_remaining > 0` (see fifo_utils) for SQLite to pick it.
+        db.Index('ix_inventory_lot_open_fifo', 'product_id', 'created_at', 'id',
+                 sqlite_where=db.text('quantity_remaining > 0')),
+    )
     
     def __repr__(self):
         return f'<InventoryLot {self.id}: Product {self.product_id}, Qty: {self.quantity_remaining}, Cost: {self.unit_cost}>'
 
 
+class FifoHead(db.Model):
+    """
+    The oldest open lot of a product (None when it has none), so a sale reads the
+    lot it draws from without walking the product's lot history. Kept by the
+    after_flush hook in routes/fifo_utils.py whenever a lot is created, deleted,
+    depleted or reopened.
+    """
+    product_id = db.Column(db.Integer, db.ForeignKey('product.id'), primary_key=True)
+    lot_id = db.Column(db.Integer, db.ForeignKey('inventory_lot.id'), nullable=True)
+
+
+class CostingMethod(db.Model):
+    """
+    Costing method ('FIFO' or 'AVERAGE') set for one product or for a whole
+    category; a product's own setting wins over its category's, and anything
+    unset is FIFO. Changed through routes/costing_utils.set_costing_method, which
+    converts the stock of the products it affects.
+    """
+    id = db.Column(db.Integer, primary_key=True)
+    product_id = db.Column(db.Integer, db.ForeignKey('product.id'), unique=True, nullable=True)
+    category = db.Column(db.String(50), unique=True, nullable=True)  # Upper-cased Product.category
+    method = db.Column(db.String(10), nullable=False)
+
+
+class AverageCost(db.Model):
+    """
+    Running quantity and value of a product costed at moving weighted average,
+    kept in place of its lots: a receipt adds to both, a sale takes its share of
+    the value at the current average, and nothing else is written. The row exists
+    only while the product is on that method.
+    """
+    product_id = db.Column(db.Integer, db.ForeignKey('product.id'), primary_key=True)
+    quantity = db.Column(db.Integer, nullable=False, default=0)
+    value = db.Column(db.Float, nullable=False, default=0.0)
+
+    @property
+    def unit_cost(self):
+        return self.value / self.quantity if self.quantity > 0 else 0.0
+
+
 class InventoryTransaction(db.Model):
     """Records the consumption of inventory lots (for audit trail)"""
     id = db.Column(db.Integer, primary_key=True)
@@ -108,10 +157,54 @@ class InventoryTransaction(db.Model):
     adjustment_id = db.Column(db.Integer, db.ForeignKey('stock_adjustment.id'), nullable=True)
     
     created_at = db.Column(db.DateTime, default=datetime.utcnow, nullable=False)
+
+    __table_args__ = (
+        # A lot's consumption records, newest last (archiving checks a lot's latest activity)
+        db.Index('ix_inventory_transaction_lot_created', 'lot_id', 'created_at'),
+    )
     
     def __repr__(self):
         return f'<InventoryTransaction {self.id}: Lot {self.lot_id}, Qty: {self.quantity_used}, Cost: {self.total_cost}>'
 
+
+class InventoryLotArchive(db.Model):
+    """
+    Depleted InventoryLot rows moved out of the hot table by
+    routes/archive_utils.archive_inventory_history once their last activity is
+    older than the archive horizon. The lot id is kept, so the archived
+    consumption records still point at their lot.
+    """
+    id = db.Column(db.Integer, primary_key=True, autoincrement=False)
+    product_id = db.Column(db.Integer, db.ForeignKey('product.id'), nullable=False, index=True)
+    quantity_remaining = db.Column(db.Integer, nullable=False)
+    unit_cost = db.Column(db.Float, nullable=False)
+    purchase_id = db.Column(db.Integer, db.ForeignKey('purchase.id'), nullable=True, index=True)
+    purchase_item_id = db.Column(db.Integer, db.ForeignKey('purchase_item.id'), nullable=True)
+    adjustment_id = db.Column(db.Integer, db.ForeignKey('stock_adjustment.id'), nullable=True)
+    movement_id = db.Column(db.Integer, db.ForeignKey('inventory_movement.id'), nullable=True)
+    created_at = db.Column(db.DateTime, nullable=False)
+    is_opening_balance = db.Column(db.Boolean, default=False)
+    archived_at = db.Column(db.DateTime, default=datetime.utcnow, nullable=False)
+
+
+class InventoryTransactionArchive(db.Model):
+    """
+    Consumption records of the lots in InventoryLotArchive, moved with their lot.
+    Its own id: the hot table's ids are not kept, as nothing points at them.
+    """
+    id = db.Column(db.Integer, primary_key=True)
+    lot_id = db.Column(db.Integer, nullable=False, index=True)  # InventoryLotArchive.id
+    quantity_used = db.Column(db.Integer, nullable=False)
+    unit_cost = db.Column(db.Float, nullable=False)
+    total_cost = db.Column(db.Float, nullable=False)
+    sale_id = db.Column(db.Integer, db.ForeignKey('sale.id'), nullable=True, index=True)
+    sale_item_id = db.Column(db.Integer, db.ForeignKey('sale_item.id'), nullable=True)
+    ar_invoice_id = db.Column(db.Integer, db.ForeignKey('ar_invoice.id'), nullable=True, index=True)
+    ar_invoice_item_id = db.Column(db.Integer, db.ForeignKey('ar_invoice_item.id'), nullable=True)
+    adjustment_id = db.Column(db.Integer, db.ForeignKey('stock_adjustment.id'), nullable=True)
+    created_at = db.Column(db.DateTime, nullable=False)
+    archived_at = db.Column(db.DateTime, default=datetime.utcnow, nullable=False)
+
 class Sale(db.Model):
     id = db.Column(db.Integer, primary_key=True)
     created_at = db.Column(db.DateTime, default=datetime.utcnow)
@@ -133,6 +226,19 @@ class Sale(db.Model):
     voided_by_user = db.relationship('User', foreign_keys=[voided_by])
 
 
+class SaleIdempotencyKey(db.Model):
+    """
+    Client key of a sale posted through /api/sales/batch. Written in the same
+    transaction as the sale, so a replayed key returns the original sale instead of posting twice.
+    """
+    id = db.Column(db.Integer, primary_key=True)
+    key = db.Column(db.String(100), unique=True, nullable=False)
+    sale_id = db.Column(db.Integer, db.ForeignKey('sale.id'), nullable=False)
+    created_at = db.Column(db.DateTime, default=datetime.utcnow)
+
+    sale = db.relationship('Sale')
+
+
 class SaleItem(db.Model):
     id = db.Column(db.Integer, primary_key=True)
     sale_id = db.Column(db.Integer, db.ForeignKey('sale.id'), nullable=False)
@@ -181,12 +287,170 @@ class JournalEntry(db.Model):
     void_reason = db.Column(db.String(500), nullable=True)
     voided_by_user = db.relationship('User', foreign_keys=[voided_by])
 
+    lines = db.relationship('JournalLine', backref='journal_entry', cascade='all, delete-orphan')
+
     def entries(self):
         try:
             return json.loads(self.entries_json)
         except (json.JSONDecodeError, TypeError):
             return []
 
+    def line_rows(self):
+        """JournalLine column values for each account line in entries_json."""
+        rows = []
+        for line in self.entries():
+            acc_code = line.get('account_code')
+            if not acc_code:
+                continue
+            rows.append({
+                'account_code': str(acc_code),
+                'debit': float(line.get('debit', 0) or 0),
+                'credit': float(line.get('credit', 0) or 0),
+                'posted_at': self.created_at
+            })
+        return rows
+
+    def build_lines(self):
+        """Materialize entries_json into JournalLine rows (one per account line)."""
+        self.created_at = self.created_at or datetime.utcnow()
+        self.lines = [JournalLine(**row) for row in self.line_rows()]
+        return self.lines
+
+
+class JournalLine(db.Model):
+    """Normalized, indexed copy of JournalEntry.entries_json used by the reports"""
+    id = db.Column(db.Integer, primary_key=True)
+    journal_entry_id = db.Column(db.Integer, db.ForeignKey('journal_entry.id'), nullable=False, index=True)
+    account_code = db.Column(db.String(32), nullable=False)
+    debit = db.Column(db.Float, nullable=False, default=0.0)
+    credit = db.Column(db.Float, nullable=False, default=0.0)
+    # Mirrors JournalEntry.created_at so date-range reports never touch the header table
+    posted_at = db.Column(db.DateTime, nullable=False)
+
+    __table_args__ = (
+        db.Index('ix_journal_line_account_posted', 'account_code', 'posted_at'),
+        db.Index('ix_journal_line_posted_at', 'posted_at'),
+        # Account -> journal entry lookups (journal search, 'has this account been used')
+        db.Index('ix_journal_line_account_entry', 'account_code', 'journal_entry_id'),
+    )
+
+
+class PeriodLockedError(ValueError):
+    """Raised when a posting or void touches a closed accounting period."""
+
+
+class AccountingPeriod(db.Model):
+    """A closed accounting month. Nothing dated before end_date may be posted or voided."""
+    id = db.Column(db.Integer, primary_key=True)
+    start_date = db.Column(db.DateTime, nullable=False)
+    # Exclusive upper bound: first instant of the following month
+    end_date = db.Column(db.DateTime, nullable=False, unique=True, index=True)
+    # Cumulative net income (Revenue - Expense) up to end_date, rolled into Retained Earnings
+    retained_earnings = db.Column(db.Float, nullable=False, default=0.0)
+    # Net income of this month alone
+    net_income = db.Column(db.Float, nullable=False, default=0.0)
+    closed_at = db.Column(db.DateTime, default=datetime.utcnow)
+    closed_by = db.Column(db.Integer, db.ForeignKey('user.id'), nullable=True)
+
+    closed_by_user = db.relationship('User', foreign_keys=[closed_by])
+    balances = db.relationship('PeriodClosingBalance', backref='period', cascade='all, delete-orphan')
+
+    @property
+    def last_day(self):
+        return self.end_date - timedelta(days=1)
+
+
+class PeriodClosingBalance(db.Model):
+    """Frozen cumulative balance (debit - credit) of one account at the end of a closed period."""
+    id = db.Column(db.Integer, primary_key=True)
+    period_id = db.Column(db.Integer, db.ForeignKey('accounting_period.id'), nullable=False, index=True)
+    account_code = db.Column(db.String(32), nullable=False)
+    balance = db.Column(db.Float, nullable=False, default=0.0)
+
+    __table_args__ = (
+        db.UniqueConstraint('period_id', 'account_code', name='uq_period_closing_balance_account'),
+    )
+
+
+class DocumentSequence(db.Model):
+    """
+    A document number series (e.g. 'invoice', 'consignment').
+    next_value is a high-water mark: numbers below it have been reserved by some
+    worker, which hands them out from memory (see routes/sequence_utils.py).
+    """
+    id = db.Column(db.Integer, primary_key=True)
+    name = db.Column(db.String(50), unique=True, nullable=False)
+    next_value = db.Column(db.Integer, nullable=False, default=1)
+    block_size = db.Column(db.Integer, nullable=False, default=20)
+    # Gap-free series (BIR-registered invoices) only retire a number when the document using it commits
+    gap_free = db.Column(db.Boolean, nullable=False, default=False)
+    updated_at = db.Column(db.DateTime, default=datetime.utcnow, onupdate=datetime.utcnow)
+
+
+class DocumentNumberLease(db.Model):
+    """
+    A reserved but not yet used number of a gap-free series. The row is deleted in
+    the same transaction as the document that takes the number, so a number is
+    either on a committed document or still leased, never lost.
+    """
+    id = db.Column(db.Integer, primary_key=True)
+    sequence_id = db.Column(db.Integer, db.ForeignKey('document_sequence.id'), nullable=False)
+    number = db.Column(db.Integer, nullable=False)
+    worker = db.Column(db.String(100), nullable=False)
+    leased_at = db.Column(db.DateTime, nullable=False, default=datetime.utcnow)
+
+    __table_args__ = (
+        db.UniqueConstraint('sequence_id', 'number', name='uq_document_number_lease'),
+    )
+
+
+class CatalogChange(db.Model):
+    """
+    One sellable item whose POS-visible fields changed. The id doubles as the
+    catalog version terminals sync against; rows are written by the after_flush
+    hook in routes/catalog_utils.py and old ones pruned by `flask prune-catalog-changes`.
+    """
+    id = db.Column(db.Integer, primary_key=True)
+    kind = db.Column(db.String(20), nullable=False)  # 'regular' or 'consignment', as in the catalog's `type`
+    item_id = db.Column(db.Integer, nullable=False)
+    changed_at = db.Column(db.DateTime, nullable=False, default=datetime.utcnow, index=True)
+
+
+@event.listens_for(Session, 'before_flush')
+def _write_journal_lines(session, flush_context, instances):
+    """
+    Every new JournalEntry gets its lines written in the same flush.
+    New entries and voids dated inside a closed period are rejected.
+    """
+    touched = []
+    for obj in list(session.new):
+        if isinstance(obj, JournalEntry):
+            if not obj.lines:
+                obj.build_lines()
+            touched.append(obj)
+    for obj in session.dirty:
+        if isinstance(obj, JournalEntry) and db.inspect(obj).attrs.voided_at.history.has_changes():
+            touched.append(obj)
+
+    if touched:
+        check_period_lock(session, touched)
+
+
+def check_period_lock(session, journal_entries):
+    """
+    Raises:
+        PeriodLockedError: If any of the journal entries is dated inside a closed period
+    """
+    locked_before = session.query(func.max(AccountingPeriod.end_date)).scalar()
+    if not locked_before:
+        return
+    for je in journal_entries:
+        if je.created_at and je.created_at < locked_before:
+            raise PeriodLockedError(
+                f"The books are closed through {(locked_before - timedelta(days=1)):%Y-%m-%d}. "
+                f"Journal entry dated {je.created_at:%Y-%m-%d} cannot be posted or voided."
+            )
+
 # ✅ --- FIX: Inherits from UserMixin to integrate with Flask-Login ---
 class User(db.Model, UserMixin):
     id = db.Column(db.Integer, primary_key=True)
@@ -402,27 +666,39 @@ class ConsignmentReceived(db.Model):
     items = db.relationship('ConsignmentItem', backref='consignment', cascade='all, delete-orphan', lazy='dynamic')
 
     remittances = db.relationship('ConsignmentRemittance', back_populates='consignment', lazy='dynamic')
+
+    counters = db.relationship('ConsignmentCounters', uselist=False, viewonly=True)
     
     created_at = db.Column(db.DateTime, default=datetime.utcnow)
     created_by_id = db.Column(db.Integer, db.ForeignKey('user.id'))
     created_by = db.relationship('User')
     
+    def get_counters(self):
+        """Running totals of the items; summed from the items if the consignment has no counters row yet"""
+        return self.counters or ConsignmentCounters.from_items(self)
+
     def get_total_sold_value(self):
         """Calculate total value of items sold"""
-        sold = db.session.query(func.sum(ConsignmentItem.quantity_sold * ConsignmentItem.retail_price))\
-            .filter(ConsignmentItem.consignment_id == self.id).scalar()
-        return sold or 0.0
-    
+        return self.get_counters().sold_value
+
     def get_commission_earned(self):
         """Calculate commission earned on sold items"""
-        sold_value = self.get_total_sold_value()
-        return round(sold_value * (self.commission_rate / 100), 2)
-    
+        return self.get_counters().commission
+
     def get_amount_due_to_supplier(self):
         """Calculate amount to remit to supplier (sales - commission)"""
-        sold_value = self.get_total_sold_value()
-        commission = self.get_commission_earned()
-        return round(sold_value - commission, 2)
+        counters = self.get_counters()
+        return round(counters.sold_value - counters.commission, 2)
+
+    def update_status(self):
+        """Closed when nothing is left to sell or return, Partial once anything is sold or returned"""
+        counters = self.get_counters()
+        if counters.units_sold + counters.units_returned >= counters.units_received:
+            self.status = 'Closed'
+        elif counters.units_sold > 0 or counters.units_returned > 0:
+            self.status = 'Partial'
+        else:
+            self.status = 'Active'
 
 class ConsignmentItem(db.Model):
     """Individual consigned products (NOT in your regular inventory)"""
@@ -465,6 +741,234 @@ class ConsignmentItem(db.Model):
             'consignment_id': self.consignment_id
         }
 
+class ConsignmentCounters(db.Model):
+    """
+    Running totals of a consignment's items, so status and settlement figures are
+    read without summing the items. Kept in the same transaction as every item
+    change by the after_flush hook below; consignments received before the table
+    existed get their row on the next change or from `flask backfill-consignment-counters`.
+    """
+    __tablename__ = 'consignment_counters'
+
+    consignment_id = db.Column(db.Integer, db.ForeignKey('consignment_received.id'), primary_key=True)
+    units_received = db.Column(db.Integer, nullable=False, default=0)
+    units_sold = db.Column(db.Integer, nullable=False, default=0)
+    units_returned = db.Column(db.Integer, nullable=False, default=0)
+    units_damaged = db.Column(db.Integer, nullable=False, default=0)
+    sold_value = db.Column(db.Float, nullable=False, default=0.0)  # Retail value of units sold
+    commission = db.Column(db.Float, nullable=False, default=0.0)  # sold_value at the consignment's commission rate
+
+    @staticmethod
+    def totals(consignment_id, connection=None):
+        """(units_received, units_sold, units_returned, units_damaged, sold_value) summed over the items"""
+        query = db.select(
+            func.coalesce(func.sum(ConsignmentItem.quantity_received), 0),
+            func.coalesce(func.sum(ConsignmentItem.quantity_sold), 0),
+            func.coalesce(func.sum(ConsignmentItem.quantity_returned), 0),
+            func.coalesce(func.sum(ConsignmentItem.quantity_damaged), 0),
+            func.coalesce(func.sum(ConsignmentItem.quantity_sold * ConsignmentItem.retail_price), 0.0),
+        ).where(ConsignmentItem.consignment_id == consignment_id)
+        return tuple((connection or db.session).execute(query).one())
+
+    @classmethod
+    def from_items(cls, consignment):
+        """A counters row (not added to the session) summed from the consignment's items"""
+        received, sold, returned, damaged, sold_value = cls.totals(consignment.id)
+        return cls(consignment_id=consignment.id, units_received=received, units_sold=sold,
+                   units_returned=returned, units_damaged=damaged, sold_value=sold_value,
+                   commission=_commission_on(sold_value, consignment.commission_rate))
+
+
+    @classmethod
+    def rebuild(cls):
+        """Recompute every consignment's counters from its items; returns the number of rows written"""
+        totals = {row[0]: row[1:] for row in db.session.execute(
+            db.select(
+                ConsignmentItem.consignment_id,
+                func.coalesce(func.sum(ConsignmentItem.quantity_received), 0),
+                func.coalesce(func.sum(ConsignmentItem.quantity_sold), 0),
+                func.coalesce(func.sum(ConsignmentItem.quantity_returned), 0),
+                func.coalesce(func.sum(ConsignmentItem.quantity_damaged), 0),
+                func.coalesce(func.sum(ConsignmentItem.quantity_sold * ConsignmentItem.retail_price), 0.0),
+            ).group_by(ConsignmentItem.consignment_id)
+        )}
+        rows = []
+        for consignment_id, rate in db.session.execute(db.select(ConsignmentReceived.id, ConsignmentReceived.commission_rate)):
+            received, sold, returned, damaged, sold_value = totals.get(consignment_id, (0, 0, 0, 0, 0.0))
+            rows.append({
+                'consignment_id': consignment_id, 'units_received': received, 'units_sold': sold,
+                'units_returned': returned, 'units_damaged': damaged, 'sold_value': sold_value,
+                'commission': _commission_on(sold_value, rate),
+            })
+        db.session.execute(db.delete(cls.__table__))
+        if rows:
+            db.session.execute(db.insert(cls.__table__), rows)
+        db.session.commit()
+        return len(rows)
+
+
+def _commission_on(sold_value, commission_rate):
+    return round(sold_value * ((commission_rate or 0) / 100), 2)
+
+
+# ConsignmentItem quantity -> ConsignmentCounters total
+_COUNTED_QUANTITIES = (
+    ('quantity_received', 'units_received'),
+    ('quantity_sold', 'units_sold'),
+    ('quantity_returned', 'units_returned'),
+    ('quantity_damaged', 'units_damaged'),
+)
+
+
+def _item_values(item, state):
+    """
+    (old, new) {attribute: value} of a flushed item, zeros for the missing side of
+    an insert or delete. `old` is None when a changed value was set without being
+    loaded first, so the change cannot be applied as a delta.
+    """
+    attrs = [name for name, _ in _COUNTED_QUANTITIES] + ['retail_price']
+    current = {name: getattr(item, name) or 0 for name in attrs}
+    zeros = dict.fromkeys(attrs, 0)
+    if state == 'new':
+        return zeros, current
+    if state == 'deleted':
+        return current, zeros
+    old = dict(current)
+    for name in attrs:
+        history = db.inspect(item).attrs[name].history
+        if history.has_changes():
+            if not history.deleted:
+                return None, current
+            old[name] = history.deleted[0] or 0
+    return old, current
+
+
+@event.listens_for(Session, 'after_flush')
+def _update_consignment_counters(session, flush_context):
+    """Apply the flush's changes to consignment items to their consignments' counters."""
+    deltas = {}
+    recount = set()
+    for objects, state in ((session.new, 'new'), (session.dirty, 'dirty'), (session.deleted, 'deleted')):
+        for obj in objects:
+            if not isinstance(obj, ConsignmentItem) or obj.consignment_id is None:
+                continue
+            old, new = _item_values(obj, state)
+            if old is None:
+                recount.add(obj.consignment_id)
+                continue
+            delta = deltas.setdefault(obj.consignment_id, dict.fromkeys(
+                [column for _, column in _COUNTED_QUANTITIES] + ['sold_value'], 0))
+            for name, column in _COUNTED_QUANTITIES:
+                delta[column] += new[name] - old[name]
+            delta['sold_value'] += new['quantity_sold'] * new['retail_price'] - old['quantity_sold'] * old['retail_price']
+
+    touched = sorted(recount | {consignment_id for consignment_id, delta in deltas.items() if any(delta.values())})
+    if not touched:
+        return
+    table = ConsignmentCounters.__table__
+    conn = session.connection()
+    for consignment_id in touched:
+        rate = conn.execute(
+            db.select(ConsignmentReceived.commission_rate).where(ConsignmentReceived.id == consignment_id)
+        ).scalar()
+        delta = deltas.get(consignment_id)
+        if consignment_id not in recount and conn.execute(
+            db.update(table).where(table.c.consignment_id == consignment_id)
+            .values({column: table.c[column] + value for column, value in delta.items()})
+        ).rowcount:
+            if delta['sold_value']:
+                sold_value = conn.execute(
+                    db.select(table.c.sold_value).where(table.c.consignment_id == consignment_id)
+                ).scalar()
+                conn.execute(db.update(table).where(table.c.consignment_id == consignment_id)
+                             .values(commission=_commission_on(sold_value, rate)))
+            continue
+        # No row yet (or a change that can only be recounted): the items already include this flush
+        received, sold, returned, damaged, sold_value = ConsignmentCounters.totals(consignment_id, conn)
+        conn.execute(db.delete(table).where(table.c.consignment_id == consignment_id))
+        conn.execute(db.insert(table).values(
+            consignment_id=consignment_id, units_received=received, units_sold=sold,
+            units_returned=returned, units_damaged=damaged, sold_value=sold_value,
+            commission=_commission_on(sold_value, rate),
+        ))
+    session.info.setdefault('consignment_counters_changed', set()).update(touched)
+
+
+@event.listens_for(Session, 'after_flush_postexec')
+def _expire_consignment_counters(session, flush_context):
+    """Loaded counters (or a consignment's missing-row None) are stale after the hook wrote to the table."""
+    for consignment_id in session.info.pop('consignment_counters_changed', ()):
+        counters = session.identity_map.get(identity_key(ConsignmentCounters, consignment_id))
+        if counters is not None:
+            session.expire(counters)
+        consignment = session.identity_map.get(identity_key(ConsignmentReceived, consignment_id))
+        if consignment is not None:
+            session.expire(consignment, ['counters'])
+
+
+class ConsignmentAvailability(db.Model):
+    """
+    A consignment item's stored quantity_available (received - sold - returned -
+    damaged) and is_active, so sellable items are found through the partial
+    index instead of computing availability for every item. Written in the same
+    transaction as the item by the after_flush hook below; items from before the
+    table existed get their row from `flask check-consignment-availability --repair`.
+    """
+    __tablename__ = 'consignment_availability'
+
+    item_id = db.Column(db.Integer, db.ForeignKey('consignment_item.id'), primary_key=True)
+    consignment_id = db.Column(db.Integer, db.ForeignKey('consignment_received.id'), nullable=False)
+    quantity_available = db.Column(db.Integer, nullable=False, default=0)
+    is_active = db.Column(db.Boolean, nullable=False, default=True)
+
+    __table_args__ = (
+        # Only sellable items; queries must repeat this condition literally for SQLite to use the index
+        db.Index('ix_consignment_availability_sellable', 'consignment_id', 'item_id', 'quantity_available',
+                 sqlite_where=db.text('is_active = 1 AND quantity_available > 0')),
+    )
+
+    @staticmethod
+    def values_of(item):
+        return {
+            'item_id': item.id,
+            'consignment_id': item.consignment_id,
+            'quantity_available': (item.quantity_received or 0) - (item.quantity_sold or 0)
+                                  - (item.quantity_returned or 0) - (item.quantity_damaged or 0),
+            'is_active': bool(item.is_active),
+        }
+
+
+_AVAILABILITY_FIELDS = ('consignment_id', 'quantity_received', 'quantity_sold', 'quantity_returned',
+                        'quantity_damaged', 'is_active')
+
+
+@event.listens_for(Session, 'after_flush')
+def _update_consignment_availability(session, flush_context):
+    """Store the availability of every consignment item the flush inserted, changed or deleted."""
+    written, deleted = [], []
+    for obj in session.new:
+        if isinstance(obj, ConsignmentItem):
+            written.append(obj)
+    for obj in session.dirty:
+        if isinstance(obj, ConsignmentItem) and any(
+                db.inspect(obj).attrs[name].history.has_changes() for name in _AVAILABILITY_FIELDS):
+            written.append(obj)
+    for obj in session.deleted:
+        if isinstance(obj, ConsignmentItem):
+            deleted.append(obj.id)
+    if not written and not deleted:
+        return
+
+    table = ConsignmentAvailability.__table__
+    conn = session.connection()
+    if deleted:
+        conn.execute(db.delete(table).where(table.c.item_id.in_(deleted)))
+    for item in written:
+        values = ConsignmentAvailability.values_of(item)
+        if not conn.execute(db.update(table).where(table.c.item_id == item.id).values(values)).rowcount:
+            conn.execute(db.insert(table).values(values))
+
+
 class ConsignmentSale(db.Model):
     """Track individual sales of consigned goods"""
     __tablename__ = 'consignment_sale'
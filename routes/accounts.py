@@ -2,12 +2,14 @@ from flask import Blueprint, render_template, request, flash, redirect, url_for
 from models import db, Account
 from flask_login import login_required
 from .decorators import role_required
-from models import JournalEntry, Account # Make sure Account is imported
-import json
+from models import Account # Make sure Account is imported
 from datetime import datetime # Import datetime
-from routes.utils import log_action # Import the log_action utility
+from routes.utils import log_action, clear_system_account_map # Import the log_action utility
 from flask_login import current_user # Import current_user
 from .utils import log_action
+from routes.period_utils import close_period, reopen_latest_period, get_next_period_to_close
+from routes.posting_utils import post_journal
+from models import AccountingPeriod
 
 accounts_bp = Blueprint('accounts', __name__, url_prefix='/accounts')
 
@@ -50,6 +52,7 @@ def add_account():
     db.session.add(new_account)
     log_action(f'Created new account: {code} - {name} ({type}).')
     db.session.commit()
+    clear_system_account_map()
     flash('Account added successfully.', 'success')
     return redirect(url_for('accounts.chart_of_accounts'))
 
@@ -94,6 +97,7 @@ def update_account(id):
         log_action(f'Updated account {acc.id}: Changed {", ".join(changes)}.')
     
     db.session.commit()
+    clear_system_account_map()
     flash('Account updated successfully.', 'success')
     return redirect(url_for('accounts.chart_of_accounts'))
 
@@ -179,12 +183,7 @@ def create_journal_entry():
 
     try:
         # Create and save the new Journal Entry
-        je = JournalEntry(
-            description=f"[Manual] {description}",
-            entries_json=json.dumps(je_lines),
-            created_at=entry_date  # Use the user-provided date
-        )
-        db.session.add(je)
+        je = post_journal(je_lines, f"[Manual] {description}", posted_at=entry_date)  # Use the user-provided date
         
         # Log this action
         log_action(f'Created manual journal entry #{je.id} for "{description}" with total ₱{total_debit:,.2f}.', user=current_user)
@@ -198,4 +197,58 @@ def create_journal_entry():
     except Exception as e:
         db.session.rollback()
         flash(f'An error occurred: {str(e)}', 'danger')
-        return redirect(url_for('accounts.new_journal_entry_form'))
\ No newline at end of file
+        return redirect(url_for('accounts.new_journal_entry_form'))
+
+
+@accounts_bp.route('/periods')
+@login_required
+@role_required('Admin', 'Accountant')
+def accounting_periods():
+    """List closed accounting periods and offer to close the next one."""
+    periods = AccountingPeriod.query.order_by(AccountingPeriod.end_date.desc()).all()
+    next_period = get_next_period_to_close()
+    can_close_next = bool(next_period) and next_period[1] <= datetime.utcnow()
+    return render_template('accounting_periods.html', periods=periods,
+                           next_period=next_period, can_close_next=can_close_next)
+
+
+@accounts_bp.route('/periods/close', methods=['POST'])
+@login_required
+@role_required('Admin', 'Accountant')
+def close_accounting_period():
+    """Close the next open month, freezing its balances and locking its postings."""
+    try:
+        year = int(request.form.get('year', ''))
+        month = int(request.form.get('month', ''))
+    except ValueError:
+        flash('Invalid period.', 'danger')
+        return redirect(url_for('accounts.accounting_periods'))
+
+    try:
+        period = close_period(year, month, user=current_user)
+        log_action(f'Closed accounting period {period.start_date:%B %Y}. '
+                   f'Net income ₱{period.net_income:,.2f} rolled into retained earnings.', user=current_user)
+        db.session.commit()
+        flash(f'{period.start_date:%B %Y} closed successfully.', 'success')
+    except ValueError as e:
+        db.session.rollback()
+        flash(str(e), 'danger')
+
+    return redirect(url_for('accounts.accounting_periods'))
+
+
+@accounts_bp.route('/periods/reopen', methods=['POST'])
+@login_required
+@role_required('Admin')
+def reopen_accounting_period():
+    """Reopen the most recently closed month."""
+    try:
+        period = reopen_latest_period()
+        log_action(f'Reopened accounting period {period.start_date:%B %Y}.', user=current_user)
+        db.session.commit()
+        flash(f'{period.start_date:%B %Y} reopened.', 'warning')
+    except ValueError as e:
+        db.session.rollback()
+        flash(str(e), 'danger')
+
+    return redirect(url_for('accounts.accounting_periods'))
@@ -1,10 +1,11 @@
-from flask import Blueprint, render_template, request, redirect, url_for, flash, send_file
+from flask import Blueprint, render_template, request, redirect, url_for, flash
 from flask_login import login_required, current_user
-from models import db, Customer, Supplier, ARInvoice, APInvoice, Payment, JournalEntry, CreditMemo, Account, Product, ARInvoiceItem, RecurringBill
-import io, csv
-import json
+from models import db, Customer, Supplier, ARInvoice, APInvoice, Payment, CreditMemo, Account, Product, ARInvoiceItem, RecurringBill
 from .decorators import role_required
 from .utils import log_action, get_system_account_code
+from .export_utils import stream_csv, EXPORT_CHUNK_ROWS
+from .posting_utils import post_journal
+from .sequence_utils import next_document_number
 from models import Product, ARInvoiceItem, Payment
 from datetime import datetime, timedelta
 
@@ -81,13 +82,12 @@ def ar_invoices():
 
             # Journal entry
             je_lines = [
-                    {'account_code': get_system_account_code('Accounts Receivable'), 'debit': round(inv.total, 2), 'credit': 0},
-                    {'account_code': get_system_account_code('Sales Revenue'), 'debit': 0, 'credit': round(inv.total - inv.vat, 2)},
-                    {'account_code': get_system_account_code('VAT Payable'), 'debit': 0, 'credit': round(inv.vat, 2)},
+                    {'system_account': 'Accounts Receivable', 'debit': round(inv.total, 2), 'credit': 0},
+                    {'system_account': 'Sales Revenue', 'debit': 0, 'credit': round(inv.total - inv.vat, 2)},
+                    {'system_account': 'VAT Payable', 'debit': 0, 'credit': round(inv.vat, 2)},
                 ]
             
-            je = JournalEntry(description=f'AR Invoice #{inv.id}', entries_json=json.dumps(je_lines))
-            db.session.add(je)
+            post_journal(je_lines, f'AR Invoice #{inv.id}')
             log_action(f'Created AR Invoice #{inv.id} for ₱{inv.total:,.2f}.')
             db.session.commit()
             flash('AR Invoice created and journal entry recorded.')
@@ -175,16 +175,15 @@ def ap_invoices():
             # Debits the user-selected account
             je_lines = [
                     {'account_code': expense_account_code, 'debit': round(inv.total - inv.vat, 2), 'credit': 0},
-                    {'account_code': get_system_account_code('VAT Input'), 'debit': round(inv.vat, 2), 'credit': 0},
-                    {'account_code': get_system_account_code('Accounts Payable'), 'debit': 0, 'credit': round(inv.total, 2)},
+                    {'system_account': 'VAT Input', 'debit': round(inv.vat, 2), 'credit': 0},
+                    {'system_account': 'Accounts Payable', 'debit': 0, 'credit': round(inv.total, 2)},
                 ]
             
             # Remove VAT Input line if VAT is zero
             if inv.vat == 0:
                 je_lines.pop(1) # Removes the VAT input line
 
-            je = JournalEntry(description=f'AP Invoice #{inv.id} ({inv.invoice_number}) - {inv.description}', entries_json=json.dumps(je_lines))
-            db.session.add(je)
+            post_journal(je_lines, f'AP Invoice #{inv.id} ({inv.invoice_number}) - {inv.description}')
             log_action(f'Created AP Invoice #{inv.id} for ₱{inv.total:,.2f}.')
             db.session.commit()
             flash('AP Invoice created and journal entry recorded.')
@@ -257,9 +256,9 @@ def record_payment():
             inv.status = 'Partially Paid'
             
         je_lines = [
-            {'account_code': get_system_account_code('Cash'), 'debit': round(amount, 2), 'credit': 0},
-            {'account_code': get_system_account_code('Creditable Withholding Tax'), 'debit': round(wht_amount, 2), 'credit': 0},
-            {'account_code': get_system_account_code('Accounts Receivable'), 'debit': 0, 'credit': total_credited}
+            {'system_account': 'Cash', 'debit': round(amount, 2), 'credit': 0},
+            {'system_account': 'Creditable Withholding Tax', 'debit': round(wht_amount, 2), 'credit': 0},
+            {'system_account': 'Accounts Receivable', 'debit': 0, 'credit': total_credited}
         ]
         
         redirect_url = url_for('ar_ap.ar_invoices')
@@ -274,8 +273,8 @@ def record_payment():
         inv.status = 'Paid' if inv.paid >= inv.total else 'Partially Paid'
         
         je_lines = [
-            {'account_code': get_system_account_code('Accounts Payable'), 'debit': round(amount, 2), 'credit': 0},
-            {'account_code': get_system_account_code('Cash'), 'debit': 0, 'credit': round(amount, 2)}
+            {'system_account': 'Accounts Payable', 'debit': round(amount, 2), 'credit': 0},
+            {'system_account': 'Cash', 'debit': 0, 'credit': round(amount, 2)}
         ]
         
         redirect_url = url_for('ar_ap.ap_invoices')
@@ -297,11 +296,7 @@ def record_payment():
         db.session.flush()
 
         # ✅ FIX: Create JE with only valid parameters
-        je = JournalEntry(
-            description=f'Payment for {ref_type} #{ref_id}', 
-            entries_json=json.dumps(je_lines)
-        )
-        db.session.add(je)
+        post_journal(je_lines, f'Payment for {ref_type} #{ref_id}')
         
         log_action(f'Recorded Payment #{p.id} of ₱{p.amount:,.2f} (WHT: ₱{p.wht_amount:,.2f}) for {ref_type} #{ref_id}.')
         db.session.commit()
@@ -366,9 +361,9 @@ def credit_memos():
 
         # Journal Entry
         je_lines = [
-                {'account_code': get_system_account_code('Sales Returns'), 'debit': amount_net, 'credit': 0},
-                {'account_code': get_system_account_code('VAT Payable'), 'debit': vat, 'credit': 0},
-                {'account_code': get_system_account_code('Accounts Receivable'), 'debit': 0, 'credit': total_amount}
+                {'system_account': 'Sales Returns', 'debit': amount_net, 'credit': 0},
+                {'system_account': 'VAT Payable', 'debit': vat, 'credit': 0},
+                {'system_account': 'Accounts Receivable', 'debit': 0, 'credit': total_amount}
             ]
         
         # --- FIX: Add logic to handle inventory return ---
@@ -402,12 +397,12 @@ def credit_memos():
                 total_cogs_reversal = round(return_cost * return_quantity, 2)
                 if total_cogs_reversal > 0:
                     je_lines.append({
-                        'account_code': get_system_account_code('Inventory'), 
+                        'system_account': 'Inventory', 
                         'debit': total_cogs_reversal, 
                         'credit': 0
                     })
                     je_lines.append({
-                        'account_code': get_system_account_code('COGS'), 
+                        'system_account': 'COGS', 
                         'debit': 0, 
                         'credit': total_cogs_reversal
                     })
@@ -415,8 +410,7 @@ def credit_memos():
                 log_action(f'Returned {return_quantity} of {product.name} to inventory via CM #{cm.id}.')
         # --- END FIX ---
 
-        je = JournalEntry(description=f'Credit Memo #{cm.id} for {reason}', entries_json=json.dumps(je_lines))
-        db.session.add(je)
+        post_journal(je_lines, f'Credit Memo #{cm.id} for {reason}')
         log_action(f'Created Credit Memo #{cm.id} for ₱{cm.total_amount:,.2f} (Reason: {reason}).')
         db.session.commit()
         flash('Credit Memo created successfully.', 'success')
@@ -520,13 +514,7 @@ def billing_invoices():
             
             invoice_total = subtotal
             
-            from models import CompanyProfile
-            company = CompanyProfile.query.first()
-            if company:
-                invoice_number = f"INV-{company.next_invoice_number:05d}"
-                company.next_invoice_number += 1
-            else:
-                invoice_number = f"INV-{datetime.utcnow().strftime('%Y%m%d%H%M%S')}"
+            invoice_number = f"INV-{next_document_number('invoice'):05d}"
             
             ar_invoice = ARInvoice(
                 customer_id=customer_id,
@@ -587,20 +575,19 @@ def billing_invoices():
                         return redirect(url_for('ar_ap.billing_invoices'))
             
             je_lines = [
-                {'account_code': get_system_account_code('Accounts Receivable'), 'debit': round(invoice_total, 2), 'credit': 0},
-                {'account_code': get_system_account_code('Sales Revenue'), 'debit': 0, 'credit': round(invoice_total - total_vat, 2)},
+                {'system_account': 'Accounts Receivable', 'debit': round(invoice_total, 2), 'credit': 0},
+                {'system_account': 'Sales Revenue', 'debit': 0, 'credit': round(invoice_total - total_vat, 2)},
             ]
             
             if total_vat > 0:
-                je_lines.append({'account_code': get_system_account_code('VAT Payable'), 'debit': 0, 'credit': round(total_vat, 2)})
+                je_lines.append({'system_account': 'VAT Payable', 'debit': 0, 'credit': round(total_vat, 2)})
             
             je_lines.extend([
-                {'account_code': get_system_account_code('COGS'), 'debit': round(total_cogs, 2), 'credit': 0},
-                {'account_code': get_system_account_code('Inventory'), 'debit': 0, 'credit': round(total_cogs, 2)}
+                {'system_account': 'COGS', 'debit': round(total_cogs, 2), 'credit': 0},
+                {'system_account': 'Inventory', 'debit': 0, 'credit': round(total_cogs, 2)}
             ])
             
-            je = JournalEntry(description=f'Billing Invoice {invoice_number} - {description}', entries_json=json.dumps(je_lines))
-            db.session.add(je)
+            post_journal(je_lines, f'Billing Invoice {invoice_number} - {description}')
             
             log_action(f'Created Billing Invoice {invoice_number} for ₱{invoice_total:,.2f} (Due: {due_date.strftime("%Y-%m-%d")})')
             db.session.commit()
@@ -638,41 +625,25 @@ def billing_invoices():
 @ar_ap_bp.route('/export/ar.csv')
 @login_required
 def export_ar_csv():
-    invoices = ARInvoice.query.order_by(ARInvoice.date.desc()).all()
-    si = io.StringIO()
-    writer = csv.DictWriter(si, fieldnames=['id', 'date', 'customer_id', 'total', 'vat', 'paid', 'status'])
-    writer.writeheader()
-    for inv in invoices:
-        writer.writerow({
-            'id': inv.id,
-            'date': inv.date.strftime('%Y-%m-%d'),
-            'customer_id': inv.customer_id or '',
-            'total': f"{inv.total:.2f}",
-            'vat': f"{inv.vat:.2f}",
-            'paid': f"{inv.paid:.2f}",
-            'status': inv.status
-        })
-    return send_file(io.BytesIO(si.getvalue().encode('utf-8')), mimetype='text/csv', download_name='ar_invoices.csv', as_attachment=True)
+    invoices = ARInvoice.query.order_by(ARInvoice.date.desc())
+    rows = (
+        [inv.id, inv.date.strftime('%Y-%m-%d'), inv.customer_id or '',
+         f"{inv.total:.2f}", f"{inv.vat:.2f}", f"{inv.paid:.2f}", inv.status]
+        for inv in invoices.yield_per(EXPORT_CHUNK_ROWS)
+    )
+    return stream_csv('ar_invoices.csv', ['id', 'date', 'customer_id', 'total', 'vat', 'paid', 'status'], rows)
 
 
 @ar_ap_bp.route('/export/ap.csv')
 @login_required
 def export_ap_csv():
-    invoices = APInvoice.query.order_by(APInvoice.date.desc()).all()
-    si = io.StringIO()
-    writer = csv.DictWriter(si, fieldnames=['id', 'date', 'supplier_id', 'total', 'vat', 'paid', 'status'])
-    writer.writeheader()
-    for inv in invoices:
-        writer.writerow({
-            'id': inv.id,
-            'date': inv.date.strftime('%Y-%m-%d'),
-            'supplier_id': inv.supplier_id or '',
-            'total': f"{inv.total:.2f}",
-            'vat': f"{inv.vat:.2f}",
-            'paid': f"{inv.paid:.2f}",
-            'status': inv.status
-        })
-    return send_file(io.BytesIO(si.getvalue().encode('utf-8')), mimetype='text/csv', download_name='ap_invoices.csv', as_attachment=True)
+    invoices = APInvoice.query.order_by(APInvoice.date.desc())
+    rows = (
+        [inv.id, inv.date.strftime('%Y-%m-%d'), inv.supplier_id or '',
+         f"{inv.total:.2f}", f"{inv.vat:.2f}", f"{inv.paid:.2f}", inv.status]
+        for inv in invoices.yield_per(EXPORT_CHUNK_ROWS)
+    )
+    return stream_csv('ap_invoices.csv', ['id', 'date', 'supplier_id', 'total', 'vat', 'paid', 'status'], rows)
 
 @ar_ap_bp.route('/recurring-bills', methods=['GET', 'POST'])
 @login_required
@@ -765,14 +736,13 @@ def generate_recurring_bill(bill_id):
         # 2. Create the Journal Entry
         je_lines = [
             {'account_code': bill.expense_account_code, 'debit': round(inv.total - inv.vat, 2), 'credit': 0},
-            {'account_code': get_system_account_code('VAT Input'), 'debit': round(inv.vat, 2), 'credit': 0},
-            {'account_code': get_system_account_code('Accounts Payable'), 'debit': 0, 'credit': round(inv.total, 2)},
+            {'system_account': 'VAT Input', 'debit': round(inv.vat, 2), 'credit': 0},
+            {'system_account': 'Accounts Payable', 'debit': 0, 'credit': round(inv.total, 2)},
         ]
         if inv.vat == 0:
             je_lines.pop(1) # Remove VAT input line
 
-        je = JournalEntry(description=f'Recurring AP Invoice #{inv.id} - {inv.description}', entries_json=json.dumps(je_lines))
-        db.session.add(je)
+        post_journal(je_lines, f'Recurring AP Invoice #{inv.id} - {inv.description}')
 
         # 3. Update the RecurringBill's next_due_date
         today = datetime.utcnow()
@@ -0,0 +1,140 @@
+"""
+Inventory History Archive
+
+Depleted lots never change again unless a void returns stock to them, yet they
+and their consumption records would stay in inventory_lot and
+inventory_transaction forever. archive_inventory_history moves them, once their
+last activity is older than the archive horizon, into InventoryLotArchive and
+InventoryTransactionArchive, so the hot tables hold open lots and recent
+activity. Voids bring archived lots back first (restore_archived_consumption),
+so reversing an old sale works as before. Nothing else reads depleted lots:
+the stock card builds from sale, purchase, adjustment and movement rows, and the
+lots page lists open lots only.
+"""
+from datetime import datetime
+
+from sqlalchemy import delete, exists, func, insert, literal, select
+
+from models import db, InventoryLot, InventoryTransaction, InventoryLotArchive, InventoryTransactionArchive
+
+
+LOT_COLUMNS = [column.name for column in InventoryLot.__table__.columns]
+# Archived records get ids of their own; nothing points at a consumption record's id
+TRANSACTION_COLUMNS = [column.name for column in InventoryTransaction.__table__.columns if column.name != 'id']
+
+
+def archive_inventory_history(before, batch_size=1000):
+    """
+    Move every depleted lot created before `before` with no consumption since,
+    and its consumption records, to the archive tables. Committed per batch of
+    lots, so it can run alongside sales and be stopped at any point.
+
+    The newest lot stays, so SQLite (which numbers a new row after the highest
+    id in the table) never hands an archived lot's id to a new lot; a lot whose id
+    is already in the archive is left where it is.
+
+    Returns:
+        tuple: (lots archived, consumption records archived)
+    """
+    lots = InventoryLot.__table__
+    transactions = InventoryTransaction.__table__
+    newest_lot = db.session.execute(select(func.max(lots.c.id))).scalar()
+    if newest_lot is None:
+        return 0, 0
+
+    recent = exists().where(transactions.c.lot_id == lots.c.id, transactions.c.created_at >= before)
+    archived = exists().where(InventoryLotArchive.id == lots.c.id)
+    lot_total = transaction_total = 0
+    after_id = 0
+    while True:
+        lot_ids = db.session.execute(
+            select(lots.c.id).where(
+                lots.c.id > after_id,
+                lots.c.id < newest_lot,
+                lots.c.quantity_remaining == 0,
+                lots.c.created_at < before,
+                ~recent,
+                ~archived,
+            ).order_by(lots.c.id).limit(batch_size)
+        ).scalars().all()
+        if not lot_ids:
+            break
+        after_id = lot_ids[-1]
+
+        now = datetime.utcnow()
+        db.session.execute(insert(InventoryLotArchive).from_select(
+            LOT_COLUMNS + ['archived_at'],
+            select(*[lots.c[name] for name in LOT_COLUMNS], literal(now, db.DateTime)).where(lots.c.id.in_(lot_ids))
+        ))
+        moved = db.session.execute(insert(InventoryTransactionArchive).from_select(
+            TRANSACTION_COLUMNS + ['archived_at'],
+            select(*[transactions.c[name] for name in TRANSACTION_COLUMNS], literal(now, db.DateTime))
+            .where(transactions.c.lot_id.in_(lot_ids)).order_by(transactions.c.id)
+        )).rowcount
+        db.session.execute(delete(transactions).where(transactions.c.lot_id.in_(lot_ids)))
+        db.session.execute(delete(lots).where(lots.c.id.in_(lot_ids)))
+        db.session.commit()
+
+        lot_total += len(lot_ids)
+        transaction_total += moved
+
+    return lot_total, transaction_total
+
+
+def restore_archived_lots(lot_ids, batch_size=1000):
+    """
+    Move archived lots, with all their archived consumption records, back to the
+    hot tables. A lot whose id has since been taken by a new lot comes back under
+    a new id, and its records with it. The caller commits.
+
+    Returns:
+        dict: Archived lot id -> id of the lot in inventory_lot
+    """
+    restored = {}
+    lots = InventoryLot.__table__
+    archive_lots = InventoryLotArchive.__table__
+    archive_transactions = InventoryTransactionArchive.__table__
+    lot_ids = list(lot_ids)
+    for start in range(0, len(lot_ids), batch_size):
+        batch = lot_ids[start:start + batch_size]
+        rows = db.session.execute(
+            select(archive_lots).where(archive_lots.c.id.in_(batch)).order_by(archive_lots.c.id)
+        ).mappings().all()
+        if not rows:
+            continue
+        ids = [row['id'] for row in rows]
+        taken = set(db.session.execute(select(lots.c.id).where(lots.c.id.in_(ids))).scalars())
+
+        free = [{name: row[name] for name in LOT_COLUMNS} for row in rows if row['id'] not in taken]
+        if free:
+            db.session.execute(insert(lots), free)
+        restored.update((row['id'], row['id']) for row in rows if row['id'] not in taken)
+        for row in rows:
+            if row['id'] in taken:
+                values = {name: row[name] for name in LOT_COLUMNS if name != 'id'}
+                restored[row['id']] = db.session.execute(insert(lots).values(values)).inserted_primary_key[0]
+
+        records = db.session.execute(
+            select(archive_transactions).where(archive_transactions.c.lot_id.in_(ids))
+            .order_by(archive_transactions.c.id)
+        ).mappings().all()
+        if records:
+            db.session.execute(insert(InventoryTransaction.__table__), [
+                {**{name: record[name] for name in TRANSACTION_COLUMNS}, 'lot_id': restored[record['lot_id']]}
+                for record in records
+            ])
+        db.session.execute(delete(archive_transactions).where(archive_transactions.c.lot_id.in_(ids)))
+        db.session.execute(delete(archive_lots).where(archive_lots.c.id.in_(ids)))
+    return restored
+
+
+def restore_archived_consumption(sale_id=None, ar_invoice_id=None):
+    """Bring back the archived lots a sale or AR invoice consumed from, before it is voided."""
+    query = select(InventoryTransactionArchive.lot_id).distinct()
+    if sale_id:
+        query = query.where(InventoryTransactionArchive.sale_id == sale_id)
+    elif ar_invoice_id:
+        query = query.where(InventoryTransactionArchive.ar_invoice_id == ar_invoice_id)
+    else:
+        raise ValueError("Must provide either sale_id or ar_invoice_id")
+    return restore_archived_lots(db.session.execute(query).scalars().all())
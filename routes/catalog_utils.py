@@ -0,0 +1,341 @@
+"""
+POS Catalog Utilities
+"""
+import base64
+import binascii
+import json
+from datetime import datetime
+
+from sqlalchemy import (and_, delete, event, func, insert, literal, literal_column, null, or_, select, tuple_,
+                        union_all, update)
+from sqlalchemy.orm import Session
+
+from models import db, Product, ConsignmentItem, ConsignmentAvailability, InventoryLot, AverageCost, CatalogChange
+
+
+CATALOG_PAGE_SIZE = 12
+CATALOG_MAX_PAGE_SIZE = 100
+
+# Sort order of the catalog: regular products first, then consignment items, each by name
+KIND_PRODUCT = 0
+KIND_CONSIGNMENT = 1
+KIND_TYPES = {KIND_PRODUCT: 'regular', KIND_CONSIGNMENT: 'consignment'}
+
+# Fields a terminal shows or sells by; a change to any of them puts the item in the next delta
+CATALOG_FIELDS = {
+    Product: ('sku', 'name', 'sale_price', 'cost_price', 'quantity', 'is_active'),
+    ConsignmentItem: ('sku', 'product_name', 'barcode', 'retail_price', 'quantity_received',
+                      'quantity_sold', 'quantity_returned', 'quantity_damaged', 'is_active'),
+    InventoryLot: ('product_id', 'quantity_remaining'),
+    AverageCost: ('quantity',),
+}
+
+
+def consignment_available():
+    """ConsignmentItem.quantity_available, as stored in ConsignmentAvailability."""
+    return ConsignmentAvailability.quantity_available
+
+
+def consignment_sellable():
+    """
+    The condition of ix_consignment_availability_sellable, with literals rather
+    than bound parameters so SQLite matches it to the partial index.
+    """
+    return and_(ConsignmentAvailability.is_active == literal_column('1'),
+                ConsignmentAvailability.quantity_available > literal_column('0'))
+
+
+def sellable_consignment_items(query):
+    """`query` over ConsignmentItem limited to sellable items, through the partial index."""
+    return query.join_from(
+        ConsignmentItem, ConsignmentAvailability, ConsignmentAvailability.item_id == ConsignmentItem.id
+    ).where(consignment_sellable())
+
+
+def _computed_available():
+    return (ConsignmentItem.quantity_received
+            - func.coalesce(ConsignmentItem.quantity_sold, 0)
+            - func.coalesce(ConsignmentItem.quantity_returned, 0)
+            - func.coalesce(ConsignmentItem.quantity_damaged, 0))
+
+
+def check_consignment_availability(repair=False):
+    """
+    Compare the stored availability of every consignment item with
+    received - sold - returned - damaged (and its is_active). Returns the
+    mismatches as (item_id, stored quantity or None if missing, expected
+    quantity); with `repair`, the stored rows are rewritten and committed.
+    """
+    expected = _computed_available()
+    rows = db.session.execute(
+        select(ConsignmentItem.id, ConsignmentItem.consignment_id, expected, ConsignmentItem.is_active,
+               ConsignmentAvailability.item_id, ConsignmentAvailability.quantity_available,
+               ConsignmentAvailability.is_active)
+        .outerjoin(ConsignmentAvailability, ConsignmentAvailability.item_id == ConsignmentItem.id)
+        .where(or_(
+            ConsignmentAvailability.item_id.is_(None),
+            ConsignmentAvailability.quantity_available != expected,
+            ConsignmentAvailability.is_active != func.coalesce(ConsignmentItem.is_active, False),
+            ConsignmentAvailability.consignment_id != ConsignmentItem.consignment_id,
+        ))
+        .order_by(ConsignmentItem.id)
+    ).all()
+    mismatches = [(row[0], row[5] if row[4] is not None else None, row[2]) for row in rows]
+
+    orphans = db.session.execute(
+        select(ConsignmentAvailability.item_id)
+        .outerjoin(ConsignmentItem, ConsignmentItem.id == ConsignmentAvailability.item_id)
+        .where(ConsignmentItem.id.is_(None))
+    ).scalars().all()
+    mismatches += [(item_id, None, None) for item_id in orphans]
+
+    if repair and mismatches:
+        table = ConsignmentAvailability.__table__
+        if orphans:
+            db.session.execute(delete(table).where(table.c.item_id.in_(orphans)))
+        for item_id, consignment_id, available, is_active, stored_id, _, _ in rows:
+            values = {'consignment_id': consignment_id, 'quantity_available': available,
+                      'is_active': bool(is_active)}
+            if stored_id is None:
+                db.session.execute(insert(table).values(item_id=item_id, **values))
+            else:
+                db.session.execute(update(table).where(table.c.item_id == item_id).values(values))
+        db.session.commit()
+    return mismatches
+
+
+def pos_catalog(search=''):
+    """
+    Active products and consignment items with stock, as one UNION ALL subquery
+    with the columns kind, id, sku, name, barcode, price, quantity and consignment_id.
+    Search is applied inside each branch so the database filters before combining.
+    """
+    products = select(
+        literal(KIND_PRODUCT).label('kind'),
+        Product.id.label('id'),
+        Product.sku.label('sku'),
+        Product.name.label('name'),
+        null().label('barcode'),
+        Product.sale_price.label('price'),
+        Product.quantity.label('quantity'),
+        null().label('consignment_id'),
+    ).where(Product.is_active == True)
+
+    consigned = sellable_consignment_items(select(
+        literal(KIND_CONSIGNMENT).label('kind'),
+        ConsignmentItem.id,
+        ConsignmentItem.sku,
+        ConsignmentItem.product_name,
+        ConsignmentItem.barcode,
+        ConsignmentItem.retail_price,
+        consignment_available(),
+        ConsignmentItem.consignment_id,
+    ))
+
+    if search:
+        pattern = f"%{search}%"
+        products = products.where(Product.name.ilike(pattern) | Product.sku.ilike(pattern))
+        consigned = consigned.where(
+            ConsignmentItem.product_name.ilike(pattern)
+            | ConsignmentItem.sku.ilike(pattern)
+            | ConsignmentItem.barcode.ilike(pattern)
+        )
+
+    return union_all(products, consigned).subquery('pos_catalog')
+
+
+def _catalog_item(row):
+    item = {
+        'id': row.id,
+        'sku': row.sku,
+        'name': row.name,
+        'price': row.price,
+        'quantity': row.quantity,
+        'is_consignment': row.kind == KIND_CONSIGNMENT,
+        'type': KIND_TYPES[row.kind],
+    }
+    if row.kind == KIND_CONSIGNMENT:
+        item['consignment_id'] = row.consignment_id
+        item['barcode'] = row.barcode
+    return item
+
+
+def _ordered(catalog):
+    return select(catalog).order_by(catalog.c.kind, catalog.c.name, catalog.c.id)
+
+
+class CatalogPagination:
+    """Page state for the catalog, with the attributes _pagination.html expects."""
+
+    def __init__(self, page, per_page, total_count):
+        self.page = page
+        self.per_page = per_page
+        self.total = total_count
+        self.pages = (total_count + per_page - 1) // per_page if total_count > 0 else 1
+        self.has_prev = page > 1
+        self.has_next = page < self.pages
+        self.prev_num = page - 1 if self.has_prev else None
+        self.next_num = page + 1 if self.has_next else None
+
+    def iter_pages(self, left_edge=2, left_current=2, right_current=5, right_edge=2):
+        """
+        Generate page numbers for pagination display.
+        Mimics Flask-SQLAlchemy's pagination.iter_pages() method.
+        """
+        last = 0
+        for num in range(1, self.pages + 1):
+            if (num <= left_edge or
+                (num > self.page - left_current - 1 and num < self.page + right_current) or
+                num > self.pages - right_edge):
+                if last + 1 != num:
+                    yield None  # Ellipsis
+                yield num
+                last = num
+
+
+def catalog_page(search='', page=1, per_page=CATALOG_PAGE_SIZE):
+    """One page of the POS catalog by page number: (items, CatalogPagination)."""
+    page = max(page, 1)
+    catalog = pos_catalog(search)
+    total = db.session.execute(select(func.count()).select_from(catalog)).scalar_one()
+    rows = db.session.execute(
+        _ordered(catalog).limit(per_page).offset((page - 1) * per_page)
+    ).all()
+    return [_catalog_item(row) for row in rows], CatalogPagination(page, per_page, total)
+
+
+def encode_cursor(item):
+    kind = KIND_CONSIGNMENT if item['is_consignment'] else KIND_PRODUCT
+    raw = json.dumps([kind, item['name'], item['id']], separators=(',', ':'))
+    return base64.urlsafe_b64encode(raw.encode('utf-8')).decode('ascii')
+
+
+def decode_cursor(cursor):
+    """(kind, name, id) from encode_cursor; raises ValueError for anything else."""
+    try:
+        kind, name, item_id = json.loads(base64.urlsafe_b64decode(cursor.encode('ascii')))
+    except (binascii.Error, UnicodeError, TypeError, ValueError):
+        raise ValueError('Invalid cursor')
+    if kind not in (KIND_PRODUCT, KIND_CONSIGNMENT) or not isinstance(name, str) or not isinstance(item_id, int):
+        raise ValueError('Invalid cursor')
+    return kind, name, item_id
+
+
+def catalog_after(search='', cursor=None, limit=CATALOG_PAGE_SIZE):
+    """
+    Up to `limit` catalog items following `cursor` (keyset pagination), and the
+    cursor for the next call, or None after the last item. Each page costs the
+    same however deep the terminal has scrolled.
+    """
+    catalog = pos_catalog(search)
+    query = _ordered(catalog).limit(limit + 1)
+    if cursor:
+        query = query.where(
+            tuple_(catalog.c.kind, catalog.c.name, catalog.c.id) > tuple_(*decode_cursor(cursor))
+        )
+    items = [_catalog_item(row) for row in db.session.execute(query).all()]
+    if len(items) <= limit:
+        return items, None
+    items = items[:limit]
+    return items, encode_cursor(items[-1])
+
+
+def _changed_catalog_item(obj, is_new_or_deleted):
+    """The catalog (type, id) an object's change affects, or None."""
+    fields = CATALOG_FIELDS.get(type(obj))
+    if fields is None:
+        return None
+    if not is_new_or_deleted:
+        attrs = db.inspect(obj).attrs
+        if not any(attrs[name].history.has_changes() for name in fields):
+            return None
+    if isinstance(obj, (InventoryLot, AverageCost)):
+        return 'regular', obj.product_id
+    if isinstance(obj, ConsignmentItem):
+        return 'consignment', obj.id
+    return 'regular', obj.id
+
+
+@event.listens_for(Session, 'after_flush')
+def _record_catalog_changes(session, flush_context):
+    """Log every sellable item the flush changed, in the same transaction as the change."""
+    changed = set()
+    for objects, is_new_or_deleted in ((session.new, True), (session.dirty, False), (session.deleted, True)):
+        for obj in objects:
+            key = _changed_catalog_item(obj, is_new_or_deleted)
+            if key is not None and key[1] is not None:
+                changed.add(key)
+    if changed:
+        session.info['catalog_changed'] = True
+        now = datetime.utcnow()
+        session.connection().execute(insert(CatalogChange.__table__), [
+            {'kind': kind, 'item_id': item_id, 'changed_at': now} for kind, item_id in sorted(changed)
+        ])
+
+
+def catalog_version():
+    """Current catalog version: the newest CatalogChange id, 0 before any change."""
+    return db.session.execute(select(func.max(CatalogChange.id))).scalar() or 0
+
+
+def catalog_snapshot():
+    """Every sellable item, in catalog order."""
+    return [_catalog_item(row) for row in db.session.execute(_ordered(pos_catalog())).all()]
+
+
+def changed_catalog_items(since, version):
+    """
+    The distinct (type, id) of items changed after version `since` up to `version`,
+    or None when the change log no longer reaches back to `since` (or `since` is
+    from another database).
+    """
+    if since > version:
+        return None
+    oldest = db.session.execute(select(func.min(CatalogChange.id))).scalar()
+    if oldest is not None and since < oldest - 1:
+        return None
+    return db.session.execute(
+        select(CatalogChange.kind, CatalogChange.item_id)
+        .where(CatalogChange.id > since, CatalogChange.id <= version)
+        .distinct()
+    ).all()
+
+
+def catalog_delta(since, version):
+    """
+    Items changed after version `since` up to `version`: (changed items, removed),
+    where removed lists the {'type', 'id'} of items that are no longer sellable.
+    Returns None when the change log no longer reaches back to `since` (or
+    `since` is from another database) and the terminal needs a full snapshot.
+    """
+    keys = changed_catalog_items(since, version)
+    if keys is None:
+        return None
+    if not keys:
+        return [], []
+    product_ids = [item_id for kind, item_id in keys if kind == 'regular']
+    consignment_ids = [item_id for kind, item_id in keys if kind == 'consignment']
+
+    catalog = pos_catalog()
+    rows = db.session.execute(_ordered(catalog).where(or_(
+        and_(catalog.c.kind == KIND_PRODUCT, catalog.c.id.in_(product_ids)),
+        and_(catalog.c.kind == KIND_CONSIGNMENT, catalog.c.id.in_(consignment_ids)),
+    ))).all()
+    items = [_catalog_item(row) for row in rows]
+    sellable = {(item['type'], item['id']) for item in items}
+    removed = [{'type': kind, 'id': item_id} for kind, item_id in sorted(set(keys)) if (kind, item_id) not in sellable]
+    return items, removed
+
+
+def prune_catalog_changes(before):
+    """
+    Delete change log rows older than `before` and return how many went. The
+    newest row always stays so the version never goes backwards; terminals
+    that synced before the cut get a full snapshot on their next delta.
+    """
+    newest = catalog_version()
+    result = db.session.execute(
+        delete(CatalogChange).where(CatalogChange.changed_at < before, CatalogChange.id < newest)
+    )
+    db.session.commit()
+    return result.rowcount
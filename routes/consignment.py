@@ -1,8 +1,11 @@
 from flask import Blueprint, render_template, request, redirect, url_for, flash, jsonify, session
 from flask_login import login_required, current_user
-from models import db, ConsignmentSupplier, ConsignmentReceived, ConsignmentItem, ConsignmentRemittance, CompanyProfile
+from models import (db, ConsignmentSupplier, ConsignmentReceived, ConsignmentItem, ConsignmentRemittance, CompanyProfile,
+                    ConsignmentAvailability)
+from routes.catalog_utils import consignment_sellable
 from routes.decorators import role_required
 from routes.utils import paginate_query, log_action
+from routes.sequence_utils import next_document_number
 from datetime import datetime, timedelta
 from sqlalchemy import func
 from decimal import Decimal, ROUND_HALF_UP
@@ -162,14 +165,7 @@ def receive():
             supplier = ConsignmentSupplier.query.get_or_404(supplier_id)
             
             # Generate receipt number
-            from models import CompanyProfile
-            profile = CompanyProfile.query.first()
-            
-            if not hasattr(profile, 'next_consignment_number') or profile.next_consignment_number is None:
-                profile.next_consignment_number = 1
-            
-            receipt_num = profile.next_consignment_number
-            profile.next_consignment_number += 1
+            receipt_num = next_document_number('consignment')
             receipt_number = f"CONS-{receipt_num:06d}"
             
             # Calculate expected return date
@@ -253,7 +249,15 @@ def list_received():
     
     query = ConsignmentReceived.query
     
-    if status_filter != 'all':
+    if status_filter == 'due':
+        # Past the expected return date with units still on hand
+        query = query.filter(
+            ConsignmentReceived.expected_return_date < datetime.utcnow(),
+            db.session.query(ConsignmentAvailability.item_id).filter(
+                ConsignmentAvailability.consignment_id == ConsignmentReceived.id, consignment_sellable()
+            ).exists()
+        )
+    elif status_filter != 'all':
         query = query.filter_by(status=status_filter)
     
     if search:
@@ -265,11 +269,20 @@ def list_received():
     query = query.order_by(ConsignmentReceived.date_received.desc())
     pagination = paginate_query(query, per_page=20)
     
+    # Units on hand for the page's consignments, from the sellable-items index
+    on_hand = dict(db.session.query(
+        ConsignmentAvailability.consignment_id, func.sum(ConsignmentAvailability.quantity_available)
+    ).filter(
+        ConsignmentAvailability.consignment_id.in_([cons.id for cons in pagination.items]), consignment_sellable()
+    ).group_by(ConsignmentAvailability.consignment_id).all()) if pagination.items else {}
+    
     safe_args = {k: v for k, v in request.args.items() if k != 'page'}
     
     return render_template(
         'consignment/list.html',
         consignments=pagination.items,
+        on_hand=on_hand,
+        now=datetime.utcnow(),
         pagination=pagination,
         search=search,
         status_filter=status_filter,
@@ -439,28 +452,25 @@ def remit_payment(consignment_id):
             status_msg = f'✅ Partial payment recorded. Remaining: ₱{(amount_due - new_total_paid):,.2f}'
         
         # Create journal entry
-        from models import JournalEntry
-        from routes.utils import get_system_account_code
-        import json
+        from routes.posting_utils import post_journal
         
         je_lines = [
             {
-                'account_code': get_system_account_code('Consignment Payable'),
+                'system_account': 'Consignment Payable',
                 'debit': float(amount_paid),
                 'credit': 0
             },
             {
-                'account_code': get_system_account_code('Cash'),
+                'system_account': 'Cash',
                 'debit': 0,
                 'credit': float(amount_paid)
             }
         ]
         
-        journal_entry = JournalEntry(
-            description=f'Settlement for {consignment.receipt_number}: Paid {consignment.supplier.name} ₱{amount_paid:,.2f}, Returned {total_returned} items',
-            entries_json=json.dumps(je_lines)
+        post_journal(
+            je_lines,
+            f'Settlement for {consignment.receipt_number}: Paid {consignment.supplier.name} ₱{amount_paid:,.2f}, Returned {total_returned} items'
         )
-        db.session.add(journal_entry)
         
         db.session.commit()
         
@@ -512,11 +522,12 @@ def settlement_receipt(remittance_id):
     # Get all items with their final quantities
     items = ConsignmentItem.query.filter_by(consignment_id=consignment.id).all()
     
-    # Calculate totals
-    total_received = sum(item.quantity_received for item in items)
-    total_sold = sum(item.quantity_sold for item in items)
-    total_returned = sum(item.quantity_returned for item in items)
-    total_damaged = sum(item.quantity_damaged for item in items)
+    # Totals from the consignment's running counters
+    counters = consignment.get_counters()
+    total_received = counters.units_received
+    total_sold = counters.units_sold
+    total_returned = counters.units_returned
+    total_damaged = counters.units_damaged
     
     # Get all remittances for this consignment
     all_remittances = ConsignmentRemittance.query.filter_by(consignment_id=consignment.id)\
@@ -524,9 +535,9 @@ def settlement_receipt(remittance_id):
     
     total_paid = sum(r.amount_paid for r in all_remittances)
     
-    # Calculate financial summary
-    total_sold_value = consignment.get_total_sold_value()
-    commission_earned = consignment.get_commission_earned()
+    # Financial summary
+    total_sold_value = counters.sold_value
+    commission_earned = counters.commission
     amount_due_total = consignment.get_amount_due_to_supplier()
     
     return render_template(
@@ -1,12 +1,12 @@
-from flask import Blueprint, render_template, request, redirect, url_for, flash, jsonify, send_file, Response, session
+from flask import Blueprint, render_template, request, redirect, url_for, flash, jsonify, send_file, Response, session, current_app
 from models import db, User, Product, Purchase, PurchaseItem, Sale, SaleItem, JournalEntry, StockAdjustment, Account, Supplier, Branch, InventoryMovement, InventoryMovementItem
 import json
 from config import Config
 from datetime import datetime, timedelta
-from sqlalchemy import func, exc 
+from sqlalchemy import func, exc, insert 
+from sqlalchemy.orm import joinedload
 from models import Sale, CompanyProfile, User, AuditLog, Customer
 import io, csv, json
-from io import StringIO
 from routes.utils import paginate_query, log_action, get_system_account_code
 from passlib.hash import pbkdf2_sha256
 from flask_login import login_user, logout_user, login_required, current_user
@@ -14,11 +14,25 @@ from routes.decorators import role_required
 from .utils import log_action
 from extensions import limiter
 from routes.sku_utils import generate_sku
-from routes.fifo_utils import create_inventory_lot, consume_inventory_fifo
+from routes.fifo_utils import create_inventory_lot, consume_inventory_fifo, consume_inventory_fifo_batch, load_open_lots, get_fifo_costs_by_cart
+from routes.export_utils import stream_csv, EXPORT_CHUNK_ROWS
+from routes.ledger_utils import entries_with_account, account_has_postings
+from routes.posting_utils import post_journal, post_many, resolve_lines, check_balance
+from routes.sequence_utils import next_document_number, reserve_document_numbers
+from routes.group_commit_utils import begin_transaction, get_group_writer
+from routes.catalog_utils import (catalog_page, catalog_after, catalog_version, catalog_snapshot, catalog_delta,
+                                  CATALOG_PAGE_SIZE, CATALOG_MAX_PAGE_SIZE)
+from routes.lookup_index import get_lookup_index, lookup_code, lookup_product, TYPEAHEAD_LIMIT
+from routes.pricing_utils import price_cart, consignment_commission
 
 
 core_bp = Blueprint('core', __name__)
 VAT_RATE = Config.VAT_RATE
+# Queued sales pushed through /api/sales/batch: most sales per request, and sales per committed chunk
+SALE_BATCH_LIMIT = 1000
+SALE_BATCH_CHUNK = 50
+# Seconds api_sale waits for the group-commit writer before giving up
+SALE_GROUP_COMMIT_TIMEOUT = 30
 
 
 @core_bp.route('/setup/license', methods=['GET', 'POST'])
@@ -93,13 +107,17 @@ def index():
     low_stock = [p for p in products if p.quantity <= 5 and p.is_active]
 
     # --- 📊 INVENTORY VALUE: Calculate from FIFO lots (not product.cost_price) ---
-    from models import InventoryLot
+    from models import InventoryLot, AverageCost
     total_inventory_value = db.session.query(
         func.sum(InventoryLot.quantity_remaining * InventoryLot.unit_cost)
     ).join(Product).filter(
         Product.is_active == True,
         InventoryLot.quantity_remaining > 0
     ).scalar() or 0.0
+    # ...plus the running value of products costed at moving average
+    total_inventory_value += db.session.query(
+        func.sum(AverageCost.value)
+    ).join(Product).filter(Product.is_active == True).scalar() or 0.0
     
     products_in_stock = Product.query.filter(Product.quantity > 0, Product.is_active == True).count()
 
@@ -149,7 +167,7 @@ def index():
     total_purchases = total_cash_purchases + total_ap_purchases
 
     # --- 📊 CALCULATE TRUE NET INCOME FROM ACCOUNTING RECORDS ---
-    from routes.reports import aggregate_account_balances
+    from routes.statements import aggregate_account_balances
     
     end_date = None
     if period != 'all':
@@ -378,9 +396,7 @@ def inventory():
     all_active_products = Product.query.filter_by(is_active=True).order_by(Product.name.asc()).all()
 
 
-    has_opening_balance = db.session.query(JournalEntry.id)\
-        .filter(JournalEntry.entries_json.ilike('%"account_code": "302"%'))\
-        .first() is not None
+    has_opening_balance = account_has_postings('302')
     
     return render_template(
         'inventory.html',
@@ -563,11 +579,7 @@ def inventory_bulk_add():
                             {'account_code': inventory_code, 'debit': initial_value, 'credit': 0},
                             {'account_code': equity_code, 'debit': 0, 'credit': initial_value}
                         ]
-                        je = JournalEntry(
-                            description=f'Beginning Balance for {new_prod.sku} ({new_prod.name})',
-                            entries_json=json.dumps(je_lines)
-                        )
-                        db.session.add(je)
+                        post_journal(je_lines, f'Beginning Balance for {new_prod.sku} ({new_prod.name})')
                     
                     db.session.commit()
                     products_added += 1
@@ -715,6 +727,7 @@ def api_add_multiple_products():
     new_product_count = 0
     total_value = 0.0
     errors = []
+    opening_entries = []
     
     try:
         # --- REFACTORED: Get codes once ---
@@ -760,11 +773,7 @@ def api_add_multiple_products():
                         {'account_code': inventory_code, 'debit': initial_value, 'credit': 0},
                         {'account_code': equity_code, 'debit': 0, 'credit': initial_value}
                     ]
-                    je = JournalEntry(
-                        description=f'Beginning Balance for {new_prod.sku} ({new_prod.name})',
-                        entries_json=json.dumps(je_lines)
-                    )
-                    db.session.add(je)
+                    opening_entries.append((je_lines, f'Beginning Balance for {new_prod.sku} ({new_prod.name})'))
                 # --- END OF NEW BLOCK ---
                 
                 new_product_count += 1
@@ -772,6 +781,8 @@ def api_add_multiple_products():
             except ValueError:
                 errors.append(f"Invalid number for SKU '{sku}'. Skipped.")
             
+        # All beginning balances post in one flush
+        post_many(opening_entries)
         db.session.commit()
         
         log_action(f'Bulk-added {new_product_count} products with total beginning value of {total_value}.')
@@ -803,6 +814,7 @@ def api_products_search():
     Returns JSON array of matching products.
     """
     query = request.args.get('q', '').strip()
+    results = []
     
     if query == '':
         # Return all active products if no search query (limited to 100)
@@ -811,16 +823,28 @@ def api_products_search():
             .limit(100)\
             .all()
     else:
-        # Search by SKU or name
-        products = Product.query.filter(
-            (Product.sku.ilike(f'%{query}%')) |
-            (Product.name.ilike(f'%{query}%'))
-        ).filter_by(is_active=True)\
-        .order_by(Product.name.asc())\
-        .limit(50)\
-        .all()
+        # SKU/name prefix matches come from the in-memory lookup index; the
+        # substring search in the database only tops the list up to 50
+        results = [{
+            'id': e['id'],
+            'sku': e['sku'],
+            'name': e['name'],
+            'quantity': e['quantity'],
+            'cost_price': float(e['cost_price']),
+            'sale_price': float(e['price'])
+        } for e in get_lookup_index().typeahead(query, limit=50, kind='regular')]
+        products = []
+        if len(results) < 50:
+            products = Product.query.filter(
+                (Product.sku.ilike(f'%{query}%')) |
+                (Product.name.ilike(f'%{query}%'))
+            ).filter_by(is_active=True)\
+            .filter(Product.id.notin_([r['id'] for r in results]))\
+            .order_by(Product.name.asc())\
+            .limit(50 - len(results))\
+            .all()
     
-    results = [{
+    results += [{
         'id': p.id,
         'sku': p.sku,
         'name': p.name,
@@ -960,21 +984,17 @@ def purchase():
             # Create Journal Entry
             if purchase_is_vatable:
                 journal_lines = [
-                    {"account_code": get_system_account_code('Inventory'), "debit": round(total - vat_total, 2), "credit": 0},
-                    {"account_code": get_system_account_code('VAT Input'), "debit": round(vat_total, 2), "credit": 0},
-                    {"account_code": get_system_account_code('Accounts Payable'), "debit": 0, "credit": round(total, 2)}
+                    {"system_account": "Inventory", "debit": round(total - vat_total, 2), "credit": 0},
+                    {"system_account": "VAT Input", "debit": round(vat_total, 2), "credit": 0},
+                    {"system_account": "Accounts Payable", "debit": 0, "credit": round(total, 2)}
                 ]
             else:
                 journal_lines = [
-                    {"account_code": get_system_account_code('Inventory'), "debit": round(total, 2), "credit": 0},
-                    {"account_code": get_system_account_code('Accounts Payable'), "debit": 0, "credit": round(total, 2)}
+                    {"system_account": "Inventory", "debit": round(total, 2), "credit": 0},
+                    {"system_account": "Accounts Payable", "debit": 0, "credit": round(total, 2)}
                 ]
 
-            journal = JournalEntry(
-                description=f"Purchase #{purchase.id} - {supplier_name}",
-                entries_json=json.dumps(journal_lines)
-            )
-            db.session.add(journal)
+            post_journal(journal_lines, f"Purchase #{purchase.id} - {supplier_name}")
             
             log_action(f'Recorded Purchase #{purchase.id} from {supplier_name} for ₱{total:,.2f}.')
             db.session.commit()
@@ -1036,17 +1056,13 @@ def cancel_purchase(purchase_id):
         # 3. Create the reversing journal entry
         # Include VAT Input reversal only when the original purchase had VAT
         journal_lines = [
-            {"account_code": get_system_account_code('Accounts Payable'), "debit": total, "credit": 0},
-            {"account_code": get_system_account_code('Inventory'), "debit": 0, "credit": total_net},
+            {"system_account": "Accounts Payable", "debit": total, "credit": 0},
+            {"system_account": "Inventory", "debit": 0, "credit": total_net},
         ]
         if total_vat and total_vat > 0:
-            journal_lines.append({"account_code": get_system_account_code('VAT Input'), "debit": 0, "credit": total_vat})
+            journal_lines.append({"system_account": "VAT Input", "debit": 0, "credit": total_vat})
 
-        journal = JournalEntry(
-            description=f"Reversal/Cancel of Purchase #{purchase.id} - {purchase.supplier}",
-            entries_json=json.dumps(journal_lines)
-        )
-        db.session.add(journal)
+        post_journal(journal_lines, f"Reversal/Cancel of Purchase #{purchase.id} - {purchase.supplier}")
 
         # --- 4. Reverse Product Quantities ---
         # We do not touch the average cost_price.
@@ -1085,100 +1101,12 @@ def view_purchase(purchase_id):
 @login_required
 @role_required('Admin', 'Cashier')
 def pos():
-    from models import ConsignmentItem
-    
     # --- Handle GET (view with pagination and search) ---
     search = request.args.get('search', '').strip()
-    
-    # Query regular products
-    product_query = Product.query.filter_by(is_active=True)
-    
-    # Query consignment items
-    consignment_query = ConsignmentItem.query.filter_by(is_active=True)
-    
-    if search:
-        product_query = product_query.filter(
-            (Product.name.ilike(f"%{search}%")) |
-            (Product.sku.ilike(f"%{search}%"))
-        )
-        consignment_query = consignment_query.filter(
-            (ConsignmentItem.product_name.ilike(f"%{search}%")) |
-            (ConsignmentItem.sku.ilike(f"%{search}%")) |
-            (ConsignmentItem.barcode.ilike(f"%{search}%"))
-        )
-    
-    # Get regular products (order by name)
-    products = product_query.order_by(Product.name.asc()).all()
-    
-    # Get consignment items with available quantity
-    consignment_items_raw = consignment_query.all()
-    consignment_items = [item for item in consignment_items_raw if item.quantity_available > 0]
-    
-    # Combine into unified list for display
-    combined_items = []
-    
-    # Add regular products
-    for p in products:
-        combined_items.append({
-            'id': p.id,
-            'sku': p.sku,
-            'name': p.name,
-            'price': p.sale_price,
-            'quantity': p.quantity,
-            'is_consignment': False,
-            'type': 'regular'
-        })
-    
-    # Add consignment items
-    for c in consignment_items:
-        combined_items.append({
-            'id': c.id,
-            'sku': c.sku,
-            'name': c.product_name,
-            'price': c.retail_price,
-            'quantity': c.quantity_available,
-            'is_consignment': True,
-            'consignment_id': c.consignment_id,
-            'type': 'consignment'
-        })
-    
-    # Manual pagination for combined list
-    per_page = 12
     page = request.args.get('page', 1, type=int)
-    total_items = len(combined_items)
-    total_pages = (total_items + per_page - 1) // per_page if total_items > 0 else 1
-    start_idx = (page - 1) * per_page
-    end_idx = start_idx + per_page
-    paginated_items = combined_items[start_idx:end_idx]
-    
-    # ✅ FIXED: Complete Pagination class with iter_pages method
-    class Pagination:
-        def __init__(self, page, per_page, total_count, total_pages):
-            self.page = page
-            self.per_page = per_page
-            self.total = total_count
-            self.pages = total_pages
-            self.has_prev = page > 1
-            self.has_next = page < total_pages
-            self.prev_num = page - 1 if self.has_prev else None
-            self.next_num = page + 1 if self.has_next else None
-        
-        def iter_pages(self, left_edge=2, left_current=2, right_current=5, right_edge=2):
-            """
-            Generate page numbers for pagination display.
-            Mimics Flask-SQLAlchemy's pagination.iter_pages() method.
-            """
-            last = 0
-            for num in range(1, self.pages + 1):
-                if (num <= left_edge or 
-                    (num > self.page - left_current - 1 and num < self.page + right_current) or
-                    num > self.pages - right_edge):
-                    if last + 1 != num:
-                        yield None  # Ellipsis
-                    yield num
-                    last = num
-    
-    pagination = Pagination(page, per_page, total_items, total_pages)
+
+    # Products and available consignment items are combined, ordered and paged in SQL
+    paginated_items, pagination = catalog_page(search, page)
     safe_args = {k: v for k, v in request.args.items() if k != 'page'}
 
     return render_template(
@@ -1191,381 +1119,540 @@ def pos():
     )
 
 
-# (only the api_sale function is shown — replace the existing api_sale in routes/core.py with this)
-# Update the api_sale function (around line 700)
+@core_bp.route('/api/pos/catalog')
+@login_required
+@role_required('Admin', 'Cashier')
+def api_pos_catalog():
+    """
+    The POS catalog as JSON, for fetching pages without reloading the POS.
+    Pass `cursor` (from the previous response's next_cursor) to page by keyset,
+    or `page` for numbered pages with totals.
+    """
+    search = request.args.get('search', '').strip()
+    per_page = min(max(request.args.get('per_page', CATALOG_PAGE_SIZE, type=int), 1), CATALOG_MAX_PAGE_SIZE)
+
+    if 'page' in request.args:
+        items, pagination = catalog_page(search, request.args.get('page', 1, type=int), per_page)
+        return jsonify({
+            'items': items,
+            'page': pagination.page,
+            'pages': pagination.pages,
+            'total': pagination.total,
+            'has_next': pagination.has_next,
+        })
+
+    try:
+        items, next_cursor = catalog_after(search, request.args.get('cursor'), per_page)
+    except ValueError as e:
+        return jsonify({'error': str(e)}), 400
+    return jsonify({'items': items, 'next_cursor': next_cursor})
+
 
-@core_bp.route('/api/sale', methods=['POST'])
+@core_bp.route('/api/pos/catalog/snapshot')
 @login_required
-def api_sale():
-    # Import FIFO utilities at the top of the function
-    from routes.fifo_utils import consume_inventory_fifo
-    
-    data = request.json or {}
-    items = data.get('items', [])
-    sale_is_vatable = bool(data.get('is_vatable', False))
-    doc_type = data.get('doc_type', 'Invoice')
+@role_required('Admin', 'Cashier')
+def api_pos_catalog_snapshot():
+    """
+    Every sellable item with the catalog version, for terminals that keep a local
+    catalog and search it themselves. With `since=<version>` only items changed
+    after that version come back (plus `removed` for ones no longer sellable),
+    unless the change log no longer reaches back that far, which gives a full
+    snapshot again (`full: true`). Unchanged catalogs answer 304 to If-None-Match.
+    """
+    since = request.args.get('since', type=int)
+    version = catalog_version()
+    etag = f'catalog-{version}' if since is None else f'catalog-{since}-{version}'
+    if request.if_none_match.contains(etag):
+        response = current_app.response_class(status=304)
+    else:
+        delta = catalog_delta(since, version) if since is not None else None
+        if delta is None:
+            response = jsonify({'version': version, 'full': True, 'items': catalog_snapshot()})
+        else:
+            items, removed = delta
+            response = jsonify({'version': version, 'full': False, 'since': since, 'items': items, 'removed': removed})
+    response.set_etag(etag)
+    response.headers['Cache-Control'] = 'private, no-cache'
+    return response
+
+
+@core_bp.route('/api/pos/lookup/<path:code>')
+@login_required
+@role_required('Admin', 'Cashier')
+def api_pos_lookup(code):
+    """Scan-to-price: the sellable item with this exact SKU or barcode."""
+    item = lookup_code(code)
+    if not item:
+        return jsonify({'error': 'Item not found'}), 404
+    fields = ('type', 'id', 'sku', 'name', 'barcode', 'price', 'quantity', 'is_consignment', 'consignment_id')
+    return jsonify({k: item[k] for k in fields if k in item})
+
+
+@core_bp.route('/api/pos/typeahead')
+@login_required
+@role_required('Admin', 'Cashier')
+def api_pos_typeahead():
+    """Sellable items whose SKU, barcode or name starts with `q`."""
+    query = request.args.get('q', '').strip()
+    if not query:
+        return jsonify([])
+    limit = min(max(request.args.get('limit', TYPEAHEAD_LIMIT, type=int), 1), CATALOG_MAX_PAGE_SIZE)
+    fields = ('type', 'id', 'sku', 'name', 'barcode', 'price', 'quantity', 'is_consignment', 'consignment_id')
+    return jsonify([{k: item[k] for k in fields if k in item}
+                    for item in get_lookup_index().typeahead(query, limit=limit)])
+
+
+class SaleError(Exception):
+    """A POS sale that cannot be recorded as sent; `status` is the HTTP status to answer with."""
+
+    def __init__(self, message, status=400):
+        super().__init__(message)
+        self.status = status
+
+
+def _as_int(value):
+    """int(value), or None for missing or malformed ids from the POS payload."""
+    try:
+        return int(value)
+    except (TypeError, ValueError):
+        return None
+
+
+def _load_sale_snapshot(carts):
+    """
+    Products by SKU and consignment items by id for every line of the given carts,
+    one IN query per item kind instead of a lookup per line.
+    """
+    from models import ConsignmentItem
+
+    lines = [it for items in carts for it in items]
+    product_skus = {it.get('sku') for it in lines if not it.get('is_consignment', False)}
+    products_by_sku = {p.sku: p for p in Product.query.filter(Product.sku.in_(product_skus))} if product_skus else {}
+    consignment_ids = {_as_int(it.get('consignment_item_id')) for it in lines if it.get('is_consignment', False)}
+    consignment_items = {
+        ci.id: ci for ci in ConsignmentItem.query.filter(ConsignmentItem.id.in_(consignment_ids))
+    } if consignment_ids else {}
+    return products_by_sku, consignment_items
+
+
+def _sale_terms(data):
+    """(is_vatable, discount_type, discount_input) of a POS sale payload."""
     discount = data.get('discount') or {}
-    
     # ✅ FIX: Added 'sc_pwd' as a potential discount type
     discount_type = discount.get('type') or None # 'percent', 'fixed', or 'sc_pwd'
     discount_input = float(discount.get('input_value') or 0) if discount.get('input_value') is not None else 0.0
+    return bool(data.get('is_vatable', False)), discount_type, discount_input
 
-    customer_name = (data.get('customer_name') or '').strip() or 'Walk-in'
 
+def _resolve_sale_lines(items, products_by_sku, consignment_items):
+    """
+    Check a cart's lines against the snapshot from _load_sale_snapshot and return
+    them in cart order with their product or consignment item, qty and unit price.
+
+    Raises:
+        SaleError: If the cart is empty or a line cannot be sold
+    """
     if not items:
-        return jsonify({'error': 'No items in sale'}), 400
+        raise SaleError('No items in sale')
 
-    try:
-        profile = CompanyProfile.query.first()
-        if not profile:
-            return jsonify({'error': 'Company profile not set up in settings'}), 500
+    processed = []
+    requested = {}
 
-        if not hasattr(profile, 'next_invoice_number') or profile.next_invoice_number is None:
-            profile.next_invoice_number = max(getattr(profile, 'next_or_number', 1) or 1,
-                                              getattr(profile, 'next_si_number', 1) or 1)
+    for it in items:
+        sku = it.get('sku')
+        try:
+            qty = int(it.get('qty') or 0)
+        except (TypeError, ValueError):
+            qty = 0
+        if qty <= 0:
+            raise SaleError(f'Invalid quantity for SKU {sku}')
+
+        is_consignment = it.get('is_consignment', False)
+        product = consignment_item = None
+
+        if is_consignment:
+            # Handle consignment item
+            consignment_item = consignment_items.get(_as_int(it.get('consignment_item_id')))
+            
+            if not consignment_item:
+                raise SaleError(f'Consignment item {sku} not found', 404)
+            
+            if consignment_item.quantity_available < qty:
+                raise SaleError(f'Insufficient consignment stock for {consignment_item.product_name}')
+            
+            unit_price = float(consignment_item.retail_price)
+            product_name = consignment_item.product_name
+            product_sku = consignment_item.sku
+            
+        else:
+            # Handle regular product
+            product = products_by_sku.get(sku)
+            if not product:
+                raise SaleError(f'Product {sku} not found', 404)
+            # The same SKU may be on several lines; check stock against the cart total
+            requested[product.id] = requested.get(product.id, 0) + qty
+            if product.quantity < requested[product.id]:
+                raise SaleError(f'Insufficient stock for {product.name}')
+
+            unit_price = float(product.sale_price)
+            product_name = product.name
+            product_sku = product.sku
+
+        processed.append({
+            'product': product,
+            'consignment_item': consignment_item,
+            'qty': qty,
+            'unit_price': unit_price,
+            'line_gross': 0.0,  # Set by _price_sale_lines
+            'cogs': 0.0,  # No COGS for consignment; FIFO fills in regular lines
+            'is_consignment': is_consignment,
+            'product_name': product_name,
+            'product_sku': product_sku
+        })
 
-        doc_num = profile.next_invoice_number
-        profile.next_invoice_number += 1
-        full_doc_number = f"INV-{doc_num:06d}"
+    return processed
 
-        sale = Sale(total=0, vat=0, document_number=full_doc_number, document_type=doc_type,
-                    is_vatable=sale_is_vatable, customer_name=customer_name,
-                    discount_type=discount_type, discount_input=discount_input)
-        db.session.add(sale)
-        db.session.flush()
 
-        subtotal_gross = 0.0
-        total_cogs = 0.0
-        processed = []
+def _price_sale_lines(processed, is_vatable, discount_type, discount_input):
+    """Run resolved lines through the pricing kernel; sets each line's line_gross and returns the totals."""
+    totals = price_cart([(p['unit_price'], p['qty'], p['is_consignment']) for p in processed],
+                        is_vatable, discount_type, discount_input, VAT_RATE)
+    for p, gross in zip(processed, totals['line_gross']):
+        p['line_gross'] = gross
+    return totals
 
-        for it in items:
-            sku = it.get('sku')
-            try:
-                qty = int(it.get('qty') or 0)
-            except (TypeError, ValueError):
-                qty = 0
-            if qty <= 0:
-                db.session.rollback()
-                return jsonify({'error': f'Invalid quantity for SKU {sku}'}), 400
 
-            from models import ConsignmentItem, ConsignmentSale, ConsignmentSaleItem
-            is_consignment = it.get('is_consignment', False)
+def _sale_commission(processed):
+    return consignment_commission([
+        (p['consignment_item'].consignment_id, p['line_gross'], p['consignment_item'].consignment.commission_rate)
+        for p in processed if p['is_consignment']
+    ])
 
-            if is_consignment:
-                # Handle consignment item
-                consignment_item_id = it.get('consignment_item_id')
-                consignment_item = ConsignmentItem.query.get(consignment_item_id)
-                
-                if not consignment_item:
-                    db.session.rollback()
-                    return jsonify({'error': f'Consignment item {sku} not found'}), 404
-                
-                if consignment_item.quantity_available < qty:
-                    db.session.rollback()
-                    return jsonify({'error': f'Insufficient consignment stock for {consignment_item.product_name}'}), 400
-                
-                unit_price = float(consignment_item.retail_price)
-                line_gross = round(unit_price * qty, 2)
-                line_cogs = 0.0  # No COGS for consignment (we don't own it)
-                
-                product_name = consignment_item.product_name
-                product_sku = consignment_item.sku
-                
-            else:
-                # Handle regular product
-                product = Product.query.filter_by(sku=sku).first()
-                if not product:
-                    db.session.rollback()
-                    return jsonify({'error': f'Product {sku} not found'}), 404
-                if product.quantity < qty:
-                    db.session.rollback()
-                    return jsonify({'error': f'Insufficient stock for {product.name}'}), 400
 
-                unit_price = float(product.sale_price)
-                line_gross = round(unit_price * qty, 2)
-                
-                try:
-                    line_cogs, _ = consume_inventory_fifo(
-                        product_id=product.id,
-                        quantity_needed=qty,
-                        sale_id=sale.id,
-                        sale_item_id=None 
-                    )
-                except ValueError as e:
-                    db.session.rollback()
-                    return jsonify({'error': str(e)}), 400
-                
-                product_name = product.name
-                product_sku = product.sku
-
-            processed.append({
-                'product': product if not is_consignment else None,
-                'consignment_item': consignment_item if is_consignment else None,
-                'qty': qty,
-                'unit_price': unit_price,
-                'line_gross': line_gross,
-                'cogs': line_cogs,
-                'is_consignment': is_consignment,
-                'product_name': product_name,
-                'product_sku': product_sku
-            })
-
-            subtotal_gross += line_gross
-            total_cogs += line_cogs
+def _quote_sale(data, processed, regular_cogs):
+    """
+    What api_sale would charge for this cart (its lines resolved by
+    _resolve_sale_lines), with the FIFO-estimated COGS of its regular lines in
+    `regular_cogs` (see get_fifo_costs_by_cart) and the margin. Writes nothing.
+    """
+    is_vatable, discount_type, discount_input = _sale_terms(data)
+    totals = _price_sale_lines(processed, is_vatable, discount_type, discount_input)
+
+    regular = [p for p in processed if not p['is_consignment']]
+    for p, cogs in zip(regular, regular_cogs):
+        p['cogs'] = cogs
+    total_cogs = round(sum(p['cogs'] for p in regular), 2)
+    commission = _sale_commission(processed)
+
+    return {
+        'lines': [{
+            'sku': p['product_sku'],
+            'name': p['product_name'],
+            'qty': p['qty'],
+            'unit_price': p['unit_price'],
+            'line_total': p['line_gross'],
+            'is_consignment': p['is_consignment'],
+            'cogs_estimate': p['cogs'],
+        } for p in processed],
+        'subtotal': round(totals['subtotal'], 2),
+        'discount_value': totals['discount'],
+        'vatable_sales': round(totals['regular_net'] + totals['consignment_net'], 2) if is_vatable else 0.0,
+        'vat': totals['vat'],
+        'total': totals['total'],
+        'cogs_estimate': total_cogs,
+        'commission': commission,
+        'margin': round(totals['regular_net'] + commission - total_cogs, 2),
+    }
+
+
+def _record_sale(data, products_by_sku, consignment_items, lots=None, journal=None, user=None, ip_address=None):
+    """
+    Record one POS sale from its JSON payload and return the receipt details.
+    Products and consignment items come from a snapshot loaded by _load_sale_snapshot;
+    `lots` is an optional open-lot snapshot (see load_open_lots) shared by several sales.
+    If a `journal` list is given, the sale's (lines, description) entry is appended
+    to it for the caller to post with post_many instead of being posted here.
+    `user` and `ip_address` are for the audit log when recording outside the request.
+    The caller commits.
+
+    Raises:
+        SaleError: If the cart is empty or a line cannot be sold
+    """
+    sale_is_vatable, discount_type, discount_input = _sale_terms(data)
+    doc_type = data.get('doc_type', 'Invoice')
+    customer_name = (data.get('customer_name') or '').strip() or 'Walk-in'
 
-        # ✅ FIX: Complete refactor of discount and VAT logic to be BIR-compliant
-        # This new block correctly handles SC/PWD discounts while keeping
-        # promo/fixed discounts functional. It also fixes the JE balancing.
+    processed = _resolve_sale_lines(data.get('items', []), products_by_sku, consignment_items)
+    totals = _price_sale_lines(processed, sale_is_vatable, discount_type, discount_input)
+    total_amount = totals['total']
+    vat_after = totals['vat']
+    resolved_discount = totals['discount']
 
-        resolved_discount = 0.0
-        
-        # 1. Calculate totals for regular items
-        regular_sales_gross = sum(p['line_gross'] for p in processed if not p['is_consignment'])
-        
-        # 2. Calculate totals for consignment items
-        consignment_sales_gross = sum(p['line_gross'] for p in processed if p['is_consignment'])
-
-        # 3. Handle different discount types
-        if discount_type == 'sc_pwd' and sale_is_vatable:
-            # --- SC/PWD LOGIC ---
-            # Assumes SC/PWD discount applies to VATable regular items only.
-            # Consignment items are not discounted in this case.
-            
-            regular_sales_net_base = round(regular_sales_gross / (1 + VAT_RATE), 2)
-            pct = max(0.0, min(100.0, float(discount_input))) # Should be 20
-            
-            resolved_discount = round(regular_sales_net_base * (pct / 100.0), 2)
+    total_cogs = 0.0
+    fifo_demands = [(index, p['product'], p['qty']) for index, p in enumerate(processed) if not p['is_consignment']]
+
+    # The cart is valid: only now take a document number and write the sale, with its final totals
+    doc_num = next_document_number('invoice')
+    full_doc_number = f"INV-{doc_num:06d}"
+
+    sale = Sale(total=total_amount, vat=vat_after, document_number=full_doc_number, document_type=doc_type,
+                is_vatable=sale_is_vatable, customer_name=customer_name,
+                discount_type=discount_type, discount_input=discount_input,
+                discount_value=resolved_discount)
+    db.session.add(sale)
+    db.session.flush()
+
+    # Cost all regular lines in one FIFO pass over the cart
+    if fifo_demands:
+        try:
+            cart_cogs = consume_inventory_fifo_batch(
+                [(product, qty) for _, product, qty in fifo_demands],
+                sale_id=sale.id,
+                lots=lots
+            )
+        except ValueError as e:
+            raise SaleError(str(e))
+        for (index, _, _), line_cogs in zip(fifo_demands, cart_cogs):
+            processed[index]['cogs'] = line_cogs
+            total_cogs += line_cogs
+
+    # Insert sale items (one bulk insert) and deduct stock
+    sale_item_rows = []
+    consignments = set()
+    for p in processed:
+        if p['is_consignment']:
+            # Handle consignment item sale
+            consignment_item = p['consignment_item']
             
-            regular_sales_final_price = round(regular_sales_net_base - resolved_discount, 2)
-            regular_sales_vat_final = 0.0 # SC/PWD sales are VAT-Exempt
-            regular_sales_net_final = regular_sales_final_price
+            # Create sale item (with product_id = None for consignment)
+            sale_item_rows.append(dict(
+                sale_id=sale.id,
+                product_id=None,  # No product_id for consignment items
+                product_name=p['product_name'],
+                sku=p['product_sku'],
+                qty=p['qty'],
+                unit_price=p['unit_price'],
+                line_total=p['line_gross'],
+                cogs=0.0  # No COGS for consignment
+            ))
             
-            # Consignment items are unaffected
-            consignment_sales_final_price = consignment_sales_gross
-            # (We assume consignment VAT logic follows main flag)
-            if sale_is_vatable:
-                consignment_vat_final = round(consignment_sales_final_price * (VAT_RATE / (1 + VAT_RATE)), 2)
-            else:
-                consignment_vat_final = 0.0
-            consignment_net_final = round(consignment_sales_final_price - consignment_vat_final, 2)
+            # Update consignment item quantity
+            consignment_item.quantity_sold += p['qty']
+            consignments.add(consignment_item.consignment)
             
-            # Final totals
-            total_amount = round(regular_sales_final_price + consignment_sales_final_price, 2)
-            vat_after = round(regular_sales_vat_final + consignment_vat_final, 2)
-
         else:
-            # --- STANDARD DISCOUNT LOGIC (Percent or Fixed) ---
-            if discount_type and discount_input:
-                if discount_type == 'percent':
-                    pct = max(0.0, min(100.0, float(discount_input)))
-                    resolved_discount = round(subtotal_gross * (pct / 100.0), 2)
-                else: # 'fixed'
-                    resolved_discount = round(min(subtotal_gross, float(discount_input)), 2)
-            
-            # Apportion discount proportionally
-            if subtotal_gross > 0:
-                regular_discount_share = round(resolved_discount * (regular_sales_gross / subtotal_gross), 2)
-                consignment_discount_share = round(resolved_discount * (consignment_sales_gross / subtotal_gross), 2)
-            else:
-                regular_discount_share = 0.0
-                consignment_discount_share = 0.0
+            # Handle regular product
+            product = p['product']
+            sale_item_rows.append(dict(
+                sale_id=sale.id,
+                product_id=product.id,
+                product_name=product.name,
+                sku=product.sku,
+                qty=p['qty'],
+                unit_price=p['unit_price'],
+                line_total=p['line_gross'],
+                cogs=p['cogs']
+            ))
+            product.quantity -= p['qty']
+
+    db.session.execute(insert(SaleItem), sale_item_rows)
+    if consignments:
+        # Update consignment status from its counters, brought up to date by the flush
+        db.session.flush()
+        for consignment in consignments:
+            consignment.update_status()
 
-            # Calculate finals for regular items
-            regular_sales_post_discount = regular_sales_gross - regular_discount_share
-            if sale_is_vatable:
-                 regular_sales_vat_final = round(regular_sales_post_discount * (VAT_RATE / (1 + VAT_RATE)), 2)
-            else:
-                 regular_sales_vat_final = 0.0
-            regular_sales_net_final = round(regular_sales_post_discount - regular_sales_vat_final, 2)
-            
-            # Calculate finals for consignment items
-            consignment_sales_post_discount = consignment_sales_gross - consignment_discount_share
-            if sale_is_vatable:
-                consignment_vat_final = round(consignment_sales_post_discount * (VAT_RATE / (1 + VAT_RATE)), 2)
-            else:
-                consignment_vat_final = 0.0
-            consignment_net_final = round(consignment_sales_post_discount - consignment_vat_final, 2)
+    # Consignment commission (based on pre-discount gross)
+    consignment_sales_total = totals['consignment_gross']
+    consignment_commission_total = _sale_commission(processed)
 
-            # Final totals
-            vat_after = round(regular_sales_vat_final + consignment_vat_final, 2)
-            total_amount = round(regular_sales_post_discount + consignment_sales_post_discount, 2)
+    # ✅ FIX: Journal Entry logic refactored to be balanced and correct
+    je_lines = []
 
-        # --- Update Sale object with final calculated totals ---
-        sale.discount_value = resolved_discount
-        sale.total = total_amount
-        sale.vat = vat_after
-        db.session.flush()
+    # 1. Cash received
+    je_lines.append({'account_code': get_system_account_code('Cash'), 'debit': float(total_amount), 'credit': 0})
 
-        # Insert sale items and deduct stock
-        for p in processed:
-            if p['is_consignment']:
-                # Handle consignment item sale
-                consignment_item = p['consignment_item']
-                
-                # Create sale item (with product_id = None for consignment)
-                sale_item = SaleItem(
-                    sale_id=sale.id,
-                    product_id=None,  # No product_id for consignment items
-                    product_name=p['product_name'],
-                    sku=p['product_sku'],
-                    qty=p['qty'],
-                    unit_price=p['unit_price'],
-                    line_total=p['line_gross'],
-                    cogs=0.0  # No COGS for consignment
-                )
-                db.session.add(sale_item)
-                
-                # Update consignment item quantity
-                consignment_item.quantity_sold += p['qty']
-                
-                # Update consignment status if needed
-                consignment = consignment_item.consignment
-                total_received = sum(item.quantity_received for item in consignment.items)
-                total_sold = sum(item.quantity_sold for item in consignment.items)
-                total_returned = sum(item.quantity_returned for item in consignment.items)
-                
-                if total_sold + total_returned >= total_received:
-                    consignment.status = 'Closed'
-                elif total_sold > 0 or total_returned > 0:
-                    consignment.status = 'Partial'
-                
-            else:
-                # Handle regular product
-                product = p['product']
-                sale_item = SaleItem(
-                    sale_id=sale.id,
-                    product_id=product.id,
-                    product_name=product.name,
-                    sku=product.sku,
-                    qty=p['qty'],
-                    unit_price=p['unit_price'],
-                    line_total=p['line_gross'],
-                    cogs=p['cogs']
-                )
-                db.session.add(sale_item)
-                product.quantity -= p['qty']
-
-        # Calculate consignment commission (based on pre-discount gross)
-        consignment_sales_total = sum(p['line_gross'] for p in processed if p['is_consignment'])
-        consignment_commission_total = 0.0
-
-        if consignment_sales_total > 0:
-            # Group consignment sales by consignment_id
-            consignment_groups = {}
-            for p in processed:
-                if p['is_consignment']:
-                    cons_id = p['consignment_item'].consignment_id
-                    if cons_id not in consignment_groups:
-                        consignment = p['consignment_item'].consignment
-                        consignment_groups[cons_id] = {
-                            'consignment': consignment,
-                            'total': 0.0
-                        }
-                    consignment_groups[cons_id]['total'] += p['line_gross']
-            
-            # Calculate commission for each consignment
-            for cons_id, group in consignment_groups.items():
-                commission_rate = group['consignment'].commission_rate / 100 if group['consignment'].commission_rate else 0
-                commission = round(group['total'] * commission_rate, 2)
-                consignment_commission_total += commission
-
-        # ✅ FIX: Journal Entry logic refactored to be balanced and correct
-        je_lines = []
-
-        # 1. Cash received
-        je_lines.append({'account_code': get_system_account_code('Cash'), 'debit': float(total_amount), 'credit': 0})
-
-        # 2. Consignment Commission Revenue (based on pre-discount)
-        if consignment_commission_total > 0:
-            je_lines.append({
-                'account_code': get_system_account_code('Consignment Commission Revenue'), 
-                'debit': 0, 
-                'credit': float(consignment_commission_total)
-            })
-
-        # 3. Consignment Payable (pre-discount sales - commission)
-        if consignment_sales_total > 0:
-            consignment_payable = consignment_sales_total - consignment_commission_total
-            je_lines.append({
-                'account_code': get_system_account_code('Consignment Payable'), 
-                'debit': 0, 
-                'credit': float(consignment_payable)
-            })
-        
-        # 4. Discount
-        discount_acc_code = get_system_account_code('Discounts Allowed')
-        if resolved_discount and resolved_discount > 0:
-            je_lines.append({'account_code': discount_acc_code, 'debit': float(resolved_discount), 'credit': 0})
+    # 2. Consignment Commission Revenue (based on pre-discount)
+    if consignment_commission_total > 0:
+        je_lines.append({
+            'account_code': get_system_account_code('Consignment Commission Revenue'), 
+            'debit': 0, 
+            'credit': float(consignment_commission_total)
+        })
+
+    # 3. Consignment Payable (pre-discount sales - commission)
+    if consignment_sales_total > 0:
+        consignment_payable = consignment_sales_total - consignment_commission_total
+        je_lines.append({
+            'account_code': get_system_account_code('Consignment Payable'), 
+            'debit': 0, 
+            'credit': float(consignment_payable)
+        })
+    
+    # 4. Discount
+    discount_acc_code = get_system_account_code('Discounts Allowed')
+    if resolved_discount and resolved_discount > 0:
+        je_lines.append({'account_code': discount_acc_code, 'debit': float(resolved_discount), 'credit': 0})
+    
+    # 5. COGS (regular products only)
+    if total_cogs and total_cogs > 0:
+        je_lines.append({'account_code': get_system_account_code('COGS'), 'debit': float(total_cogs), 'credit': 0})
+
+    # 6. Sales Revenue (FIXED: Uses final post-discount/pre-tax value)
+    if totals['regular_net'] > 0:
+        je_lines.append({'account_code': get_system_account_code('Sales Revenue'), 'debit': 0, 'credit': float(totals['regular_net'])})
+
+    # 7. VAT Payable (FIXED: Uses final calculated VAT for both)
+    final_total_vat = totals['regular_vat'] + totals['consignment_vat']
+    if final_total_vat > 0:
+        je_lines.append({'account_code': get_system_account_code('VAT Payable'), 'debit': 0, 'credit': float(final_total_vat)})
+
+    # 8. Inventory (regular products only)
+    if total_cogs and total_cogs > 0:
+        je_lines.append({'account_code': get_system_account_code('Inventory'), 'debit': 0, 'credit': float(total_cogs)})
+
+    # Rounding adjustment
+    total_debits = sum(float(l.get('debit', 0) or 0) for l in je_lines)
+    total_credits = sum(float(l.get('credit', 0) or 0) for l in je_lines)
+
+    rounding_diff = round(total_debits - total_credits, 2)
+    if abs(rounding_diff) >= 0.01:
+        adjusted = False
+        # Try to adjust Sales Revenue first
+        sales_revenue_code = get_system_account_code('Sales Revenue')
+        for l in je_lines:
+            if l.get('account_code') == sales_revenue_code:
+                l['credit'] = round(l['credit'] + rounding_diff, 2)
+                adjusted = True
+                break
         
-        # 5. COGS (regular products only)
-        if total_cogs and total_cogs > 0:
-            je_lines.append({'account_code': get_system_account_code('COGS'), 'debit': float(total_cogs), 'credit': 0})
-
-        # 6. Sales Revenue (FIXED: Uses final post-discount/pre-tax value)
-        if regular_sales_net_final > 0:
-            je_lines.append({'account_code': get_system_account_code('Sales Revenue'), 'debit': 0, 'credit': float(regular_sales_net_final)})
-
-        # 7. VAT Payable (FIXED: Uses final calculated VAT for both)
-        final_total_vat = regular_sales_vat_final + (consignment_vat_final if 'consignment_vat_final' in locals() else 0.0)
-        if final_total_vat > 0:
-            je_lines.append({'account_code': get_system_account_code('VAT Payable'), 'debit': 0, 'credit': float(final_total_vat)})
-
-        # 8. Inventory (regular products only)
-        if total_cogs and total_cogs > 0:
-            je_lines.append({'account_code': get_system_account_code('Inventory'), 'debit': 0, 'credit': float(total_cogs)})
-
-        # Rounding adjustment
-        total_debits = sum(float(l.get('debit', 0) or 0) for l in je_lines)
-        total_credits = sum(float(l.get('credit', 0) or 0) for l in je_lines)
-
-        rounding_diff = round(total_debits - total_credits, 2)
-        if abs(rounding_diff) >= 0.01:
-            adjusted = False
-            # Try to adjust Sales Revenue first
-            sales_revenue_code = get_system_account_code('Sales Revenue')
+        # If not, adjust discount
+        if not adjusted:
             for l in je_lines:
-                if l.get('account_code') == sales_revenue_code:
-                    l['credit'] = round(l['credit'] + rounding_diff, 2)
+                if l.get('account_code') == discount_acc_code and l.get('debit', 0) >= abs(rounding_diff):
+                    l['debit'] = round(l['debit'] - rounding_diff, 2)
                     adjusted = True
                     break
-            
-            # If not, adjust discount
-            if not adjusted:
-                for l in je_lines:
-                    if l.get('account_code') == discount_acc_code and l.get('debit', 0) >= abs(rounding_diff):
-                        l['debit'] = round(l['debit'] - rounding_diff, 2)
-                        adjusted = True
-                        break
-            
-            # Fallback to cash
-            if not adjusted:
-                cash_code = get_system_account_code('Cash')
-                for l in je_lines:
-                    if l.get('account_code') == cash_code:
-                        l['debit'] = round(l['debit'] - rounding_diff, 2)
-                        adjusted = True
-                        break
         
-        # Final balance check
-        total_debits = sum(float(l.get('debit', 0) or 0) for l in je_lines)
-        total_credits = sum(float(l.get('credit', 0) or 0) for l in je_lines)
+        # Fallback to cash
+        if not adjusted:
+            cash_code = get_system_account_code('Cash')
+            for l in je_lines:
+                if l.get('account_code') == cash_code:
+                    l['debit'] = round(l['debit'] - rounding_diff, 2)
+                    adjusted = True
+                    break
+    
+    # Final balance check
+    total_debits = sum(float(l.get('debit', 0) or 0) for l in je_lines)
+    total_credits = sum(float(l.get('credit', 0) or 0) for l in je_lines)
 
-        if round(total_debits, 2) != round(total_credits, 2):
-            db.session.rollback()
-            return jsonify({'error': f'Journal entry balancing failed. D={total_debits}, C={total_credits}'}), 500
+    if round(total_debits, 2) != round(total_credits, 2):
+        raise SaleError(f'Journal entry balancing failed. D={total_debits}, C={total_credits}', 500)
 
-        db.session.add(JournalEntry(description=f'Sale #{sale.id} ({full_doc_number})', entries_json=json.dumps(je_lines)))
+    if journal is not None:
+        check_balance(resolve_lines(je_lines))
+        journal.append((je_lines, f'Sale #{sale.id} ({full_doc_number})'))
+    else:
+        post_journal(je_lines, f'Sale #{sale.id} ({full_doc_number})')
 
-        log_action(f'Recorded Sale #{sale.id} ({full_doc_number}) for ₱{total_amount:,.2f}. Customer: {customer_name}. Discount: ₱{resolved_discount:.2f}')
-        db.session.commit()
+    log_action(f'Recorded Sale #{sale.id} ({full_doc_number}) for ₱{total_amount:,.2f}. Customer: {customer_name}. Discount: ₱{resolved_discount:.2f}',
+               user=user, ip_address=ip_address)
 
-        return jsonify({
-            'status': 'ok',
-            'sale_id': sale.id,
-            'receipt_number': full_doc_number,
-            'vat': vat_after,
-            'discount_value': resolved_discount
-        })
+    return {
+        'status': 'ok',
+        'sale_id': sale.id,
+        'receipt_number': full_doc_number,
+        'vat': vat_after,
+        'discount_value': resolved_discount
+    }
+
+
+def _record_sale_in_group(data, user, ip_address):
+    """A group-commit job: record one sale on the writer thread's session."""
+    products_by_sku, consignment_items = _load_sale_snapshot([data['items']])
+    return _record_sale(data, products_by_sku, consignment_items, user=user, ip_address=ip_address)
+
+
+def _sale_writer():
+    # Invoice numbers for a group are reserved before its transaction starts writing
+    return get_group_writer('sales', before_batch=lambda jobs: reserve_document_numbers('invoice', len(jobs)))
+
+
+@core_bp.route('/api/sale/quote', methods=['POST'])
+@login_required
+def api_sale_quote():
+    """
+    Price a cart ({items, is_vatable, discount}, as for /api/sale) or several
+    ({carts: [...]}) exactly as api_sale would, with FIFO-estimated COGS and
+    margin. Nothing is written and no row is locked, so the POS can quote on
+    every cart change.
+    """
+    data = request.json or {}
+    many = 'carts' in data
+    carts = data.get('carts') if many else [data]
+    if not isinstance(carts, list) or not carts or not all(isinstance(c, dict) for c in carts):
+        return jsonify({'error': 'Expected a cart or a non-empty list of carts'}), 400
+    if len(carts) > SALE_BATCH_LIMIT:
+        return jsonify({'error': f'At most {SALE_BATCH_LIMIT} carts per request'}), 400
+
+    products_by_sku, consignment_items = _load_sale_snapshot([c.get('items') or [] for c in carts])
+
+    resolved = []
+    for cart in carts:
+        try:
+            resolved.append(_resolve_sale_lines(cart.get('items', []), products_by_sku, consignment_items))
+        except SaleError as e:
+            if not many:
+                return jsonify({'error': str(e)}), e.status
+            resolved.append(e)
+
+    # COGS of every cart's regular lines in one window query over the open lots
+    cart_cogs = iter(get_fifo_costs_by_cart([
+        [(p['product'].id, p['qty']) for p in processed if not p['is_consignment']]
+        for processed in resolved if not isinstance(processed, SaleError)
+    ]))
+
+    quotes = []
+    for cart, processed in zip(carts, resolved):
+        if isinstance(processed, SaleError):
+            quotes.append({'error': str(processed)})
+        else:
+            quotes.append(_quote_sale(cart, processed, next(cart_cogs)))
+    return jsonify({'quotes': quotes} if many else quotes[0])
+
+
+@core_bp.route('/api/sale', methods=['POST'])
+@login_required
+def api_sale():
+    data = request.json or {}
+    if not data.get('items'):
+        return jsonify({'error': 'No items in sale'}), 400
+
+    try:
+        profile = CompanyProfile.query.first()
+        if not profile:
+            return jsonify({'error': 'Company profile not set up in settings'}), 500
+
+        if current_app.config.get('SALE_GROUP_COMMIT'):
+            # Answer only once the writer thread has committed this sale with the others in its group.
+            # The request's pooled connection goes back first: a burst of waiting terminals
+            # must not hold the whole pool while the writer needs a connection to commit.
+            user = current_user._get_current_object()
+            db.session.close()
+            future = _sale_writer().submit(_record_sale_in_group, data, user, request.remote_addr)
+            return jsonify(future.result(timeout=SALE_GROUP_COMMIT_TIMEOUT))
+
+        products_by_sku, consignment_items = _load_sale_snapshot([data['items']])
+        result = _record_sale(data, products_by_sku, consignment_items)
+        db.session.commit()
+        return jsonify(result)
+    except SaleError as e:
+        db.session.rollback()
+        return jsonify({'error': str(e)}), e.status
+    except TimeoutError:
+        # The writer may still commit it, so the terminal must not simply resend
+        return jsonify({'error': 'The sale is still being recorded. Check recent sales before retrying.'}), 503
     except exc.IntegrityError as e:
         db.session.rollback()
         return jsonify({'error': 'Failed to generate unique document number. Please try again.'}), 500
@@ -1574,6 +1661,115 @@ def api_sale():
         return jsonify({'error': f'An unexpected error occurred: {str(e)}'}), 500
 
 
+def _sale_receipt(sale):
+    return {
+        'status': 'ok',
+        'sale_id': sale.id,
+        'receipt_number': sale.document_number,
+        'vat': sale.vat,
+        'discount_value': sale.discount_value
+    }
+
+
+@core_bp.route('/api/sales/batch', methods=['POST'])
+@login_required
+def api_sales_batch():
+    """
+    Record sales a terminal queued while offline. Body:
+        {"sales": [{"idempotency_key": "...", <same fields as /api/sale>}, ...]}
+
+    Sales are recorded in order, SALE_BATCH_CHUNK per transaction, all sales of a
+    chunk sharing one product and lot snapshot. Each sale runs in its own savepoint,
+    so a bad sale fails alone. A key that was already recorded (a batch replayed after
+    a timeout) returns the original sale with 'replayed': true instead of posting again.
+    """
+    from models import SaleIdempotencyKey
+
+    sales = (request.json or {}).get('sales') or []
+    if not sales:
+        return jsonify({'error': 'No sales in batch'}), 400
+    if len(sales) > SALE_BATCH_LIMIT:
+        return jsonify({'error': f'At most {SALE_BATCH_LIMIT} sales per batch'}), 400
+    if not CompanyProfile.query.first():
+        return jsonify({'error': 'Company profile not set up in settings'}), 500
+
+    results = []
+    recorded = {}  # key -> receipt, for keys repeated within the batch
+    for start in range(0, len(sales), SALE_BATCH_CHUNK):
+        chunk = sales[start:start + SALE_BATCH_CHUNK]
+        keys = {str(data.get('idempotency_key') or '').strip() for data in chunk} - {''}
+        existing = {
+            k.key: k.sale for k in SaleIdempotencyKey.query.options(joinedload(SaleIdempotencyKey.sale))
+            .filter(SaleIdempotencyKey.key.in_(keys))
+        } if keys else {}
+        new_carts = [data.get('items') or [] for data in chunk
+                     if str(data.get('idempotency_key') or '').strip() not in existing]
+        products_by_sku, consignment_items = _load_sale_snapshot(new_carts)
+        lots = load_open_lots([p.id for p in products_by_sku.values()])
+        # Invoice numbers for the whole chunk are reserved before it starts writing
+        reserve_document_numbers('invoice', len(new_carts))
+        begin_transaction()
+        journal = []
+        chunk_keys = set()  # keys recorded in this chunk's transaction
+
+        for data in chunk:
+            key = str(data.get('idempotency_key') or '').strip()
+            if not key:
+                results.append({'status': 'error', 'error': 'Missing idempotency_key'})
+                continue
+            if key in existing:
+                results.append({**_sale_receipt(existing[key]), 'idempotency_key': key, 'replayed': True})
+                continue
+            if key in recorded:
+                results.append({**recorded[key], 'replayed': True})
+                continue
+
+            sale_journal = []
+            try:
+                with db.session.begin_nested():
+                    receipt = _record_sale(data, products_by_sku, consignment_items, lots, sale_journal)
+                    db.session.add(SaleIdempotencyKey(key=key, sale_id=receipt['sale_id']))
+                journal.extend(sale_journal)
+                chunk_keys.add(key)
+                recorded[key] = {**receipt, 'idempotency_key': key}
+                results.append(recorded[key])
+            except SaleError as e:
+                results.append({'status': 'error', 'idempotency_key': key, 'error': str(e)})
+            except exc.IntegrityError:
+                # Another request recorded this key first
+                replay = SaleIdempotencyKey.query.filter_by(key=key).first()
+                if replay:
+                    results.append({**_sale_receipt(replay.sale), 'idempotency_key': key, 'replayed': True})
+                else:
+                    results.append({'status': 'error', 'idempotency_key': key,
+                                    'error': 'Failed to generate unique document number. Please try again.'})
+            except Exception as e:
+                results.append({'status': 'error', 'idempotency_key': key,
+                                'error': f'An unexpected error occurred: {str(e)}'})
+
+        # The chunk's journal entries go in together; if that fails, none of its sales are kept
+        try:
+            post_many(journal)
+            db.session.commit()
+        except Exception as e:
+            db.session.rollback()
+            for key in chunk_keys:
+                recorded.pop(key, None)
+            for i in range(len(results) - len(chunk), len(results)):
+                key = results[i].get('idempotency_key')
+                if key in chunk_keys:
+                    results[i] = {'status': 'error', 'idempotency_key': key,
+                                  'error': f'An unexpected error occurred: {str(e)}'}
+
+    return jsonify({
+        'status': 'ok',
+        'recorded': sum(1 for r in results if r['status'] == 'ok' and not r.get('replayed')),
+        'replayed': sum(1 for r in results if r.get('replayed')),
+        'failed': sum(1 for r in results if r['status'] == 'error'),
+        'results': results
+    })
+
+
 @core_bp.route('/sales')
 def sales():
     from models import Sale, ARInvoice, Customer
@@ -1761,53 +1957,44 @@ def export_sales():
         cash_query = cash_query.filter(Sale.created_at <= end_date)
         ar_query = ar_query.filter(ARInvoice.date <= end_date)
 
-    cash_sales = cash_query.order_by(Sale.created_at.desc()).all()
-    ar_invoices = ar_query.order_by(ARInvoice.date.desc()).all()
+    cash_sales = cash_query.order_by(Sale.created_at.desc())
+    ar_invoices = ar_query.options(joinedload(ARInvoice.customer)).order_by(ARInvoice.date.desc())
 
     if format_type == 'csv':
-        # Generate CSV in memory
-        output = io.StringIO()
-        writer = csv.writer(output)
-        writer.writerow(["Type", "Doc #", "Date", "Customer", "Total", "Paid", "Balance", "VAT", "Discount", "Status"])
+        def rows():
+            # Add cash sales
+            for s in cash_sales.yield_per(EXPORT_CHUNK_ROWS):
+                yield [
+                    "Cash Sale",
+                    s.document_number or f"Sale-{s.id}",
+                    s.created_at.strftime('%Y-%m-%d %H:%M') if s.created_at else "",
+                    s.customer_name or "Walk-in",
+                    f"{s.total:.2f}",
+                    f"{s.total:.2f}",  # Fully paid
+                    "0.00",
+                    f"{(s.vat or 0):.2f}",
+                    f"{(s.discount_value or 0):.2f}",
+                    s.status or "paid"
+                ]
 
-        # Add cash sales
-        for s in cash_sales:
-            writer.writerow([
-                "Cash Sale",
-                s.document_number or f"Sale-{s.id}",
-                s.created_at.strftime('%Y-%m-%d %H:%M') if s.created_at else "",
-                s.customer_name or "Walk-in",
-                f"{s.total:.2f}",
-                f"{s.total:.2f}",  # Fully paid
-                "0.00",
-                f"{(s.vat or 0):.2f}",
-                f"{(s.discount_value or 0):.2f}",
-                s.status or "paid"
-            ])
-        
-        # Add billing invoices
-        for inv in ar_invoices:
-            writer.writerow([
-                "Billing Invoice",
-                inv.invoice_number or f"AR-{inv.id}",
-                inv.date.strftime('%Y-%m-%d %H:%M') if inv.date else "",
-                inv.customer.name if inv.customer else "N/A",
-                f"{inv.total:.2f}",
-                f"{inv.paid:.2f}",
-                f"{(inv.total - inv.paid):.2f}",
-                f"{(inv.vat or 0):.2f}",
-                "0.00",
-                inv.status or "Open"
-            ])
+            # Add billing invoices
+            for inv in ar_invoices.yield_per(EXPORT_CHUNK_ROWS):
+                yield [
+                    "Billing Invoice",
+                    inv.invoice_number or f"AR-{inv.id}",
+                    inv.date.strftime('%Y-%m-%d %H:%M') if inv.date else "",
+                    inv.customer.name if inv.customer else "N/A",
+                    f"{inv.total:.2f}",
+                    f"{inv.paid:.2f}",
+                    f"{(inv.total - inv.paid):.2f}",
+                    f"{(inv.vat or 0):.2f}",
+                    "0.00",
+                    inv.status or "Open"
+                ]
 
-        output.seek(0)
         filename = f"sales_export_{datetime.now().strftime('%Y%m%d_%H%M')}.csv"
-
-        return Response(
-            output.getvalue(),
-            mimetype="text/csv",
-            headers={"Content-Disposition": f"attachment;filename={filename}"}
-        )
+        header = ["Type", "Doc #", "Date", "Customer", "Total", "Paid", "Balance", "VAT", "Discount", "Status"]
+        return stream_csv(filename, header, rows())
 
     # Default fallback
     return redirect(url_for('core.sales'))
@@ -1843,7 +2030,7 @@ def journal_entries():
         # Updated to search for account_code instead of account name
         query = query.filter(
             (JournalEntry.description.ilike(f'%{search}%')) |
-            (JournalEntry.entries_json.ilike(f'%\"account_code\": \"{search}\"%')) 
+            (JournalEntry.id.in_(entries_with_account(search)))
         )
         
     start_date, end_date = None, None
@@ -1895,7 +2082,7 @@ def export_journal_entries():
     if search:
         query = query.filter(
             (JournalEntry.description.ilike(f'%{search}%')) |
-            (JournalEntry.entries_json.ilike(f'%\"account_code\": \"{search}\"%'))
+            (JournalEntry.id.in_(entries_with_account(search)))
         )
     if start_date_str:
         try:
@@ -1908,59 +2095,38 @@ def export_journal_entries():
             query = query.filter(JournalEntry.created_at <= end_date)
         except ValueError: pass
 
-    journals = query.all()
-    
-    # --- Create CSV ---
-    si = io.StringIO()
-    writer = csv.writer(si)
-    
-    # Write Header
-    writer.writerow(['Journal_ID', 'Date', 'Description', 'Account_Code', 'Account_Name', 'Debit', 'Credit'])
-    
-    # Write Rows
-    for je in journals:
-        je_date = je.created_at.strftime('%Y-%m-%d %H:%M')
-        for line in je.entries():
-            code = line.get('account_code')
-            # Use the map to find the name
-            name = accounts_map.get(code, code) # Fallback to code if not found
-            debit = line.get('debit', 0)
-            credit = line.get('credit', 0)
-            writer.writerow([je.id, je_date, je.description, code, name, debit, credit])
+    def rows():
+        for je in query.yield_per(EXPORT_CHUNK_ROWS):
+            je_date = je.created_at.strftime('%Y-%m-%d %H:%M')
+            for line in je.entries():
+                code = line.get('account_code')
+                # Use the map to find the name
+                name = accounts_map.get(code, code) # Fallback to code if not found
+                debit = line.get('debit', 0)
+                credit = line.get('credit', 0)
+                yield [je.id, je_date, je.description, code, name, debit, credit]
 
-    output = si.getvalue()
-    return Response(
-        output,
-        mimetype="text/csv",
-        headers={"Content-Disposition": "attachment;filename=journal_entries.csv"}
-    )
+    header = ['Journal_ID', 'Date', 'Description', 'Account_Code', 'Account_Name', 'Debit', 'Credit']
+    return stream_csv("journal_entries.csv", header, rows())
 
 @core_bp.route('/export_journals')
 def export_journals():
     """Export journal entries as CSV."""
-    journals = JournalEntry.query.order_by(JournalEntry.created_at.desc()).all()
-
-    output = StringIO()
-    writer = csv.writer(output)
-    writer.writerow(["ID", "Description", "Account", "Debit", "Credit", "Date"])
-
-    for j in journals:
-        for e in j.entries():
-            writer.writerow([
-                j.id,
-                j.description or '',
-                e.get("account", ""),
-                e.get("debit", 0),
-                e.get("credit", 0),
-                j.created_at.strftime("%Y-%m-%d %H:%M") if j.created_at else "",
-            ])
+    journals = JournalEntry.query.order_by(JournalEntry.created_at.desc())
+
+    def rows():
+        for j in journals.yield_per(EXPORT_CHUNK_ROWS):
+            for e in j.entries():
+                yield [
+                    j.id,
+                    j.description or '',
+                    e.get("account", ""),
+                    e.get("debit", 0),
+                    e.get("credit", 0),
+                    j.created_at.strftime("%Y-%m-%d %H:%M") if j.created_at else "",
+                ]
 
-    output.seek(0)
-    return Response(
-        output.getvalue(),
-        mimetype="text/csv",
-        headers={"Content-Disposition": "attachment; filename=journal_entries.csv"}
-    )
+    return stream_csv("journal_entries.csv", ["ID", "Description", "Account", "Debit", "Credit", "Date"], rows())
 
 @core_bp.route('/new_journal')
 def new_journal():
@@ -2038,16 +2204,16 @@ def export_vat_report():
 
 @core_bp.route('/api/product/<sku>')
 def api_product(sku):
-    product = Product.query.filter_by(sku=sku).first()
+    product = lookup_product(sku)
     if not product:
         return jsonify({'error': 'Product not found'}), 404
 
     return jsonify({
-        'sku': product.sku,
-        'name': product.name,
-        'sale_price': float(product.sale_price or 0),
-        'cost_price': float(product.cost_price or 0),
-        'quantity': product.quantity
+        'sku': product['sku'],
+        'name': product['name'],
+        'sale_price': float(product['price'] or 0),
+        'cost_price': float(product['cost_price'] or 0),
+        'quantity': product['quantity']
     })
 
 
@@ -2271,8 +2437,7 @@ def adjust_stock():
             {"account_code": debit_account_code, "debit": adjustment_value, "credit": 0},
             {"account_code": credit_account_code, "debit": 0, "credit": adjustment_value}
         ]
-        journal = JournalEntry(description=desc, entries_json=json.dumps(je_lines))
-        db.session.add(journal)
+        post_journal(je_lines, desc)
 
         log_action(f'Adjusted stock for {product.name} by {quantity}. Reason: {reason}.')
         db.session.commit()
@@ -2346,6 +2511,7 @@ def audit_log():
 def inventory_lots(product_id):
     """View FIFO inventory lots for a specific product"""
     from routes.fifo_utils import get_inventory_lots_summary, reconcile_inventory_lots
+    from models import AverageCost
     
     product = Product.query.get_or_404(product_id)
     lots = get_inventory_lots_summary(product_id)
@@ -2353,11 +2519,17 @@ def inventory_lots(product_id):
     
     total_qty = sum(lot['quantity'] for lot in lots)
     total_value = sum(lot['total_value'] for lot in lots)
+    # Products costed at moving average hold their stock in one running total instead
+    average = db.session.get(AverageCost, product_id)
+    if average is not None:
+        total_qty += average.quantity
+        total_value += average.value
     avg_cost = total_value / total_qty if total_qty > 0 else 0.0
     
     return render_template('inventory_lots.html',
                          product=product,
                          lots=lots,
+                         average=average,
                          total_qty=total_qty,
                          total_value=total_value,
                          avg_cost=avg_cost,
@@ -0,0 +1,183 @@
+"""
+Inventory Costing Methods
+
+Products are costed FIFO from their lots (routes/fifo_utils.py) unless they, or
+their category, are set to moving weighted average: such a product keeps one
+AverageCost row with its running quantity and value instead of lots and
+consumption records. create_inventory_lot, consume_inventory_fifo(_batch) and
+reverse_inventory_consumption pick the method per product, so callers do not
+need to know which one a product is on.
+"""
+from datetime import datetime
+
+from sqlalchemy import func, or_
+
+from models import db, Product, InventoryLot, CostingMethod, AverageCost
+
+
+FIFO = 'FIFO'
+AVERAGE = 'AVERAGE'
+COSTING_METHODS = (FIFO, AVERAGE)
+
+
+def _category_key(category):
+    return (category or '').strip().upper() or None
+
+
+def costing_method_setting(product):
+    """The method `product` should be costed by: its own setting, else its category's, else FIFO."""
+    conditions = [CostingMethod.product_id == product.id]
+    key = _category_key(product.category)
+    if key:
+        conditions.append(CostingMethod.category == key)
+    settings = CostingMethod.query.filter(or_(*conditions)).all()
+    for setting in settings:
+        if setting.product_id == product.id:
+            return setting.method
+    return settings[0].method if settings else FIFO
+
+
+def average_costs(product_ids):
+    """{product_id: AverageCost} for those of the given products costed at moving average."""
+    if not product_ids:
+        return {}
+    return {pool.product_id: pool for pool in AverageCost.query.filter(AverageCost.product_id.in_(product_ids))}
+
+
+def apply_costing_method(product):
+    """
+    Convert the stock of `product` to the method its setting asks for, if it is not
+    on it already. Returns True if it was converted.
+
+    To average, its open lots are emptied into a new AverageCost at their total
+    value. To FIFO, what is in its AverageCost becomes one lot at the average cost.
+    """
+    pool = db.session.get(AverageCost, product.id)
+    method = costing_method_setting(product)
+    if method == AVERAGE and pool is None:
+        lots = InventoryLot.query.filter(
+            InventoryLot.product_id == product.id, InventoryLot.quantity_remaining > 0
+        ).all()
+        db.session.add(AverageCost(
+            product_id=product.id,
+            quantity=sum(lot.quantity_remaining for lot in lots),
+            value=round(sum(round(lot.quantity_remaining * lot.unit_cost, 2) for lot in lots), 2),
+        ))
+        for lot in lots:
+            lot.quantity_remaining = 0
+        return True
+    if method == FIFO and pool is not None:
+        if pool.quantity > 0:
+            db.session.add(InventoryLot(
+                product_id=product.id,
+                quantity_remaining=pool.quantity,
+                unit_cost=pool.unit_cost,
+                created_at=datetime.utcnow()
+            ))
+        db.session.delete(pool)
+        return True
+    return False
+
+
+def set_costing_method(method, product_id=None, category=None):
+    """
+    Set the costing method of one product or of a category, and convert the stock
+    of every product it now applies to (a product with its own setting keeps it
+    when its category changes). The caller commits.
+
+    Returns:
+        list: The products that were converted
+
+    Raises:
+        ValueError: If the method is unknown, or not exactly one of product_id and
+            category is given
+    """
+    if method not in COSTING_METHODS:
+        raise ValueError(f"Costing method must be one of {', '.join(COSTING_METHODS)}")
+    key = _category_key(category)
+    if (product_id is None) == (key is None):
+        raise ValueError("Give either a product or a category")
+
+    if product_id is not None:
+        product = db.session.get(Product, product_id)
+        if not product:
+            raise ValueError(f"Product {product_id} not found")
+        setting = CostingMethod.query.filter_by(product_id=product_id).first()
+        products = [product]
+    else:
+        setting = CostingMethod.query.filter_by(category=key).first()
+        products = Product.query.filter(func.upper(func.trim(Product.category)) == key).all()
+
+    if setting is None:
+        setting = CostingMethod(product_id=product_id, category=key if product_id is None else None)
+        db.session.add(setting)
+    setting.method = method
+    db.session.flush()
+
+    return [product for product in products if apply_costing_method(product)]
+
+
+def receiving_pool(product_id):
+    """
+    The AverageCost a receipt of `product_id` goes into, or None if the product is
+    costed FIFO. The setting is checked on every receipt, so a product whose
+    category or own setting has changed is converted before the stock comes in.
+    """
+    product = db.session.get(Product, product_id)
+    if product is not None:
+        apply_costing_method(product)
+    return db.session.get(AverageCost, product_id)
+
+
+def average_cogs(on_hand, value, quantity):
+    """Cost of `quantity` of `on_hand` units worth `value`; the last units take whatever value is left."""
+    if quantity >= on_hand:
+        return round(value, 2)
+    return round(value * quantity / on_hand, 2)
+
+
+def receive_average(pool, quantity, unit_cost):
+    """Add a receipt of `quantity` units at `unit_cost` to a product's running totals."""
+    pool.quantity += quantity
+    pool.value = round(pool.value + quantity * unit_cost, 2)
+
+
+def consume_average(pool, quantity):
+    """
+    Take `quantity` units out at the current average cost and return their COGS.
+
+    Raises:
+        ValueError: If the product has fewer units on hand
+    """
+    if pool.quantity < quantity:
+        raise ValueError(
+            f"Could not consume {quantity} units. "
+            f"Only {pool.quantity} on hand at average cost."
+        )
+    cogs = average_cogs(pool.quantity, pool.value, quantity)
+    pool.quantity -= quantity
+    pool.value = round(pool.value - cogs, 2)
+    return cogs
+
+
+def return_average(pool, quantity, value):
+    """Put `quantity` units worth `value` back, as when a sale is voided at the COGS it was charged."""
+    pool.quantity += quantity
+    pool.value = round(pool.value + value, 2)
+
+
+def withdraw_average(pool, quantity, value):
+    """
+    Take a receipt back out, as when a purchase or stock gain is voided: `quantity`
+    units worth `value`, or whatever value is left if that is less.
+
+    Raises:
+        ValueError: If fewer units are on hand (some have been sold)
+    """
+    if pool.quantity < quantity:
+        raise ValueError(
+            f"Cannot remove {quantity} units. "
+            f"Only {pool.quantity} on hand at average cost."
+        )
+    pool.quantity -= quantity
+    pool.value = round(max(pool.value - value, 0.0), 2)
@@ -0,0 +1,65 @@
+"""
+Streaming CSV Export Utilities
+"""
+import csv
+import io
+import zlib
+
+from flask import Response, request, stream_with_context
+
+
+# Rows fetched per database round trip and written per response chunk
+EXPORT_CHUNK_ROWS = 500
+
+
+def iter_csv(header, rows, chunk_rows=EXPORT_CHUNK_ROWS):
+    """
+    Yield a CSV document as UTF-8 byte chunks of about `chunk_rows` rows each,
+    so only one chunk is ever held in memory.
+    """
+    buffer = io.StringIO()
+    writer = csv.writer(buffer)
+    if header:
+        writer.writerow(header)
+
+    pending = 0
+    for row in rows:
+        writer.writerow(row)
+        pending += 1
+        if pending >= chunk_rows:
+            yield buffer.getvalue().encode('utf-8')
+            buffer.seek(0)
+            buffer.truncate()
+            pending = 0
+
+    tail = buffer.getvalue()
+    if tail:
+        yield tail.encode('utf-8')
+
+
+def gzip_chunks(chunks):
+    """Compress a byte-chunk iterator into a gzip stream on the fly."""
+    compressor = zlib.compressobj(6, zlib.DEFLATED, 16 + zlib.MAX_WBITS)
+    for chunk in chunks:
+        data = compressor.compress(chunk)
+        if data:
+            yield data
+    yield compressor.flush()
+
+
+def client_accepts_gzip():
+    return 'gzip' in request.accept_encodings
+
+
+def stream_csv(filename, header, rows, chunk_rows=EXPORT_CHUNK_ROWS):
+    """
+    Stream `rows` (any iterable of row lists, typically fed by a yield_per query)
+    as a CSV attachment. The body is gzip-encoded when the client accepts it.
+    The request context stays open while streaming, so `rows` may keep using db.session.
+    """
+    chunks = iter_csv(header, rows, chunk_rows)
+    headers = {"Content-Disposition": f"attachment; filename={filename}", "Vary": "Accept-Encoding"}
+    if client_accepts_gzip():
+        chunks = gzip_chunks(chunks)
+        headers["Content-Encoding"] = "gzip"
+    return Response(stream_with_context(chunks), mimetype="text/csv", headers=headers)
@@ -1,22 +1,98 @@
 """
 FIFO Inventory Costing Utilities
 """
-from models import db, InventoryLot, InventoryTransaction, Product
-from sqlalchemy import func
+from models import (db, InventoryLot, InventoryTransaction, Product, FifoHead, AverageCost, SaleItem, ARInvoiceItem,
+                    JournalLine)
+from routes.utils import get_system_account_map
+from routes.archive_utils import restore_archived_consumption
+from routes.costing_utils import (average_costs, average_cogs, receiving_pool, receive_average, consume_average,
+                                  return_average)
+from sqlalchemy import Integer, and_, case, column, delete, event, func, insert, literal_column, select, values
+from sqlalchemy.orm import Session
 from datetime import datetime
 
 
+def lot_is_open():
+    """
+    `quantity_remaining > 0` with a literal rather than a bound parameter, so SQLite
+    matches it to the partial index ix_inventory_lot_open_fifo.
+    """
+    return InventoryLot.quantity_remaining > literal_column('0')
+
+
+def _fifo_order():
+    return (InventoryLot.created_at.asc(), InventoryLot.id.asc())
+
+
+def _refresh_fifo_heads(connection, product_ids):
+    """Point each product's FifoHead at its oldest open lot, found through the FIFO index."""
+    head = select(InventoryLot.id).where(
+        InventoryLot.product_id == Product.id, lot_is_open()
+    ).order_by(*_fifo_order()).limit(1).scalar_subquery()
+    connection.execute(delete(FifoHead).where(FifoHead.product_id.in_(product_ids)))
+    connection.execute(insert(FifoHead).from_select(
+        ['product_id', 'lot_id'], select(Product.id, head).where(Product.id.in_(product_ids))
+    ))
+
+
+@event.listens_for(Session, 'after_flush')
+def _update_fifo_heads(session, flush_context):
+    """
+    Move the head of every product whose open lots the flush changed: a lot
+    created, deleted, depleted or reopened. Drawing down a lot that stays open
+    leaves the head where it is, so most sales write nothing here.
+    """
+    products = set()
+    for obj in session.new:
+        if isinstance(obj, InventoryLot):
+            products.add(obj.product_id)
+    for obj in session.deleted:
+        if isinstance(obj, InventoryLot):
+            products.add(obj.product_id)
+    for obj in session.dirty:
+        if not isinstance(obj, InventoryLot):
+            continue
+        attrs = db.inspect(obj).attrs
+        if attrs.product_id.history.has_changes() or attrs.created_at.history.has_changes():
+            products.update(attrs.product_id.history.sum())
+            continue
+        history = attrs.quantity_remaining.history
+        if history.has_changes():
+            before = history.deleted[0] if history.deleted else None
+            if before is None or (before > 0) != (obj.quantity_remaining > 0):
+                products.add(obj.product_id)
+    products.discard(None)
+    if products:
+        _refresh_fifo_heads(session.connection(), sorted(products))
+
+
+def rebuild_fifo_heads():
+    """Set the FifoHead of every product; returns how many products have an open lot."""
+    product_ids = db.session.execute(select(Product.id)).scalars().all()
+    for start in range(0, len(product_ids), 500):
+        _refresh_fifo_heads(db.session.connection(), product_ids[start:start + 500])
+    db.session.commit()
+    return db.session.execute(select(func.count()).where(FifoHead.lot_id.is_not(None))).scalar()
+
+
 def create_inventory_lot(product_id, quantity, unit_cost, purchase_id=None, 
                          purchase_item_id=None, adjustment_id=None, movement_id=None, is_opening_balance=False):
     """
     Create a new inventory lot when receiving inventory.
     Accepts optional movement_id to link the lot to an InventoryMovement (receive).
+    A product costed at moving average (see costing_utils) gets no lot: the
+    receipt is added to its AverageCost, which is returned instead.
     """
     if quantity <= 0:
         raise ValueError("Quantity must be positive")
 
     if unit_cost < 0:
         raise ValueError("Unit cost cannot be negative")
+
+    pool = receiving_pool(product_id)
+    if pool is not None:
+        receive_average(pool, quantity, unit_cost)
+        return pool
     
     lot = InventoryLot(
         product_id=product_id,
@@ -37,7 +113,8 @@ def create_inventory_lot(product_id, quantity, unit_cost, purchase_id=None,
 def consume_inventory_fifo(product_id, quantity_needed, sale_id=None, sale_item_id=None,
                            ar_invoice_id=None, ar_invoice_item_id=None, adjustment_id=None):
     """
-    Consume inventory using FIFO method and return total COGS.
+    Consume inventory using FIFO method and return total COGS. A product costed
+    at moving average is charged the average cost instead, with no transactions.
     
     Args:
         product_id: ID of the product
@@ -68,11 +145,12 @@ def consume_inventory_fifo(product_id, quantity_needed, sale_id=None, sale_item_
             f"Available: {product.quantity}, Requested: {quantity_needed}"
         )
     
-    # Get oldest lots first (FIFO)
-    lots = InventoryLot.query.filter(
-        InventoryLot.product_id == product_id,
-        InventoryLot.quantity_remaining > 0
-    ).order_by(InventoryLot.created_at.asc()).all()
+    pool = db.session.get(AverageCost, product_id)
+    if pool is not None:
+        return consume_average(pool, quantity_needed), []
+
+    # Get oldest lots first (FIFO), starting from the head lot
+    lots = load_fifo_lots({product_id: quantity_needed}).get(product_id)
     
     if not lots:
         raise ValueError(f"No inventory lots found for product {product_id}")
@@ -121,6 +199,168 @@ def consume_inventory_fifo(product_id, quantity_needed, sale_id=None, sale_item_
     return round(total_cogs, 2), transactions
 
 
+def load_open_lots(product_ids):
+    """
+    Open lots of the given products in FIFO order, as {product_id: [InventoryLot, ...]}.
+    Loaded once, the snapshot can be passed to several consume_inventory_fifo_batch
+    calls in the same session; consumption updates the lots in place.
+    """
+    lots_by_product = {}
+    if not product_ids:
+        return lots_by_product
+    lots = InventoryLot.query.filter(
+        InventoryLot.product_id.in_(product_ids),
+        lot_is_open()
+    ).order_by(InventoryLot.product_id, *_fifo_order()).all()
+    for lot in lots:
+        lots_by_product.setdefault(lot.product_id, []).append(lot)
+    return lots_by_product
+
+
+def load_fifo_lots(needed):
+    """
+    Open lots in FIFO order for the quantities in `needed` ({product_id: quantity}),
+    as load_open_lots returns them, reading no further than needed: a product whose
+    head lot covers its quantity gets just that lot, in one query for all of them;
+    the rest get their open lots through the FIFO index.
+    """
+    lots_by_product = {}
+    if not needed:
+        return lots_by_product
+    heads = {
+        product_id: lot for product_id, lot in db.session.execute(
+            select(FifoHead.product_id, InventoryLot)
+            .outerjoin(InventoryLot, InventoryLot.id == FifoHead.lot_id)
+            .where(FifoHead.product_id.in_(needed))
+        ).all()
+    }
+    rest = []
+    for product_id, quantity in needed.items():
+        if product_id not in heads:
+            rest.append(product_id)  # No head yet: lots from before the head was kept
+        elif heads[product_id] is None:
+            lots_by_product[product_id] = []
+        elif heads[product_id].quantity_remaining >= quantity:
+            lots_by_product[product_id] = [heads[product_id]]
+        else:
+            rest.append(product_id)
+    lots_by_product.update(load_open_lots(rest))
+    return lots_by_product
+
+
+def consume_inventory_fifo_batch(demands, sale_id=None, ar_invoice_id=None, adjustment_id=None, lots=None):
+    """
+    Consume inventory for a whole cart at once using FIFO and return each line's COGS.
+    Open lots for every product are read in one ordered query and allocated in
+    memory, and the InventoryTransaction rows go in as one bulk insert, so the
+    number of round trips does not grow with the cart. Products costed at moving
+    average are charged from their AverageCost, read for the whole cart at once.
+
+    Args:
+        demands: List of (Product, quantity) in cart order; a product may appear more than once
+        sale_id: Reference to sale (optional)
+        ar_invoice_id: Reference to AR invoice (optional)
+        adjustment_id: Reference to stock adjustment (optional)
+        lots: Snapshot from load_open_lots covering these products (optional; read from
+            the head lots if omitted)
+
+    Returns:
+        list: COGS per demand, in the order given
+
+    Raises:
+        ValueError: If any product has insufficient inventory (nothing is consumed)
+    """
+    needed = {}
+    for product, quantity in demands:
+        if quantity <= 0:
+            raise ValueError("Quantity must be positive")
+        needed[product.id] = needed.get(product.id, 0) + quantity
+
+    for product, _ in demands:
+        if product.quantity < needed[product.id]:
+            raise ValueError(
+                f"Insufficient inventory for {product.name}. "
+                f"Available: {product.quantity}, Requested: {needed[product.id]}"
+            )
+
+    if not needed:
+        return []
+
+    pools = average_costs(list(needed))
+    for product_id, pool in pools.items():
+        if pool.quantity < needed[product_id]:
+            raise ValueError(
+                f"Could not consume {needed[product_id]} units. "
+                f"Only {pool.quantity} on hand at average cost."
+            )
+    fifo_needed = {product_id: quantity for product_id, quantity in needed.items() if product_id not in pools}
+
+    lots_by_product = lots if lots is not None else load_fifo_lots(fifo_needed)
+
+    # Plan every line before touching a lot, so a shortfall leaves nothing half-consumed
+    left = {
+        lot.id: lot.quantity_remaining
+        for product_id in fifo_needed for lot in lots_by_product.get(product_id, ())
+    }
+    plans = []
+    for product, quantity in demands:
+        if product.id in pools:
+            plans.append(None)
+            continue
+        product_lots = lots_by_product.get(product.id)
+        if not product_lots:
+            raise ValueError(f"No inventory lots found for product {product.id}")
+        plan = []
+        remaining_to_consume = quantity
+        for lot in product_lots:
+            if remaining_to_consume <= 0:
+                break
+            qty_from_lot = min(left[lot.id], remaining_to_consume)
+            if qty_from_lot <= 0:
+                continue
+            left[lot.id] -= qty_from_lot
+            remaining_to_consume -= qty_from_lot
+            plan.append((lot, qty_from_lot))
+        if remaining_to_consume > 0:
+            raise ValueError(
+                f"Could not consume {quantity} units. "
+                f"Only {quantity - remaining_to_consume} available in lots."
+            )
+        plans.append(plan)
+
+    now = datetime.utcnow()
+    line_cogs = []
+    transaction_rows = []
+    for plan, (product, quantity) in zip(plans, demands):
+        if plan is None:
+            line_cogs.append(consume_average(pools[product.id], quantity))
+            continue
+        total_cogs = 0.0
+        for lot, qty_from_lot in plan:
+            cost_from_lot = round(qty_from_lot * lot.unit_cost, 2)
+            lot.quantity_remaining -= qty_from_lot
+            total_cogs += cost_from_lot
+            transaction_rows.append({
+                'lot_id': lot.id,
+                'quantity_used': qty_from_lot,
+                'unit_cost': lot.unit_cost,
+                'total_cost': cost_from_lot,
+                'sale_id': sale_id,
+                'ar_invoice_id': ar_invoice_id,
+                'adjustment_id': adjustment_id,
+                'created_at': now
+            })
+        line_cogs.append(round(total_cogs, 2))
+
+    if transaction_rows:
+        db.session.execute(insert(InventoryTransaction), transaction_rows)
+    return line_cogs
+
+
+# Demand rows per costing query, well inside SQLite's bound-parameter limit
+FIFO_COST_CHUNK = 2000
+
+
 def get_fifo_cost(product_id, quantity):
     """
     Calculate what the COGS would be for a given quantity without consuming.
@@ -133,22 +373,84 @@ def get_fifo_cost(product_id, quantity):
     Returns:
         float: Estimated COGS
     """
-    lots = InventoryLot.query.filter(
-        InventoryLot.product_id == product_id,
-        InventoryLot.quantity_remaining > 0
-    ).order_by(InventoryLot.created_at.asc()).all()
-    
-    total_cost = 0.0
-    remaining = quantity
-    
-    for lot in lots:
-        if remaining <= 0:
-            break
-        qty_from_lot = min(lot.quantity_remaining, remaining)
-        total_cost += qty_from_lot * lot.unit_cost
-        remaining -= qty_from_lot
-    
-    return round(total_cost, 2)
+    return get_fifo_costs([(product_id, quantity)])[0]
+
+
+def get_fifo_costs(demands):
+    """
+    FIFO COGS of many lines at once without consuming anything: `demands` is a
+    sequence of (product_id, qty) and the result the COGS of each, in order.
+    Lines of the same product draw on its lots one after the other, as a cart does.
+    """
+    return get_fifo_costs_by_cart([demands])[0]
+
+
+def get_fifo_costs_by_cart(carts):
+    """
+    FIFO COGS of every line of several carts, each costed against the current open
+    lots as if it were the only sale. Lines of the same product within a cart draw
+    on its lots in order, as consume_inventory_fifo_batch would take them.
+
+    One query does the walk: a running SUM(quantity_remaining) over each product's
+    open lots in FIFO order places every lot on a line of units, each line's demand
+    is the interval it takes from that line, and only the (line, lot) overlaps come
+    back. Each overlap is costed and rounded to the cent as consumption rounds it;
+    stock beyond the open lots is costed at 0. Products costed at moving average
+    are charged from their AverageCost as consume_average would charge them.
+
+    Args:
+        carts: Sequence of carts, each a sequence of (product_id, qty)
+
+    Returns:
+        list: Per cart, the COGS of each line in the order given
+    """
+    costs = [[0.0] * len(cart) for cart in carts]
+    pools = average_costs({product_id for cart in carts for product_id, _ in cart})
+    rows = []
+    for cart_index, cart in enumerate(carts):
+        drawn = {}
+        averaged = {}
+        for line_index, (product_id, quantity) in enumerate(cart):
+            start = drawn.get(product_id, 0)
+            drawn[product_id] = start + quantity
+            pool = pools.get(product_id)
+            if pool is not None:
+                on_hand, value = averaged.get(product_id, (pool.quantity, pool.value))
+                take = min(quantity, on_hand)
+                cost = average_cogs(on_hand, value, take) if take > 0 else 0.0
+                averaged[product_id] = (on_hand - take, round(value - cost, 2))
+                costs[cart_index][line_index] = cost
+            elif quantity > 0:
+                rows.append((cart_index, line_index, product_id, start, start + quantity))
+
+    for offset in range(0, len(rows), FIFO_COST_CHUNK):
+        chunk = rows[offset:offset + FIFO_COST_CHUNK]
+        demand = values(
+            column('cart', Integer), column('line', Integer), column('product_id', Integer),
+            column('units_from', Integer), column('units_to', Integer), name='demand'
+        ).data(chunk).cte('demand')
+        upto = func.sum(InventoryLot.quantity_remaining).over(
+            partition_by=InventoryLot.product_id, order_by=_fifo_order()
+        )
+        lots = select(
+            InventoryLot.product_id, InventoryLot.unit_cost,
+            (upto - InventoryLot.quantity_remaining).label('units_from'), upto.label('units_to'),
+        ).where(
+            InventoryLot.product_id.in_({row[2] for row in chunk}), lot_is_open()
+        ).cte('fifo_lots')
+        taken = (case((demand.c.units_to < lots.c.units_to, demand.c.units_to), else_=lots.c.units_to)
+                 - case((demand.c.units_from > lots.c.units_from, demand.c.units_from), else_=lots.c.units_from))
+        overlaps = db.session.execute(
+            select(demand.c.cart, demand.c.line, taken, lots.c.unit_cost)
+            .join(lots, and_(lots.c.product_id == demand.c.product_id,
+                             lots.c.units_to > demand.c.units_from,
+                             lots.c.units_from < demand.c.units_to))
+            .order_by(demand.c.cart, demand.c.line, lots.c.units_from)
+        )
+        for cart_index, line_index, quantity, unit_cost in overlaps:
+            costs[cart_index][line_index] += round(quantity * unit_cost, 2)
+
+    return [[round(cost, 2) for cost in cart_costs] for cart_costs in costs]
 
 
 def get_weighted_average_cost(product_id):
@@ -162,12 +464,16 @@ def get_weighted_average_cost(product_id):
     Returns:
         float: Weighted average cost per unit
     """
+    pool = db.session.get(AverageCost, product_id)
+    if pool is not None:
+        return round(pool.unit_cost, 2)
+
     result = db.session.query(
         func.sum(InventoryLot.quantity_remaining * InventoryLot.unit_cost),
         func.sum(InventoryLot.quantity_remaining)
     ).filter(
         InventoryLot.product_id == product_id,
-        InventoryLot.quantity_remaining > 0
+        lot_is_open()
     ).first()
     
     total_value, total_qty = result
@@ -184,8 +490,8 @@ def get_inventory_lots_summary(product_id):
     """
     lots = InventoryLot.query.filter(
         InventoryLot.product_id == product_id,
-        InventoryLot.quantity_remaining > 0
-    ).order_by(InventoryLot.created_at.asc()).all()
+        lot_is_open()
+    ).order_by(*_fifo_order()).all()
     
     summary = []
     for lot in lots:
@@ -224,6 +530,9 @@ def reconcile_inventory_lots(product_id):
     ).filter(
         InventoryLot.product_id == product_id
     ).scalar() or 0
+    pool = db.session.get(AverageCost, product_id)
+    if pool is not None:
+        lot_total += pool.quantity
     
     discrepancy = product.quantity - lot_total
     
@@ -235,11 +544,103 @@ def reconcile_inventory_lots(product_id):
     }
 
 
+def reconcile_inventory(first_id=None, last_id=None):
+    """
+    Reconcile every product with an id in [first_id, last_id] (either bound may be
+    None) in one grouped pass: Product.quantity against the units in its open lots,
+    or in its AverageCost if it is costed at moving average. Ranges of ids can be
+    checked in parallel, each in its own session.
+
+    Returns:
+        dict: products (how many were checked), stock_value (the value of their
+        lots and running totals) and discrepancies, one dict per product whose
+        quantity does not match, with the keys of reconcile_inventory_lots plus
+        product_id, sku, name and lot_value
+    """
+    lots = select(
+        InventoryLot.product_id,
+        func.sum(InventoryLot.quantity_remaining).label('quantity'),
+        func.sum(InventoryLot.quantity_remaining * InventoryLot.unit_cost).label('value'),
+    ).where(lot_is_open())
+    products = []
+    if first_id is not None:
+        lots = lots.where(InventoryLot.product_id >= first_id)
+        products.append(Product.id >= first_id)
+    if last_id is not None:
+        lots = lots.where(InventoryLot.product_id <= last_id)
+        products.append(Product.id <= last_id)
+    lots = lots.group_by(InventoryLot.product_id).subquery()
+
+    rows = db.session.execute(
+        select(Product.id, Product.sku, Product.name, Product.quantity,
+               func.coalesce(lots.c.quantity, 0) + func.coalesce(AverageCost.quantity, 0),
+               func.coalesce(lots.c.value, 0.0) + func.coalesce(AverageCost.value, 0.0))
+        .outerjoin(lots, lots.c.product_id == Product.id)
+        .outerjoin(AverageCost, AverageCost.product_id == Product.id)
+        .where(*products)
+        .order_by(Product.id)
+    )
+
+    checked = 0
+    stock_value = 0.0
+    discrepancies = []
+    for product_id, sku, name, quantity, lot_total, lot_value in rows:
+        checked += 1
+        stock_value += lot_value
+        if quantity != lot_total:
+            discrepancies.append({
+                'product_id': product_id,
+                'sku': sku,
+                'name': name,
+                'product_quantity': quantity,
+                'lot_total': lot_total,
+                'lot_value': round(lot_value, 2),
+                'discrepancy': quantity - lot_total,
+                'is_balanced': False
+            })
+
+    return {'products': checked, 'stock_value': stock_value, 'discrepancies': discrepancies}
+
+
+def inventory_gl_balance():
+    """Balance (debit - credit) of the Inventory account over everything posted."""
+    account_code = get_system_account_map().get('Inventory')
+    total = db.session.query(
+        func.sum(JournalLine.debit - JournalLine.credit)
+    ).filter(
+        JournalLine.account_code == account_code
+    ).scalar()
+    return float(total or 0.0)
+
+
+def repair_inventory_quantities(discrepancies, batch_size=500):
+    """
+    Set the quantity of each product in `discrepancies` (as reconcile_inventory
+    returns them) to the units in its lots or running totals, which are what its
+    cost and the GL are based on. Loaded through the ORM so the catalog change
+    log sees the new quantities. The caller commits.
+
+    Returns:
+        int: Number of products updated
+    """
+    targets = {row['product_id']: row['lot_total'] for row in discrepancies}
+    product_ids = sorted(targets)
+    updated = 0
+    for start in range(0, len(product_ids), batch_size):
+        for product in Product.query.filter(Product.id.in_(product_ids[start:start + batch_size])):
+            product.quantity = targets[product.id]
+            updated += 1
+    return updated
+
+
 
 def reverse_inventory_consumption(sale_id=None, ar_invoice_id=None):
     """
     Reverse FIFO inventory consumption for voided transactions.
-    Restores inventory lots and deletes the consumption records.
+    Restores inventory lots and deletes the consumption records, bringing back
+    archived lots it consumed from first (see archive_utils). Lines costed at
+    moving average left no records: their units go back at the COGS recorded on
+    the line, through create_inventory_lot.
     
     Args:
         sale_id: ID of the voided sale
@@ -257,24 +658,43 @@ def reverse_inventory_consumption(sale_id=None, ar_invoice_id=None):
         query = query.filter(InventoryTransaction.ar_invoice_id == ar_invoice_id)
     else:
         raise ValueError("Must provide either sale_id or ar_invoice_id")
+
+    restore_archived_consumption(sale_id=sale_id, ar_invoice_id=ar_invoice_id)
     
     transactions = query.all()
     
     reversed_summary = {}
+    costed_fifo = set()
     
     for trans in transactions:
         # Restore the lot quantity
         lot = InventoryLot.query.get(trans.lot_id)
         if lot:
-            lot.quantity_remaining += trans.quantity_used
+            pool = db.session.get(AverageCost, lot.product_id)
+            if pool is not None:
+                # Moved to moving average since the sale: back into its running totals
+                return_average(pool, trans.quantity_used, trans.total_cost)
+            else:
+                lot.quantity_remaining += trans.quantity_used
             
             # Track what we reversed
             product_id = lot.product_id
+            costed_fifo.add(product_id)
             if product_id not in reversed_summary:
                 reversed_summary[product_id] = 0
             reversed_summary[product_id] += trans.quantity_used
         
         # Delete the transaction record
         db.session.delete(trans)
+
+    if sale_id:
+        items = SaleItem.query.filter(SaleItem.sale_id == sale_id, SaleItem.product_id.isnot(None))
+    else:
+        items = ARInvoiceItem.query.filter(ARInvoiceItem.ar_invoice_id == ar_invoice_id)
+    for item in items.all():
+        if item.product_id in costed_fifo or item.qty <= 0:
+            continue
+        create_inventory_lot(item.product_id, item.qty, (item.cogs or 0.0) / item.qty)
+        reversed_summary[item.product_id] = reversed_summary.get(item.product_id, 0) + item.qty
     
     return reversed_summary
\ No newline at end of file
@@ -0,0 +1,117 @@
+"""
+Group Commit Utilities
+"""
+import queue
+import threading
+import time
+from concurrent.futures import Future
+
+from flask import current_app
+
+from models import db
+
+
+_writers_lock = threading.Lock()
+
+
+def begin_transaction():
+    """
+    Start the session's transaction on the database before SAVEPOINTs are used.
+    pysqlite only emits BEGIN ahead of DML, so a leading SAVEPOINT would open the
+    transaction itself and its RELEASE would commit it.
+    """
+    connection = db.session.connection()
+    if connection.dialect.name == 'sqlite' and not connection.connection.dbapi_connection.in_transaction:
+        connection.exec_driver_sql('BEGIN')
+
+
+class GroupCommitWriter:
+    """
+    One writer thread that runs submitted jobs and commits them together.
+
+    The thread waits up to `window` seconds after the first job for more to arrive
+    (at most `max_batch`), runs each job in its own SAVEPOINT inside one transaction
+    and commits once. A job's future resolves only after that shared commit; a job
+    that raises fails alone and its future gets the exception straight away.
+    `before_batch(jobs)` runs before the transaction starts, e.g. to reserve
+    document numbers for the whole group.
+    """
+
+    def __init__(self, app, window, max_batch, before_batch=None):
+        self.app = app
+        self.window = window
+        self.max_batch = max_batch
+        self.before_batch = before_batch
+        self.jobs = queue.Queue()
+        self.thread = threading.Thread(target=self._run, name='group-commit-writer', daemon=True)
+        self.thread.start()
+
+    def submit(self, fn, *args, **kwargs):
+        """Queue fn(*args, **kwargs) for the writer thread and return its Future."""
+        future = Future()
+        self.jobs.put((fn, args, kwargs, future))
+        return future
+
+    def _run(self):
+        with self.app.app_context():
+            while True:
+                batch = [self.jobs.get()]
+                deadline = time.monotonic() + self.window
+                while len(batch) < self.max_batch:
+                    timeout = deadline - time.monotonic()
+                    if timeout <= 0:
+                        break
+                    try:
+                        batch.append(self.jobs.get(timeout=timeout))
+                    except queue.Empty:
+                        break
+                try:
+                    self._write(batch)
+                finally:
+                    db.session.remove()
+
+    def _write(self, batch):
+        done = []
+        try:
+            if self.before_batch:
+                self.before_batch(batch)
+            begin_transaction()
+            for fn, args, kwargs, future in batch:
+                try:
+                    with db.session.begin_nested():
+                        result = fn(*args, **kwargs)
+                except Exception as e:
+                    future.set_exception(e)
+                else:
+                    done.append((future, result))
+            db.session.commit()
+        except Exception as e:
+            db.session.rollback()
+            for _, _, _, future in batch:
+                if not future.done():
+                    future.set_exception(e)
+            return
+
+        for future, result in done:
+            future.set_result(result)
+
+
+def get_group_writer(name, before_batch=None):
+    """
+    The app's GroupCommitWriter for `name`, started on first use. The window and
+    group size come from GROUP_COMMIT_WINDOW_MS and GROUP_COMMIT_MAX_BATCH.
+    """
+    writers = current_app.extensions.setdefault('group_commit_writers', {})
+    writer = writers.get(name)
+    if writer is None:
+        with _writers_lock:
+            writer = writers.get(name)
+            if writer is None:
+                writer = GroupCommitWriter(
+                    current_app._get_current_object(),
+                    window=current_app.config.get('GROUP_COMMIT_WINDOW_MS', 5) / 1000.0,
+                    max_batch=current_app.config.get('GROUP_COMMIT_MAX_BATCH', 50),
+                    before_batch=before_batch,
+                )
+                writers[name] = writer
+    return writer
@@ -0,0 +1,205 @@
+"""
+In-Memory Ledger Cube
+"""
+import threading
+from datetime import datetime, date, timedelta
+
+import numpy as np
+from flask import current_app
+from sqlalchemy import func
+
+from models import db, JournalLine
+from routes.ledger_utils import sum_journal_lines
+
+
+# Extra days allocated past the last posting so day-to-day growth rarely reallocates
+DAY_HEADROOM = 366
+
+
+class LedgerCube:
+    """
+    Accounts x days matrix of cumulative net movement (debit - credit).
+
+    prefix[i, d] is account i's total for everything posted before day origin + d,
+    so any whole-day range costs two column lookups and a subtraction. A parallel
+    matrix of cumulative line counts tells which accounts had activity in a range,
+    so results carry the same keys as the SQL path.
+
+    Journal lines are append-only (voids post reversing entries), so the cube
+    catches up on every read by folding in lines with id > last_line_id.
+    """
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._reset()
+
+    def _reset(self):
+        self.codes = []
+        self.index = {}
+        self.origin = None
+        self.prefix = np.zeros((0, 1))
+        self.counts = np.zeros((0, 1), dtype=np.int64)
+        self.last_line_id = 0
+        self.built = False
+
+    @property
+    def n_days(self):
+        return self.prefix.shape[1] - 1
+
+    # --- Loading ---
+
+    def _daily_rows(self):
+        """(account_code, day, net, line_count, max_line_id) per account and day for the whole journal."""
+        day = func.date(JournalLine.posted_at)
+        rows = db.session.query(
+            JournalLine.account_code,
+            day,
+            func.sum(JournalLine.debit - JournalLine.credit),
+            func.count(JournalLine.id),
+            func.max(JournalLine.id)
+        ).group_by(JournalLine.account_code, day).all()
+
+        return [
+            (code, d if isinstance(d, date) else date.fromisoformat(d), float(net or 0.0), int(cnt), int(max_id))
+            for code, d, net, cnt, max_id in rows
+        ]
+
+    def _new_rows(self):
+        """
+        Same shape as _daily_rows for lines after last_line_id only.
+        Plain primary-key range read, grouped here: a GROUP BY would make
+        SQLite walk the account index over the whole table.
+        """
+        lines = db.session.query(
+            JournalLine.id, JournalLine.account_code, JournalLine.posted_at,
+            JournalLine.debit - JournalLine.credit
+        ).filter(JournalLine.id > self.last_line_id).all()
+
+        grouped = {}
+        for line_id, code, posted_at, net in lines:
+            key = (code, posted_at.date())
+            total, cnt, max_id = grouped.get(key, (0.0, 0, 0))
+            grouped[key] = (total + float(net or 0.0), cnt + 1, max(max_id, line_id))
+        return [(code, day, net, cnt, max_id) for (code, day), (net, cnt, max_id) in grouped.items()]
+
+    def build(self):
+        """Load the whole journal into the cube."""
+        self._reset()
+        rows = self._daily_rows()
+        self.built = True
+        if not rows:
+            return
+
+        self.origin = min(r[1] for r in rows)
+        last_day = max(max(r[1] for r in rows), datetime.utcnow().date())
+        n_days = (last_day - self.origin).days + 1 + DAY_HEADROOM
+
+        self.codes = sorted({r[0] for r in rows})
+        self.index = {code: i for i, code in enumerate(self.codes)}
+
+        daily = np.zeros((len(self.codes), n_days))
+        daily_counts = np.zeros((len(self.codes), n_days), dtype=np.int64)
+        rows_idx = np.array([self.index[r[0]] for r in rows])
+        days_idx = np.array([(r[1] - self.origin).days for r in rows])
+        np.add.at(daily, (rows_idx, days_idx), [r[2] for r in rows])
+        np.add.at(daily_counts, (rows_idx, days_idx), [r[3] for r in rows])
+
+        self.prefix = np.zeros((len(self.codes), n_days + 1))
+        self.prefix[:, 1:] = np.cumsum(daily, axis=1)
+        self.counts = np.zeros((len(self.codes), n_days + 1), dtype=np.int64)
+        self.counts[:, 1:] = np.cumsum(daily_counts, axis=1)
+        self.last_line_id = max(r[4] for r in rows)
+
+    def refresh(self):
+        """Fold in journal lines posted since the last build or refresh."""
+        if not self.built:
+            self.build()
+            return
+
+        rows = self._new_rows()
+        if not rows:
+            return
+
+        # A back-dated posting before the cube's first day: cheaper to start over
+        if self.origin is None or min(r[1] for r in rows) < self.origin:
+            self.build()
+            return
+
+        new_codes = sorted({r[0] for r in rows} - set(self.index))
+        if new_codes:
+            for code in new_codes:
+                self.index[code] = len(self.codes)
+                self.codes.append(code)
+            self.prefix = np.vstack([self.prefix, np.zeros((len(new_codes), self.prefix.shape[1]))])
+            self.counts = np.vstack([self.counts, np.zeros((len(new_codes), self.counts.shape[1]), dtype=np.int64)])
+
+        max_day = max((r[1] - self.origin).days for r in rows)
+        if max_day >= self.n_days:
+            extra = max_day - self.n_days + 1 + DAY_HEADROOM
+            self.prefix = np.pad(self.prefix, ((0, 0), (0, extra)), mode='edge')
+            self.counts = np.pad(self.counts, ((0, 0), (0, extra)), mode='edge')
+
+        for code, day, net, cnt, _ in rows:
+            i, d = self.index[code], (day - self.origin).days
+            self.prefix[i, d + 1:] += net
+            self.counts[i, d + 1:] += cnt
+
+        self.last_line_id = max(r[4] for r in rows)
+
+    # --- Queries ---
+
+    def _column(self, dt):
+        """Prefix column for midnight of dt's day, clamped to the cube."""
+        if dt is None:
+            return self.n_days
+        return min(max((dt.date() - self.origin).days, 0), self.n_days)
+
+    def _whole_days(self, start, end):
+        totals = self.prefix[:, self._column(end)] - (self.prefix[:, self._column(start)] if start else 0.0)
+        active = self.counts[:, self._column(end)] - (self.counts[:, self._column(start)] if start else 0)
+        return {self.codes[i]: round(float(totals[i]), 2) for i in np.nonzero(active > 0)[0]}
+
+    def balances(self, start=None, end=None):
+        """
+        Return dict: account_code -> net movement for lines posted in [start, end).
+        Whole days come from the prefix sums; a partial first or last day is
+        summed in SQL over the posted_at index.
+        """
+        with self._lock:
+            self.refresh()
+            if self.origin is None:
+                return {}
+
+            start_day = _midnight(start) if start else None
+            if start_day and start_day < start:
+                start_day += timedelta(days=1)
+            end_day = _midnight(end) if end else None
+
+            if start_day and end_day and start_day >= end_day:
+                return sum_journal_lines(start=start, end=end)
+
+            result = self._whole_days(start_day, end_day)
+
+        edges = []
+        if start and start_day != start:
+            edges.append(sum_journal_lines(start=start, end=start_day))
+        if end and end_day != end:
+            edges.append(sum_journal_lines(start=end_day, end=end))
+        for edge in edges:
+            for code, movement in edge.items():
+                result[code] = result.get(code, 0.0) + movement
+        return result
+
+
+def _midnight(dt):
+    return datetime(dt.year, dt.month, dt.day)
+
+
+def get_ledger_cube():
+    """The app's ledger cube, or None unless LEDGER_CUBE_ENABLED is set."""
+    if not current_app.config.get('LEDGER_CUBE_ENABLED'):
+        return None
+    cube = current_app.extensions.get('ledger_cube')
+    if cube is None:
+        cube = current_app.extensions.setdefault('ledger_cube', LedgerCube())
+    return cube
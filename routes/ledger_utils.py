@@ -0,0 +1,229 @@
+"""
+General Ledger Utilities
+"""
+from models import db, JournalEntry, JournalLine
+from sqlalchemy import func, or_, and_, extract, exists
+from datetime import datetime, timedelta
+
+
+LEDGER_PAGE_SIZE = 100
+
+
+def backfill_journal_lines(batch_size=1000):
+    """
+    One-shot backfill of JournalLine rows from existing entries_json.
+    Only journal entries that have no lines yet are processed, so it is
+    safe to run more than once.
+
+    Returns:
+        int: Number of journal entries backfilled
+    """
+    processed = 0
+    last_id = 0
+
+    while True:
+        batch = JournalEntry.query.filter(
+            JournalEntry.id > last_id,
+            ~JournalEntry.lines.any()
+        ).order_by(JournalEntry.id.asc()).limit(batch_size).all()
+
+        if not batch:
+            break
+
+        for je in batch:
+            je.build_lines()
+            last_id = je.id
+
+        db.session.commit()
+        processed += len(batch)
+
+    return processed
+
+
+def sum_journal_lines(start=None, end=None):
+    """
+    Net movement (debit - credit) per account for lines posted in [start, end).
+    Either bound may be None. One GROUP BY over the (account_code, posted_at) index.
+
+    Returns:
+        dict: account_code -> net movement
+    """
+    query = db.session.query(JournalLine.account_code, func.sum(JournalLine.debit - JournalLine.credit))
+    if start:
+        query = query.filter(JournalLine.posted_at >= start)
+    if end:
+        query = query.filter(JournalLine.posted_at < end)
+    return {acc_code: float(total or 0.0) for acc_code, total in query.group_by(JournalLine.account_code).all()}
+
+
+def sum_journal_lines_by_month(start=None, end=None):
+    """
+    Net movement (debit - credit) per account and calendar month for lines
+    posted in [start, end), in a single GROUP BY.
+
+    Returns:
+        list: (account_code, year, month, net movement) tuples
+    """
+    year = extract('year', JournalLine.posted_at)
+    month = extract('month', JournalLine.posted_at)
+    query = db.session.query(
+        JournalLine.account_code, year, month, func.sum(JournalLine.debit - JournalLine.credit)
+    )
+    if start:
+        query = query.filter(JournalLine.posted_at >= start)
+    if end:
+        query = query.filter(JournalLine.posted_at < end)
+    return [
+        (acc_code, int(y), int(m), float(total or 0.0))
+        for acc_code, y, m, total in query.group_by(JournalLine.account_code, year, month).all()
+    ]
+
+
+def get_opening_balance(account_code, before_date):
+    """
+    Balance (debit - credit) of an account for everything posted before a date.
+    A single SUM over the (account_code, posted_at) index.
+    """
+    if not before_date:
+        return 0.0
+
+    total = db.session.query(
+        func.sum(JournalLine.debit - JournalLine.credit)
+    ).filter(
+        JournalLine.account_code == account_code,
+        JournalLine.posted_at < before_date
+    ).scalar()
+    return float(total or 0.0)
+
+
+def entries_with_account(account_code):
+    """
+    Subquery of journal entry ids with a line on an account, for use as
+    JournalEntry.id.in_(...). Served from the (account_code, journal_entry_id) index.
+    """
+    return db.session.query(JournalLine.journal_entry_id).filter(
+        JournalLine.account_code == account_code
+    ).scalar_subquery()
+
+
+def account_has_postings(account_code):
+    """True if any journal entry has a line on the account (an EXISTS on the account index)."""
+    return db.session.query(
+        exists().where(JournalLine.account_code == account_code)
+    ).scalar()
+
+
+def encode_ledger_cursor(posted_at, line_id, balance):
+    """Cursor string for the ledger line after which the next page starts."""
+    return f"{posted_at.isoformat()}|{line_id}|{balance!r}"
+
+
+def decode_ledger_cursor(cursor):
+    """
+    Parse a cursor built by encode_ledger_cursor.
+
+    Returns:
+        tuple: (posted_at, line_id, balance)
+
+    Raises:
+        ValueError: If the cursor is malformed
+    """
+    try:
+        posted_at_str, line_id_str, balance_str = cursor.split('|')
+        return datetime.fromisoformat(posted_at_str), int(line_id_str), float(balance_str)
+    except (AttributeError, TypeError, ValueError):
+        raise ValueError(f"Invalid ledger cursor: {cursor!r}")
+
+
+def get_account_ledger_page(account_code, start_date=None, end_date=None, cursor=None,
+                            per_page=LEDGER_PAGE_SIZE):
+    """
+    One page of an account's ledger with running balances computed in SQL.
+
+    Lines are ordered by (posted_at, id) and paged by keyset: the cursor carries
+    the last line shown plus the running balance at that point, so every page
+    is an index range scan of at most per_page + 1 lines no matter how much
+    history precedes it. The opening balance is only aggregated on the first page.
+
+    Args:
+        account_code: Account to list
+        start_date: Inclusive lower bound on posted_at (optional)
+        end_date: Inclusive date upper bound on posted_at (optional)
+        cursor: Value of next_cursor from the previous page (optional)
+        per_page: Maximum number of lines to return
+
+    Returns:
+        dict: opening_balance (balance before the first line of this page),
+              rows (date, desc, debit, credit, balance, je_id),
+              closing_balance (balance after the last line of this page),
+              next_cursor (None on the last page)
+
+    Raises:
+        ValueError: If the cursor is malformed
+    """
+    if cursor:
+        after_posted_at, after_id, opening_balance = decode_ledger_cursor(cursor)
+    else:
+        after_posted_at, after_id = None, None
+        opening_balance = get_opening_balance(account_code, start_date)
+
+    running = func.sum(JournalLine.debit - JournalLine.credit).over(
+        order_by=(JournalLine.posted_at, JournalLine.id)
+    )
+
+    query = db.session.query(
+        JournalLine.id,
+        JournalLine.posted_at,
+        JournalLine.debit,
+        JournalLine.credit,
+        running.label('running'),
+        JournalEntry.id,
+        JournalEntry.description
+    ).join(
+        JournalEntry, JournalEntry.id == JournalLine.journal_entry_id
+    ).filter(
+        JournalLine.account_code == account_code
+    )
+
+    if start_date:
+        query = query.filter(JournalLine.posted_at >= start_date)
+    if end_date:
+        end_date_inclusive = end_date + timedelta(days=1)
+        query = query.filter(JournalLine.posted_at < end_date_inclusive)
+    if after_posted_at is not None:
+        query = query.filter(or_(
+            JournalLine.posted_at > after_posted_at,
+            and_(JournalLine.posted_at == after_posted_at, JournalLine.id > after_id)
+        ))
+
+    results = query.order_by(
+        JournalLine.posted_at, JournalLine.id
+    ).limit(per_page + 1).all()
+
+    has_more = len(results) > per_page
+    results = results[:per_page]
+
+    rows = []
+    balance = opening_balance
+    for line_id, posted_at, debit, credit, running_total, je_id, description in results:
+        balance = opening_balance + float(running_total or 0.0)
+        rows.append({
+            'date': posted_at,
+            'desc': description,
+            'debit': float(debit or 0.0),
+            'credit': float(credit or 0.0),
+            'balance': balance,
+            'je_id': je_id,
+        })
+
+    next_cursor = None
+    if has_more:
+        last_id, last_posted_at = results[-1][0], results[-1][1]
+        next_cursor = encode_ledger_cursor(last_posted_at, last_id, balance)
+
+    return {
+        'opening_balance': opening_balance,
+        'rows': rows,
+        'closing_balance': balance,
+        'next_cursor': next_cursor,
+    }
@@ -0,0 +1,234 @@
+"""
+SKU / Barcode Lookup Index
+"""
+import bisect
+import threading
+import time
+
+from flask import current_app
+from sqlalchemy import event, or_, select
+from sqlalchemy.orm import Session
+
+from models import db, Product, ConsignmentItem
+from routes.catalog_utils import (catalog_version, changed_catalog_items, consignment_available,
+                                  sellable_consignment_items)
+
+
+DEFAULT_LOOKUP_REFRESH_SECONDS = 1.0
+TYPEAHEAD_LIMIT = 20
+
+# Bumped when a transaction in this process commits catalog changes, so the
+# index catches up on the next lookup instead of waiting for its refresh interval
+_catalog_commits = 0
+_commits_lock = threading.Lock()
+
+
+@event.listens_for(Session, 'after_commit')
+def _note_catalog_commit(session):
+    global _catalog_commits
+    if session.in_nested_transaction():
+        return  # A released savepoint; the change is not visible until the outer commit
+    if session.info.pop('catalog_changed', False):
+        with _commits_lock:
+            _catalog_commits += 1
+
+
+def _product_entry(row):
+    return {
+        'type': 'regular',
+        'id': row.id,
+        'sku': row.sku,
+        'name': row.name,
+        'barcode': None,
+        'price': row.sale_price,
+        'cost_price': row.cost_price,
+        'quantity': row.quantity,
+        'is_active': bool(row.is_active),
+        'is_consignment': False,
+    }
+
+
+def _consignment_entry(row):
+    return {
+        'type': 'consignment',
+        'id': row.id,
+        'sku': row.sku,
+        'name': row.product_name,
+        'barcode': row.barcode,
+        'price': row.retail_price,
+        'quantity': row.available,
+        'is_active': True,
+        'is_consignment': True,
+        'consignment_id': row.consignment_id,
+    }
+
+
+def _product_rows(where=None):
+    query = select(Product.id, Product.sku, Product.name, Product.sale_price, Product.cost_price,
+                   Product.quantity, Product.is_active)
+    if where is not None:
+        query = query.where(where)
+    return [_product_entry(row) for row in db.session.execute(query)]
+
+
+def _consignment_rows(where=None):
+    query = sellable_consignment_items(select(
+        ConsignmentItem.id, ConsignmentItem.sku, ConsignmentItem.product_name, ConsignmentItem.barcode,
+        ConsignmentItem.retail_price, consignment_available().label('available'), ConsignmentItem.consignment_id,
+    ))
+    if where is not None:
+        query = query.where(where)
+    return [_consignment_entry(row) for row in db.session.execute(query)]
+
+
+def _codes(entry):
+    return {code for code in (entry['sku'], entry['barcode']) if code}
+
+
+def _terms(entry):
+    return {term.lower() for term in (entry['sku'], entry['barcode'], entry['name']) if term}
+
+
+class LookupIndex:
+    """
+    Every product (active or not) and sellable consignment item, held in memory:
+    an exact map from SKU and barcode to items, and a sorted list of
+    (lowercased SKU, barcode or name, item key) for prefix typeahead with bisect.
+
+    The index follows the catalog change log: a lookup after a catalog commit in
+    this process applies the new changes first, and otherwise the log is
+    checked at most every `refresh_seconds` for other workers' changes.
+    """
+
+    def __init__(self, refresh_seconds=DEFAULT_LOOKUP_REFRESH_SECONDS):
+        self.refresh_seconds = refresh_seconds
+        self.lock = threading.RLock()
+        self.version = None
+        self.seen_commits = None
+        self.next_check = 0.0
+        self.items = {}     # (type, id) -> entry
+        self.codes = {}     # SKU or barcode -> [(type, id), ...]
+        self.prefixes = []  # sorted [(term, (type, id)), ...]
+
+    def _refresh(self):
+        if self.seen_commits == _catalog_commits and time.monotonic() < self.next_check:
+            return
+        with self.lock:
+            commits = _catalog_commits
+            if self.seen_commits == commits and time.monotonic() < self.next_check:
+                return
+            version = catalog_version()
+            if version != self.version:
+                keys = changed_catalog_items(self.version, version) if self.version is not None else None
+                if keys is None:
+                    self._load_all()
+                else:
+                    self._reload(keys)
+                self.version = version
+            self.seen_commits = commits
+            self.next_check = time.monotonic() + self.refresh_seconds
+
+    def _load_all(self):
+        self.items, self.codes, self.prefixes = {}, {}, []
+        entries = _product_rows() + _consignment_rows()
+        for entry in entries:
+            key = (entry['type'], entry['id'])
+            self.items[key] = entry
+            for code in _codes(entry):
+                self.codes.setdefault(code, []).append(key)
+        self.prefixes = sorted((term, (entry['type'], entry['id'])) for entry in entries for term in _terms(entry))
+
+    def _reload(self, keys):
+        product_ids = [item_id for kind, item_id in keys if kind == 'regular']
+        consignment_ids = [item_id for kind, item_id in keys if kind == 'consignment']
+        for key in keys:
+            self._drop(tuple(key))
+        entries = []
+        if product_ids:
+            entries += _product_rows(Product.id.in_(product_ids))
+        if consignment_ids:
+            entries += _consignment_rows(ConsignmentItem.id.in_(consignment_ids))
+        for entry in entries:
+            self._put(entry)
+
+    def _put(self, entry):
+        key = (entry['type'], entry['id'])
+        self.items[key] = entry
+        for code in _codes(entry):
+            self.codes.setdefault(code, []).append(key)
+        for term in _terms(entry):
+            bisect.insort(self.prefixes, (term, key))
+
+    def _drop(self, key):
+        entry = self.items.pop(key, None)
+        if entry is None:
+            return
+        for code in _codes(entry):
+            keys = self.codes.get(code, [])
+            if key in keys:
+                keys.remove(key)
+            if not keys:
+                self.codes.pop(code, None)
+        for term in _terms(entry):
+            i = bisect.bisect_left(self.prefixes, (term, key))
+            if i < len(self.prefixes) and self.prefixes[i] == (term, key):
+                del self.prefixes[i]
+
+    def by_code(self, code):
+        """Items whose SKU or barcode is exactly `code`."""
+        self._refresh()
+        with self.lock:
+            return [self.items[key] for key in self.codes.get(code, ())]
+
+    def typeahead(self, prefix, limit=TYPEAHEAD_LIMIT, kind=None):
+        """
+        Up to `limit` sellable items whose SKU, barcode or name starts with `prefix`
+        (case-insensitive), optionally only of one catalog type ('regular' or 'consignment').
+        """
+        self._refresh()
+        prefix = prefix.lower()
+        found, seen = [], set()
+        with self.lock:
+            i = bisect.bisect_left(self.prefixes, (prefix,))
+            while i < len(self.prefixes) and len(found) < limit:
+                term, key = self.prefixes[i]
+                if not term.startswith(prefix):
+                    break
+                entry = self.items[key]
+                if key not in seen and entry['is_active'] and (kind is None or key[0] == kind):
+                    seen.add(key)
+                    found.append(entry)
+                i += 1
+        return found
+
+
+def get_lookup_index():
+    """The app's LookupIndex, built on first use."""
+    index = current_app.extensions.get('lookup_index')
+    if index is None:
+        index = current_app.extensions.setdefault('lookup_index', LookupIndex(
+            current_app.config.get('LOOKUP_REFRESH_SECONDS', DEFAULT_LOOKUP_REFRESH_SECONDS)
+        ))
+    return index
+
+
+def lookup_code(code):
+    """
+    The sellable item a scanned SKU or barcode belongs to, or None. Products win
+    over consignment items sharing the code. A miss is checked against the
+    database, for items created in another worker since the last refresh.
+    """
+    entries = [entry for entry in get_lookup_index().by_code(code) if entry['is_active']]
+    if not entries:
+        entries = [entry for entry in _product_rows(Product.sku == code) if entry['is_active']] \
+            or _consignment_rows(or_(ConsignmentItem.barcode == code, ConsignmentItem.sku == code))
+    return entries[0] if entries else None
+
+
+def lookup_product(sku):
+    """The product with this exact SKU, active or not, or None."""
+    for entry in get_lookup_index().by_code(sku):
+        if entry['type'] == 'regular' and entry['sku'] == sku:
+            return entry
+    entries = _product_rows(Product.sku == sku)
+    return entries[0] if entries else None
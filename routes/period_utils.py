@@ -0,0 +1,140 @@
+"""
+Accounting Period Close Utilities
+"""
+from models import db, Account, AccountingPeriod, PeriodClosingBalance, JournalLine
+from routes.ledger_utils import sum_journal_lines
+from sqlalchemy import func
+from datetime import datetime
+
+
+def month_bounds(year, month):
+    """Return (first instant of the month, first instant of the next month)."""
+    start = datetime(year, month, 1)
+    end = datetime(year + 1, 1, 1) if month == 12 else datetime(year, month + 1, 1)
+    return start, end
+
+
+def get_latest_closed_period(before=None):
+    """
+    Latest closed period whose end_date is on or before the given datetime.
+    With no argument, the latest closed period overall.
+    """
+    query = AccountingPeriod.query
+    if before:
+        query = query.filter(AccountingPeriod.end_date <= before)
+    return query.order_by(AccountingPeriod.end_date.desc()).first()
+
+
+def get_next_period_to_close():
+    """
+    (start, end) of the month that would be closed next, or None if there is
+    nothing posted yet. Periods close strictly in order, starting at the month
+    of the earliest journal line.
+    """
+    latest = get_latest_closed_period()
+    if latest:
+        start = latest.end_date
+    else:
+        first_posted = db.session.query(func.min(JournalLine.posted_at)).scalar()
+        if not first_posted:
+            return None
+        start = datetime(first_posted.year, first_posted.month, 1)
+    return month_bounds(start.year, start.month)
+
+
+def get_closing_balances(period):
+    """Return dict: account_code -> frozen cumulative balance for a closed period."""
+    rows = db.session.query(
+        PeriodClosingBalance.account_code, PeriodClosingBalance.balance
+    ).filter(PeriodClosingBalance.period_id == period.id).all()
+    return {code: float(balance) for code, balance in rows}
+
+
+def balances_as_of(end):
+    """
+    Cumulative balance per account for everything posted before `end`
+    (exclusive; None means no upper bound).
+
+    Starts from the latest closing snapshot on or before `end` and only sums
+    journal lines posted after it, so the cost depends on activity since the
+    last close rather than on the company's whole history.
+
+    Returns:
+        tuple: (dict account_code -> balance, AccountingPeriod or None)
+    """
+    period = get_latest_closed_period(before=end)
+    if not period:
+        return sum_journal_lines(end=end), None
+
+    balances = get_closing_balances(period)
+    for code, movement in sum_journal_lines(start=period.end_date, end=end).items():
+        balances[code] = balances.get(code, 0.0) + movement
+    return balances, period
+
+
+def net_income_from_balances(balances, account_types=None):
+    """Revenue minus Expense for a dict of account_code -> balance (debit - credit)."""
+    if account_types is None:
+        account_types = dict(db.session.query(Account.code, Account.type).all())
+    net_income = 0.0
+    for code, bal in balances.items():
+        acc_type = account_types.get(code)
+        if acc_type in ('Revenue', 'Expense'):
+            net_income -= bal
+    return net_income
+
+
+def close_period(year, month, user=None):
+    """
+    Close one month: freeze each account's cumulative balance at month end,
+    roll the month's net income into retained earnings and lock the period
+    against new postings and voids.
+
+    Raises:
+        ValueError: If the month is not the next one in sequence or has not ended yet
+    """
+    next_bounds = get_next_period_to_close()
+    if next_bounds is None:
+        raise ValueError("There are no journal entries to close.")
+
+    start, end = month_bounds(year, month)
+    if (start, end) != next_bounds:
+        raise ValueError(f"Periods must be closed in order. The next period to close is {next_bounds[0]:%B %Y}.")
+    if end > datetime.utcnow():
+        raise ValueError(f"{start:%B %Y} has not ended yet.")
+
+    previous = get_latest_closed_period()
+    balances = get_closing_balances(previous) if previous else {}
+    movements = sum_journal_lines(start=start, end=end)
+    for code, movement in movements.items():
+        balances[code] = balances.get(code, 0.0) + movement
+
+    net_income = net_income_from_balances(movements)
+    period = AccountingPeriod(
+        start_date=start,
+        end_date=end,
+        net_income=round(net_income, 2),
+        retained_earnings=round((previous.retained_earnings if previous else 0.0) + net_income, 2),
+        closed_by=user.id if user else None,
+        closed_at=datetime.utcnow()
+    )
+    period.balances = [
+        PeriodClosingBalance(account_code=code, balance=round(balance, 2))
+        for code, balance in sorted(balances.items())
+    ]
+    db.session.add(period)
+    return period
+
+
+def reopen_latest_period():
+    """
+    Reopen the most recently closed month, discarding its snapshot.
+
+    Raises:
+        ValueError: If no period has been closed
+    """
+    period = get_latest_closed_period()
+    if not period:
+        raise ValueError("No closed period to reopen.")
+    db.session.delete(period)
+    return period
@@ -0,0 +1,137 @@
+"""
+Journal Posting Utilities
+"""
+import json
+from datetime import datetime
+
+from sqlalchemy import insert
+
+from models import db, JournalEntry, JournalLine, check_period_lock
+from routes.utils import get_system_account_code
+
+
+# Callers round each line independently, so up to a cent of rounding residue is accepted
+BALANCE_TOLERANCE = 0.01
+
+
+class UnbalancedEntryError(ValueError):
+    """Raised when a journal entry's debits and credits do not agree."""
+
+
+def resolve_lines(lines):
+    """
+    Return journal lines with every {'system_account': name} replaced by its
+    {'account_code': code}, resolved from the preloaded account map.
+    Lines that already carry an account_code are passed through unchanged.
+    """
+    resolved = []
+    for line in lines:
+        if 'system_account' in line:
+            rest = {key: value for key, value in line.items() if key != 'system_account'}
+            line = {'account_code': get_system_account_code(line['system_account']), **rest}
+        resolved.append(line)
+    return resolved
+
+
+def check_balance(lines):
+    """
+    Raises:
+        UnbalancedEntryError: If total debits and credits differ by more than BALANCE_TOLERANCE
+    """
+    total_debit = sum(float(line.get('debit', 0) or 0) for line in lines)
+    total_credit = sum(float(line.get('credit', 0) or 0) for line in lines)
+    if abs(total_debit - total_credit) > BALANCE_TOLERANCE + 1e-9:
+        raise UnbalancedEntryError(
+            f'Journal entry is unbalanced. Debits ₱{total_debit:,.2f} vs credits ₱{total_credit:,.2f}.'
+        )
+
+
+def build_journal_entry(lines, description, posted_at=None):
+    """Validate and build (but do not add) a JournalEntry from a list of lines."""
+    lines = resolve_lines(lines)
+    check_balance(lines)
+    return JournalEntry(
+        description=description,
+        entries_json=json.dumps(lines),
+        created_at=posted_at or datetime.utcnow()
+    )
+
+
+def post_journal(lines, description, posted_at=None):
+    """
+    Post one journal entry. Lines are dicts of account_code (or system_account),
+    debit and credit; the entry is checked for balance once and added to the session.
+    Its JournalLine rows are written with it at flush time, and the caller commits.
+
+    Raises:
+        UnbalancedEntryError: If debits and credits do not agree
+    """
+    je = build_journal_entry(lines, description, posted_at)
+    db.session.add(je)
+    return je
+
+
+def post_many(entries):
+    """
+    Post many journal entries at once, for imports and batch jobs.
+    `entries` is an iterable of (lines, description) or (lines, description, posted_at).
+
+    Every entry is validated before anything is written, so one bad entry posts
+    nothing. Headers go in through one INSERT ... RETURNING executed for all
+    entries, with the ids sorted back into parameter order (SQLite cannot batch
+    that, so it runs a statement per header without the ORM flush), and all lines
+    as one executemany. The caller commits.
+
+    Returns:
+        list: The new journal entry ids, in the order given
+
+    Raises:
+        UnbalancedEntryError: If any entry's debits and credits do not agree
+        PeriodLockedError: If any entry is dated inside a closed period
+    """
+    journal_entries = [build_journal_entry(*entry) for entry in entries]
+    if not journal_entries:
+        return []
+    check_period_lock(db.session, journal_entries)
+
+    ids = db.session.execute(
+        insert(JournalEntry).returning(JournalEntry.id, sort_by_parameter_order=True),
+        [{'created_at': je.created_at, 'description': je.description, 'entries_json': je.entries_json}
+         for je in journal_entries]
+    ).scalars().all()
+
+    line_rows = [
+        {'journal_entry_id': je_id, **row}
+        for je_id, je in zip(ids, journal_entries)
+        for row in je.line_rows()
+    ]
+    if line_rows:
+        db.session.execute(insert(JournalLine), line_rows)
+    return ids
+
+
+def reverse_journal(original, description, user=None, reason=None):
+    """
+    Void a journal entry: post its exact mirror (debits and credits swapped) and
+    mark the original as voided. The reversal is not balance-checked, since it
+    must cancel the original exactly whatever it contained.
+    """
+    reversed_lines = [
+        {
+            'account_code': line['account_code'],
+            'debit': line.get('credit', 0),  # Swap debit/credit
+            'credit': line.get('debit', 0)
+        }
+        for line in original.entries()
+    ]
+    reversing_je = JournalEntry(
+        description=description,
+        entries_json=json.dumps(reversed_lines),
+        created_at=datetime.utcnow()
+    )
+    db.session.add(reversing_je)
+
+    original.voided_at = datetime.utcnow()
+    original.voided_by = user.id if user else None
+    original.void_reason = reason
+    return reversing_je
@@ -0,0 +1,113 @@
+"""
+POS Pricing Kernel
+"""
+from config import Config
+
+
+VAT_RATE = Config.VAT_RATE
+
+
+def line_gross(unit_price, qty):
+    return round(unit_price * qty, 2)
+
+
+def _vat_inclusive_split(amount, is_vatable, vat_rate):
+    """(net, vat) of a VAT-inclusive amount."""
+    vat = round(amount * (vat_rate / (1 + vat_rate)), 2) if is_vatable else 0.0
+    return round(amount - vat, 2), vat
+
+
+def price_cart(lines, is_vatable, discount_type=None, discount_input=0.0, vat_rate=VAT_RATE):
+    """
+    Totals of one cart, without touching the database.
+
+    Args:
+        lines: Sequence of (unit_price, qty, is_consignment)
+        is_vatable: Whether the sale carries VAT (prices are VAT-inclusive)
+        discount_type: None, 'percent', 'fixed' or 'sc_pwd'
+        discount_input: Percent for 'percent'/'sc_pwd', amount for 'fixed'
+
+    Returns:
+        dict: line_gross (per line), subtotal, discount, the net/vat of regular and
+        consignment sales, and the sale's vat and total
+
+    SC/PWD discounts (VATable sales only) take the percentage off the VAT-exclusive
+    price of regular items and make them VAT-exempt; consignment items keep their
+    price. Percent and fixed discounts are apportioned between regular and
+    consignment sales by their share of the gross.
+    """
+    grosses = [line_gross(unit_price, qty) for unit_price, qty, _ in lines]
+    subtotal = 0.0
+    regular_gross = 0.0
+    consignment_gross = 0.0
+    for gross, (_, _, is_consignment) in zip(grosses, lines):
+        subtotal += gross
+        if is_consignment:
+            consignment_gross += gross
+        else:
+            regular_gross += gross
+
+    discount = 0.0
+    if discount_type == 'sc_pwd' and is_vatable:
+        regular_net_base = round(regular_gross / (1 + vat_rate), 2)
+        pct = max(0.0, min(100.0, float(discount_input)))
+        discount = round(regular_net_base * (pct / 100.0), 2)
+        regular_final = round(regular_net_base - discount, 2)
+        regular_net, regular_vat = regular_final, 0.0
+        consignment_final = consignment_gross
+    else:
+        if discount_type and discount_input:
+            if discount_type == 'percent':
+                pct = max(0.0, min(100.0, float(discount_input)))
+                discount = round(subtotal * (pct / 100.0), 2)
+            else:
+                discount = round(min(subtotal, float(discount_input)), 2)
+        if subtotal > 0:
+            regular_share = round(discount * (regular_gross / subtotal), 2)
+            consignment_share = round(discount * (consignment_gross / subtotal), 2)
+        else:
+            regular_share = consignment_share = 0.0
+        regular_final = regular_gross - regular_share
+        regular_net, regular_vat = _vat_inclusive_split(regular_final, is_vatable, vat_rate)
+        consignment_final = consignment_gross - consignment_share
+
+    consignment_net, consignment_vat = _vat_inclusive_split(consignment_final, is_vatable, vat_rate)
+
+    return {
+        'line_gross': grosses,
+        'subtotal': subtotal,
+        'regular_gross': regular_gross,
+        'consignment_gross': consignment_gross,
+        'discount': discount,
+        'regular_net': regular_net,
+        'regular_vat': regular_vat,
+        'consignment_net': consignment_net,
+        'consignment_vat': consignment_vat,
+        'vat': round(regular_vat + consignment_vat, 2),
+        'total': round(regular_final + consignment_final, 2),
+    }
+
+
+def price_carts(carts, vat_rate=VAT_RATE):
+    """
+    Totals of many carts: each cart is a dict with `lines`, `is_vatable` and
+    optionally `discount_type` / `discount_input` as taken by price_cart.
+    """
+    return [price_cart(cart['lines'], cart['is_vatable'], cart.get('discount_type'),
+                       cart.get('discount_input') or 0.0, vat_rate)
+            for cart in carts]
+
+
+def consignment_commission(lines):
+    """
+    Store commission on consignment lines, charged on the pre-discount gross of
+    each consignment: `lines` is a sequence of (consignment_id, line_gross, commission_rate %).
+    """
+    groups = {}
+    for consignment_id, gross, rate in lines:
+        total, _ = groups.get(consignment_id, (0.0, rate))
+        groups[consignment_id] = (total + gross, rate)
+    commission = 0.0
+    for total, rate in groups.values():
+        commission += round(total * (rate / 100 if rate else 0), 2)
+    return commission
@@ -0,0 +1,162 @@
+"""
+Report Result Cache
+"""
+import threading
+from collections import OrderedDict
+from datetime import date, datetime
+from functools import wraps
+
+from flask import current_app, request, Response
+from sqlalchemy import event, func, select
+from sqlalchemy.orm import Session
+
+from models import db, JournalEntry, AccountingPeriod, Account
+
+
+DEFAULT_REPORT_CACHE_SIZE = 256
+
+# Bumped by the after_flush hook below whenever a journal entry is posted or voided,
+# a period is closed/reopened or the chart of accounts is edited in this process.
+_ledger_counter = 0
+_counter_lock = threading.Lock()
+
+
+@event.listens_for(Session, 'after_flush')
+def _bump_ledger_version(session, flush_context):
+    """Advance the in-process ledger counter when a flush changes what reports would show."""
+    global _ledger_counter
+    changed = any(isinstance(obj, (JournalEntry, AccountingPeriod, Account)) for obj in session.new) \
+        or any(isinstance(obj, (AccountingPeriod, Account)) for obj in session.deleted) \
+        or any(isinstance(obj, Account) or
+               isinstance(obj, JournalEntry) and db.inspect(obj).attrs.voided_at.history.has_changes()
+               for obj in session.dirty)
+    if changed:
+        with _counter_lock:
+            _ledger_counter += 1
+
+
+def ledger_version():
+    """
+    Version of the posted ledger: (process counter, last journal entry id, last closed
+    period, last account id). The counter reacts immediately in this process, also to
+    account edits; the committed ids make other worker processes' postings and new
+    accounts (and commits that land after a flush was counted) visible too.
+    """
+    last_je_id, last_close, last_account_id = db.session.execute(select(
+        select(func.max(JournalEntry.id)).scalar_subquery(),
+        select(func.max(AccountingPeriod.end_date)).scalar_subquery(),
+        select(func.max(Account.id)).scalar_subquery()
+    )).one()
+    return _ledger_counter, last_je_id, last_close, last_account_id
+
+
+def _normalize(value):
+    """Turn report parameters into a hashable, order-independent key."""
+    if isinstance(value, (datetime, date)):
+        return value.isoformat()
+    if isinstance(value, dict):
+        return tuple(sorted((k, _normalize(v)) for k, v in value.items()))
+    if isinstance(value, (list, tuple)):
+        return tuple(_normalize(v) for v in value)
+    return value
+
+
+class ReportCache:
+    """Bounded LRU of report results keyed by (report name, params, ledger version)."""
+
+    def __init__(self, maxsize=DEFAULT_REPORT_CACHE_SIZE):
+        self.maxsize = maxsize
+        self._data = OrderedDict()
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+
+    def get_or_compute(self, name, params, compute):
+        key = (name, _normalize(params), ledger_version())
+        with self._lock:
+            if key in self._data:
+                self._data.move_to_end(key)
+                self.hits += 1
+                return self._data[key]
+            self.misses += 1
+
+        value = compute()
+
+        with self._lock:
+            self._data[key] = value
+            self._data.move_to_end(key)
+            while len(self._data) > self.maxsize:
+                self._data.popitem(last=False)
+                self.evictions += 1
+        return value
+
+    def clear(self):
+        with self._lock:
+            self._data.clear()
+
+    def stats(self):
+        with self._lock:
+            lookups = self.hits + self.misses
+            return {
+                'size': len(self._data),
+                'maxsize': self.maxsize,
+                'hits': self.hits,
+                'misses': self.misses,
+                'evictions': self.evictions,
+                'hit_rate': round(self.hits / lookups, 4) if lookups else 0.0,
+            }
+
+
+def get_report_cache():
+    """The app's report cache, or None when REPORT_CACHE_SIZE is 0."""
+    maxsize = current_app.config.get('REPORT_CACHE_SIZE', DEFAULT_REPORT_CACHE_SIZE)
+    if not maxsize:
+        return None
+    cache = current_app.extensions.get('report_cache')
+    if cache is None:
+        cache = current_app.extensions.setdefault('report_cache', ReportCache(maxsize))
+    return cache
+
+
+def cached_report(name):
+    """
+    Cache a report computation by its arguments and the ledger version.
+    Results are shared between requests, so callers must treat them as read-only
+    and the function must not return ORM instances.
+    """
+    def decorator(fn):
+        @wraps(fn)
+        def wrapper(*args, **kwargs):
+            cache = get_report_cache()
+            if cache is None:
+                return fn(*args, **kwargs)
+            return cache.get_or_compute(name, (args, kwargs), lambda: fn(*args, **kwargs))
+        wrapper.uncached = fn
+        return wrapper
+    return decorator
+
+
+def cached_export(name):
+    """
+    Cache a file-export view's response body by its query string, today's date
+    (exports default to 'as of today') and the ledger version.
+    """
+    def decorator(view):
+        @wraps(view)
+        def wrapper(*args, **kwargs):
+            cache = get_report_cache()
+            if cache is None:
+                return view(*args, **kwargs)
+
+            def render():
+                response = view(*args, **kwargs)
+                headers = {k: v for k, v in response.headers.items()
+                           if k not in ('Content-Type', 'Content-Length')}
+                return response.get_data(), response.mimetype, headers
+
+            params = (sorted(request.args.items(multi=True)), kwargs, date.today())
+            body, mimetype, headers = cache.get_or_compute(name, params, render)
+            return Response(body, mimetype=mimetype, headers=headers)
+        return wrapper
+    return decorator
@@ -1,15 +1,17 @@
-from flask import Blueprint, render_template, request, abort, Response
+from flask import Blueprint, render_template, request, abort, Response, jsonify, flash, redirect, url_for
 from flask_login import login_required
 # Add CompanyProfile, Customer, Supplier, CreditMemo
-from models import db, JournalEntry, Account, Sale, Purchase, Product, ARInvoice, APInvoice, CompanyProfile, Customer, Supplier, CreditMemo, Payment, SaleItem, PurchaseItem, StockAdjustment
-from collections import defaultdict
+from models import db, Account, Sale, Purchase, Product, ARInvoice, APInvoice, CompanyProfile, Customer, Supplier, CreditMemo, Payment, SaleItem, PurchaseItem, StockAdjustment
 import json
 from sqlalchemy import func, extract, cast, Date, or_, and_
 from datetime import datetime, date, timedelta
 from routes.decorators import role_required
 import io
 import csv
-from routes.utils import get_system_account_code  # add this near your other imports at top of file
+from routes.ledger_utils import get_account_ledger_page
+from routes.report_cache import cached_report, cached_export, get_report_cache
+from routes.statements import (build_statements, build_balance_sheet, build_comparative_income_statement,
+                               build_comparative_balance_sheet)
 
 
 reports_bp = Blueprint('reports', __name__, url_prefix='/reports')
@@ -22,6 +24,62 @@ def parse_date(date_str):
     except (ValueError, TypeError):
         return None
 
+def comparative_range(start_date, end_date):
+    """Fill in a comparative report's range: defaults to the twelve months ending with end_date (or today)."""
+    end_date = end_date or datetime.combine(date.today(), datetime.min.time())
+    if not start_date:
+        year, month = end_date.year, end_date.month - 11
+        if month <= 0:
+            year, month = year - 1, month + 12
+        start_date = datetime(year, month, 1)
+    return start_date, end_date
+
+
+def render_comparative(builder, endpoint, export_endpoint, grain, start_date, end_date):
+    """Render a comparative statement page, or bounce back to the single-period view on bad input."""
+    start_date, end_date = comparative_range(start_date, end_date)
+    try:
+        report = builder(start_date, end_date, grain)
+    except ValueError as e:
+        flash(str(e), 'danger')
+        return redirect(url_for(endpoint))
+    return render_template('comparative_statement.html', report=report,
+                           endpoint=endpoint, export_endpoint=export_endpoint,
+                           start_date=start_date.strftime('%Y-%m-%d'), end_date=end_date.strftime('%Y-%m-%d'))
+
+
+def comparative_csv(builder, grain, start_date, end_date, filename_prefix):
+    """CSV export of a comparative statement: one amount column per period."""
+    start_date, end_date = comparative_range(start_date, end_date)
+    try:
+        report = builder(start_date, end_date, grain)
+    except ValueError:
+        abort(400)
+
+    output = io.StringIO()
+    writer = csv.writer(output)
+    writer.writerow([f"Comparative {report.title} by {grain}", ""])
+    writer.writerow([f"For the period {start_date:%Y-%m-%d} to {end_date:%Y-%m-%d}", ""])
+    writer.writerow([])
+    writer.writerow(["Account"] + report.labels)
+
+    def amounts(line):
+        return [f"({v:.2f})" if line.negative else f"{v:.2f}" for v in line.values]
+
+    for section in report.sections:
+        if section.title:
+            writer.writerow([section.title])
+        for line in section.lines:
+            writer.writerow([line.name] + amounts(line))
+        if section.total:
+            writer.writerow([section.total.name] + amounts(section.total))
+        writer.writerow([])
+
+    output.seek(0)
+    filename = f"{filename_prefix}_{grain}_{start_date:%Y%m%d}_{end_date:%Y%m%d}.csv"
+    return Response(output.getvalue(), mimetype="text/csv", headers={"Content-Disposition": f"attachment; filename={filename}"})
+
+
 @reports_bp.route('/trial-balance')
 @login_required
 @role_required('Admin', 'Accountant')
@@ -33,29 +91,11 @@ def trial_balance():
     start_date = parse_date(start_date_str)
     end_date = parse_date(end_date_str)
     
-    # --- MODIFIED: Pass dates to the aggregator ---
-    agg = aggregate_account_balances(start_date, end_date)
-    
-    tb = []
-    total_debit = 0.0
-    total_credit = 0.0
-    
-    for acc_code, val in agg.items():
-        acc_details = Account.query.filter_by(code=acc_code).first()
-        acc_name = acc_details.name if acc_details else f"Unknown ({acc_code})"
-        
-        if val >= 0:
-            tb.append({'code': acc_code, 'name': acc_name, 'debit': val, 'credit': 0.0})
-            total_debit += val
-        else:
-            tb.append({'code': acc_code, 'name': acc_name, 'debit': 0.0, 'credit': -val})
-            total_credit += -val
-            
-    tb.sort(key=lambda x: x['code'])
+    statements = build_statements(start_date, end_date)
     
     # --- MODIFIED: Pass dates back to the template ---
-    return render_template('trial_balance.html', tb=tb, 
-                           total_debit=total_debit, total_credit=total_credit,
+    return render_template('trial_balance.html', tb=statements.trial_balance, 
+                           total_debit=statements.total_debit, total_credit=statements.total_credit,
                            start_date=start_date_str, end_date=end_date_str)
 
 
@@ -68,47 +108,32 @@ def ledger(code):
     # --- MODIFIED: Get dates from URL ---
     start_date_str = request.args.get('start_date', '')
     end_date_str = request.args.get('end_date', '')
+    cursor = request.args.get('cursor') or None
 
     start_date = parse_date(start_date_str)
     end_date = parse_date(end_date_str)
-    
-    # --- MODIFIED: Filter the Journal Entry query by date ---
-    query = JournalEntry.query.order_by(JournalEntry.created_at)
-    if start_date:
-        query = query.filter(JournalEntry.created_at >= start_date)
-    if end_date:
-        end_date_inclusive = end_date + timedelta(days=1)
-        query = query.filter(JournalEntry.created_at < end_date_inclusive)
-    
+
+    # --- Running balances come from SQL, paged by (posted_at, id) keyset ---
+    try:
+        page = get_account_ledger_page(code, start_date, end_date, cursor=cursor)
+    except ValueError:
+        abort(400)
+
     rows = []
-    balance = 0.0
-    
-    # --- MODIFIED: Get running balance *before* the start date (if one exists) ---
-    if start_date:
-        opening_balance_query = JournalEntry.query.filter(JournalEntry.created_at < start_date)
-        for je in opening_balance_query.all():
-            for line in je.entries():
-                if line.get('account_code') == code:
-                    debit = float(line.get('debit', 0) or 0)
-                    credit = float(line.get('credit', 0) or 0)
-                    balance += debit - credit
-        
+    if cursor and page['rows']:
+        rows.append({'date': page['rows'][0]['date'], 'desc': 'Balance Brought Forward',
+                     'debit': 0, 'credit': 0, 'balance': page['opening_balance']})
+    elif start_date:
         # Add the opening balance as the first row
-        rows.append({'date': start_date, 'desc': 'Opening Balance', 'debit': 0, 'credit': 0, 'balance': balance})
+        rows.append({'date': start_date, 'desc': 'Opening Balance', 'debit': 0, 'credit': 0,
+                     'balance': page['opening_balance']})
+    rows.extend(page['rows'])
 
-
-    # --- MODIFIED: Loop through the *filtered* query ---
-    for je in query.all():
-        for line in je.entries():
-            if line.get('account_code') == code:
-                debit = float(line.get('debit', 0) or 0)
-                credit = float(line.get('credit', 0) or 0)
-                balance += debit - credit
-                rows.append({'date': je.created_at, 'desc': je.description, 'debit': debit, 'credit': credit, 'balance': balance})
-    
     # --- MODIFIED: Pass dates back to the template ---
-    return render_template('ledger.html', account=account, rows=rows, 
-                           balance=balance, start_date=start_date_str, end_date=end_date_str)
+    return render_template('ledger.html', account=account, rows=rows,
+                           balance=page['closing_balance'], next_cursor=page['next_cursor'],
+                           is_first_page=not cursor,
+                           start_date=start_date_str, end_date=end_date_str)
 
 
 @reports_bp.route('/balance-sheet')
@@ -120,49 +145,19 @@ def balance_sheet():
     default_end_date = datetime.utcnow().strftime('%Y-%m-%d')
     end_date_str = request.args.get('end_date', default_end_date)
     end_date = parse_date(end_date_str)
-    
-    # --- MODIFIED: Pass only the end_date to the aggregator ---
-    # This gets all transactions from the beginning of time *up to* this date
-    agg = aggregate_account_balances(start_date=None, end_date=end_date)
-    
-    assets, liabilities, equity = [], [], []
-    
-    for acc_code, bal in agg.items():
-        acct_rec = Account.query.filter_by(code=acc_code).first()
-        if not acct_rec:
-            continue 
-            
-        acc_name = acct_rec.name
-        acc_type = acct_rec.type
-
-        if acc_type == 'Asset':
-            assets.append((acc_name, bal))
-        elif acc_type == 'Liability':
-            liabilities.append((acc_name, -bal))
-        elif acc_type == 'Equity':
-            equity.append((acc_name, -bal))
-
-    # --- MODIFIED: Calculate Net Income *up to the end_date* ---
-    net_income = 0.0
-    # We re-call the aggregator just for Revenue/Expense accounts
-    is_agg = aggregate_account_balances(start_date=None, end_date=end_date)
-    revenues = {code: -bal for code, bal in is_agg.items() if Account.query.filter_by(code=code, type='Revenue').first()}
-    expenses = {code: bal for code, bal in is_agg.items() if Account.query.filter_by(code=code, type='Expense').first()}
-    
-    total_revenue = sum(revenues.values())
-    total_expense = sum(expenses.values())
-    net_income = total_revenue - total_expense
-    
-    equity.append(("Current Period Net Income", net_income))
 
-    total_assets = sum(b for a, b in assets)
-    total_liabilities = sum(b for a, b in liabilities)
-    total_equity = sum(b for a, b in equity)
+    grain = request.args.get('compare', '')
+    if grain:
+        return render_comparative(build_comparative_balance_sheet, 'reports.balance_sheet',
+                                  'reports.export_balance_sheet', grain,
+                                  parse_date(request.args.get('start_date', '')), end_date)
+    
+    sheet = build_balance_sheet(end_date)
     
     # --- MODIFIED: Pass the end_date back to the template ---
-    return render_template('balance_sheet.html', assets=assets, liabilities=liabilities, equity=equity,
-                           total_assets=total_assets, total_liabilities=total_liabilities, total_equity=total_equity,
-                           end_date=end_date_str)
+    return render_template('balance_sheet.html', assets=sheet.assets, liabilities=sheet.liabilities, equity=sheet.equity,
+                           total_assets=sheet.total_assets, total_liabilities=sheet.total_liabilities,
+                           total_equity=sheet.total_equity, end_date=end_date_str)
 
 
 @reports_bp.route('/income-statement')
@@ -176,73 +171,29 @@ def income_statement():
     start_date = parse_date(start_date_str)
     end_date = parse_date(end_date_str)
 
-    # Aggregate balances for the period
-    agg = aggregate_account_balances(start_date, end_date)
-    
-    revenues, expenses = {}, {}
-    cogs_amount = 0.0
+    grain = request.args.get('compare', '')
+    if grain:
+        return render_comparative(build_comparative_income_statement, 'reports.income_statement',
+                                  'reports.export_income_statement', grain,
+                                  start_date, end_date)
 
-    # Option A: use system COGS account code (preferred)
-    try:
-        cogs_code = get_system_account_code('COGS')
-    except Exception:
-        cogs_code = None
-
-    # Build revenues and expenses dictionaries and extract COGS
-    # agg: account_code -> balance (debit - credit)
-    for acc_code, bal in agg.items():
-        acct_rec = Account.query.filter_by(code=acc_code).first()
-        if not acct_rec:
-            continue
-
-        acc_name = acct_rec.name
-        acc_type = acct_rec.type
-
-        # Revenue accounts: we show as positive numbers (sales)
-        if acc_type == 'Revenue':
-            # agg stores debit - credit; revenue accounts are typically credit balances (negative in agg)
-            revenues[acc_name] = -bal
-        elif acc_type == 'Expense':
-            # expense normal is debit => positive in agg
-            # if this is the COGS account, record separately
-            if cogs_code and acc_code == cogs_code:
-                cogs_amount += float(bal or 0.0)
-            elif acc_name.lower() in ('cogs', 'cost of goods sold') and not cogs_code:
-                # fallback if get_system_account_code failed
-                cogs_amount += float(bal or 0.0)
-            else:
-                expenses[acc_name] = float(bal or 0.0)
-
-    # If COGS sits under multiple accounts (rare), you could sum them here — currently we picked single system account.
-    total_revenue = sum(revenues.values())
-    total_expense = sum(expenses.values())
-    # Net income considering COGS as part of expenses for presentation:
-    gross_profit = total_revenue - cogs_amount
-    net_income = gross_profit - total_expense
+    income = build_statements(start_date, end_date).income_statement
 
     return render_template('income_statement.html',
-                           revenues=revenues,
-                           expenses=expenses,
-                           cogs=cogs_amount,
-                           total_revenue=total_revenue,
-                           total_expense=total_expense,
-                           gross_profit=gross_profit,
-                           net_income=net_income,
+                           revenues=income.revenues,
+                           expenses=income.expenses,
+                           cogs=income.cogs,
+                           total_revenue=income.total_revenue,
+                           total_expense=income.total_expense,
+                           gross_profit=income.gross_profit,
+                           net_income=income.net_income,
                            start_date=start_date_str,
                            end_date=end_date_str)
 
 
-@reports_bp.route('/vat-report')
-@login_required
-@role_required('Admin', 'Accountant')
-def vat_report():
-    # --- Get dates from URL ---
-    start_date_str = request.args.get('start_date', '')
-    end_date_str = request.args.get('end_date', '')
-
-    start_date = parse_date(start_date_str)
-    end_date = parse_date(end_date_str)
-
+@cached_report('vat_summary')
+def vat_summary(start_date=None, end_date=None):
+    """Output/input VAT and non-VAT totals shown on the VAT report."""
     # --- OUTPUT VAT ---
     output_vat_query = db.session.query(
         func.sum(Sale.vat)
@@ -336,14 +287,36 @@ def vat_report():
     total_non_vat_sales_combined = total_non_vat_sales + total_non_vat_ar
     total_non_vat_purchases_combined = total_non_vat_purchases + total_non_vat_ap
 
+    return {
+        'total_output_vat': total_output_vat,
+        'total_input_vat': total_input_vat,
+        'vat_payable': vat_payable,
+        'total_nonvat_sales': total_non_vat_sales_combined,
+        'total_nonvat_purchases': total_non_vat_purchases_combined,
+    }
+
+
+@reports_bp.route('/vat-report')
+@login_required
+@role_required('Admin', 'Accountant')
+def vat_report():
+    # --- Get dates from URL ---
+    start_date_str = request.args.get('start_date', '')
+    end_date_str = request.args.get('end_date', '')
+
+    start_date = parse_date(start_date_str)
+    end_date = parse_date(end_date_str)
+
+    summary = vat_summary(start_date, end_date)
+
     # ✅ FIX: The variable names here now match vat_report.html
     return render_template(
         'vat_report.html',
-        total_output_vat=total_output_vat,
-        total_input_vat=total_input_vat,
-        vat_payable=vat_payable,
-        total_nonvat_sales=total_non_vat_sales_combined,  # <--- No underscore
-        total_nonvat_purchases=total_non_vat_purchases_combined, # <--- No underscore
+        total_output_vat=summary['total_output_vat'],
+        total_input_vat=summary['total_input_vat'],
+        vat_payable=summary['vat_payable'],
+        total_nonvat_sales=summary['total_nonvat_sales'],  # <--- No underscore
+        total_nonvat_purchases=summary['total_nonvat_purchases'], # <--- No underscore
         start_date=start_date_str,
         end_date=end_date_str
     )
@@ -511,17 +484,18 @@ def form_2307_report():
                            selected_customer_id=selected_customer_id,
                            month=month, payments=payments, customer=customer, company=company)
 
-@reports_bp.route('/ar-aging')
-@login_required
-@role_required('Admin', 'Accountant')
-def ar_aging():
-    """Generates an Accounts Receivable Aging report."""
-    today = date.today()
-    invoices = ARInvoice.query.filter(
-        (ARInvoice.total - ARInvoice.paid) > 0.01,
-        ARInvoice.voided_at.is_(None) # Explicitly exclude voided invoices
+@cached_report('aging')
+def aging_summary(kind, today):
+    """
+    Bucket open AR ('ar') or AP ('ap') invoices by days past their date.
+    Rows are plain dicts rather than invoices so the result can be cached.
+    """
+    model, party = (ARInvoice, 'customer') if kind == 'ar' else (APInvoice, 'supplier')
+    invoices = model.query.filter(
+        (model.total - model.paid) > 0.01,
+        model.voided_at.is_(None) # Explicitly exclude voided invoices
     ).all()
-    
+
     aging_data = {
         'current': [], '1-30': [], '31-60': [], '61-90': [], '91+': []
     }
@@ -534,21 +508,32 @@ def ar_aging():
         totals['total'] += balance
 
         if age <= 0:
-            aging_data['current'].append(inv)
-            totals['current'] += balance
+            bucket = 'current'
         elif 1 <= age <= 30:
-            aging_data['1-30'].append(inv)
-            totals['1-30'] += balance
+            bucket = '1-30'
         elif 31 <= age <= 60:
-            aging_data['31-60'].append(inv)
-            totals['31-60'] += balance
+            bucket = '31-60'
         elif 61 <= age <= 90:
-            aging_data['61-90'].append(inv)
-            totals['61-90'] += balance
+            bucket = '61-90'
         else:
-            aging_data['91+'].append(inv)
-            totals['91+'] += balance
-            
+            bucket = '91+'
+
+        party_rec = getattr(inv, party)
+        aging_data[bucket].append({
+            'id': inv.id, 'total': inv.total, 'paid': inv.paid, 'date': inv.date,
+            party: {'name': party_rec.name} if party_rec else None,
+        })
+        totals[bucket] += balance
+
+    return aging_data, totals
+
+
+@reports_bp.route('/ar-aging')
+@login_required
+@role_required('Admin', 'Accountant')
+def ar_aging():
+    """Generates an Accounts Receivable Aging report."""
+    aging_data, totals = aging_summary('ar', date.today())
     return render_template('ar_aging.html', aging_data=aging_data, totals=totals)
 
 @reports_bp.route('/ap-aging')
@@ -556,38 +541,7 @@ def ar_aging():
 @role_required('Admin', 'Accountant')
 def ap_aging():
     """Generates an Accounts Payable Aging report."""
-    today = date.today()
-    invoices = APInvoice.query.filter(
-        (APInvoice.total - APInvoice.paid) > 0.01,
-        APInvoice.voided_at.is_(None)
-    ).all()
-
-    aging_data = {
-        'current': [], '1-30': [], '31-60': [], '61-90': [], '91+': []
-    }
-    totals = { 'current': 0, '1-30': 0, '31-60': 0, '61-90': 0, '91+': 0, 'total': 0 }
-
-    for inv in invoices:
-        due_date = inv.date.date()
-        age = (today - due_date).days
-        balance = inv.total - inv.paid
-        totals['total'] += balance
-
-        if age <= 0:
-            aging_data['current'].append(inv)
-            totals['current'] += balance
-        elif 1 <= age <= 30:
-            aging_data['1-30'].append(inv)
-            totals['1-30'] += balance
-        elif 31 <= age <= 60:
-            aging_data['31-60'].append(inv)
-            totals['31-60'] += balance
-        elif 61 <= age <= 90:
-            aging_data['61-90'].append(inv)
-            totals['61-90'] += balance
-        else:
-            aging_data['91+'].append(inv)
-            totals['91+'] += balance
+    aging_data, totals = aging_summary('ap', date.today())
 
     return render_template('ap_aging.html', aging_data=aging_data, totals=totals)
 
@@ -785,6 +739,7 @@ def stock_card(product_id):
 @reports_bp.route('/export/balance-sheet')
 @login_required
 @role_required('Admin', 'Accountant')
+@cached_export('balance_sheet_csv')
 def export_balance_sheet():
     """Exports the balance sheet to CSV."""
     
@@ -795,42 +750,12 @@ def export_balance_sheet():
     end_date = parse_date(end_date_str)
     # --- END OF ADDED BLOCK ---
 
-    # --- MODIFIED: Pass the end_date to the aggregator ---
-    agg = aggregate_account_balances(start_date=None, end_date=end_date)
-    assets, liabilities, equity = [], [], []
+    grain = request.args.get('compare', '')
+    if grain:
+        return comparative_csv(build_comparative_balance_sheet, grain,
+                               parse_date(request.args.get('start_date', '')), end_date, 'balance_sheet')
 
-    # --- Re-run the balance_sheet logic ---
-    for acc_code, bal in agg.items():
-        acct_rec = Account.query.filter_by(code=acc_code).first()
-        if not acct_rec: continue
-        
-        acc_name = acct_rec.name
-        acc_type = acct_rec.type
-
-        if acc_type == 'Asset':
-            assets.append((acc_name, bal))
-        elif acc_type == 'Liability':
-            liabilities.append((acc_name, -bal))
-        elif acc_type == 'Equity':
-            equity.append((acc_name, -bal))
-
-    # --- MODIFIED: We must also filter the Net Income calculation ---
-    is_agg_net_income = aggregate_account_balances(start_date=None, end_date=end_date)
-    revenues = {code: -bal for code, bal in is_agg_net_income.items() if Account.query.filter_by(code=code, type='Revenue').first()}
-    expenses = {code: bal for code, bal in is_agg_net_income.items() if Account.query.filter_by(code=code, type='Expense').first()}
-    # --- END MODIFICATION ---
-
-    total_revenue = sum(revenues.values())
-    total_expense = sum(expenses.values())
-    net_income = total_revenue - total_expense
-    
-    equity.append(("Current Period Net Income", net_income))
-    
-    total_assets = sum(b for a, b in assets)
-    total_liabilities = sum(b for a, b in liabilities)
-    total_equity = sum(b for a, b in equity)
-    total_liabilities_and_equity = total_liabilities + total_equity
-    # --- End of logic ---
+    sheet = build_balance_sheet(end_date)
 
     output = io.StringIO()
     writer = csv.writer(output)
@@ -841,24 +766,24 @@ def export_balance_sheet():
     # --- END MODIFICATION ---
 
     writer.writerow(["ASSETS", "Amount"])
-    for name, balance in assets:
+    for name, balance in sheet.assets:
         writer.writerow([name, f"{balance:.2f}"])
-    writer.writerow(["TOTAL ASSETS", f"{total_assets:.2f}"])
+    writer.writerow(["TOTAL ASSETS", f"{sheet.total_assets:.2f}"])
     writer.writerow([])
     
     writer.writerow(["LIABILITIES", "Amount"])
-    for name, balance in liabilities:
+    for name, balance in sheet.liabilities:
         writer.writerow([name, f"{balance:.2f}"])
-    writer.writerow(["TOTAL LIABILITIES", f"{total_liabilities:.2f}"])
+    writer.writerow(["TOTAL LIABILITIES", f"{sheet.total_liabilities:.2f}"])
     writer.writerow([])
     
     writer.writerow(["EQUITY", "Amount"])
-    for name, balance in equity:
+    for name, balance in sheet.equity:
         writer.writerow([name, f"{balance:.2f}"])
-    writer.writerow(["TOTAL EQUITY", f"{total_equity:.2f}"])
+    writer.writerow(["TOTAL EQUITY", f"{sheet.total_equity:.2f}"])
     writer.writerow([])
     
-    writer.writerow(["TOTAL LIABILITIES & EQUITY", f"{total_liabilities_and_equity:.2f}"])
+    writer.writerow(["TOTAL LIABILITIES & EQUITY", f"{sheet.total_liabilities_and_equity:.2f}"])
 
     output.seek(0)
     # --- MODIFIED: Include date in filename ---
@@ -869,6 +794,7 @@ def export_balance_sheet():
 @reports_bp.route('/export/income-statement')
 @login_required
 @role_required('Admin', 'Accountant')
+@cached_export('income_statement_csv')
 def export_income_statement():
     """Exports the income statement to CSV."""
     start_date_str = request.args.get('start_date', '')
@@ -876,35 +802,11 @@ def export_income_statement():
     start_date = parse_date(start_date_str)
     end_date = parse_date(end_date_str)
 
-    agg = aggregate_account_balances(start_date, end_date)
+    grain = request.args.get('compare', '')
+    if grain:
+        return comparative_csv(build_comparative_income_statement, grain, start_date, end_date, 'income_statement')
 
-    revenues, expenses = {}, {}
-    cogs_amount = 0.0
-
-    try:
-        cogs_code = get_system_account_code('COGS')
-    except Exception:
-        cogs_code = None
-
-    for acc_code, bal in agg.items():
-        acct_rec = Account.query.filter_by(code=acc_code).first()
-        if not acct_rec:
-            continue
-
-        if acct_rec.type == 'Revenue':
-            revenues[acct_rec.name] = -bal
-        elif acct_rec.type == 'Expense':
-            if cogs_code and acc_code == cogs_code:
-                cogs_amount += float(bal or 0.0)
-            elif acct_rec.name.lower() in ('cogs', 'cost of goods sold') and not cogs_code:
-                cogs_amount += float(bal or 0.0)
-            else:
-                expenses[acct_rec.name] = float(bal or 0.0)
-
-    total_revenue = sum(revenues.values())
-    total_expense = sum(expenses.values())
-    gross_profit = total_revenue - cogs_amount
-    net_income = gross_profit - total_expense
+    income = build_statements(start_date, end_date).income_statement
 
     output = io.StringIO()
     writer = csv.writer(output)
@@ -918,23 +820,23 @@ def export_income_statement():
     writer.writerow([])
 
     writer.writerow(["REVENUES", "Amount"])
-    for name, balance in revenues.items():
+    for name, balance in income.revenues.items():
         writer.writerow([name, f"{balance:.2f}"])
-    writer.writerow(["Total Revenue", f"{total_revenue:.2f}"])
+    writer.writerow(["Total Revenue", f"{income.total_revenue:.2f}"])
     writer.writerow([])
 
     # Insert COGS as single line item right after revenues (Xero style)
-    writer.writerow(["Cost of Goods Sold (COGS)", f"({cogs_amount:.2f})"])
-    writer.writerow(["Gross Profit", f"{gross_profit:.2f}"])
+    writer.writerow(["Cost of Goods Sold (COGS)", f"({income.cogs:.2f})"])
+    writer.writerow(["Gross Profit", f"{income.gross_profit:.2f}"])
     writer.writerow([])
 
     writer.writerow(["EXPENSES", "Amount"])
-    for name, balance in expenses.items():
+    for name, balance in income.expenses.items():
         writer.writerow([name, f"({balance:.2f})"])
-    writer.writerow(["Total Expenses", f"({total_expense:.2f})"])
+    writer.writerow(["Total Expenses", f"({income.total_expense:.2f})"])
     writer.writerow([])
 
-    writer.writerow(["NET INCOME", f"{net_income:.2f}"])
+    writer.writerow(["NET INCOME", f"{income.net_income:.2f}"])
 
     output.seek(0)
     filename = f"income_statement_{datetime.now().strftime('%Y%m%d')}.csv"
@@ -946,6 +848,7 @@ def export_income_statement():
 @reports_bp.route('/export/vat-report')
 @login_required
 @role_required('Admin', 'Accountant')
+@cached_export('vat_report_csv')
 def export_vat_report():
     start_date = parse_date(request.args.get("start_date"))
     end_date = parse_date(request.args.get("end_date"))
@@ -1005,6 +908,7 @@ def export_vat_report():
 @reports_bp.route('/export/trial-balance')
 @login_required
 @role_required('Admin', 'Accountant')
+@cached_export('trial_balance_csv')
 def export_trial_balance():
     """Exports the trial balance to CSV."""
     
@@ -1015,25 +919,7 @@ def export_trial_balance():
     end_date = parse_date(end_date_str)
     # --- END OF ADDED BLOCK ---
 
-    # --- MODIFIED: Pass dates to the aggregator ---
-    agg = aggregate_account_balances(start_date, end_date)
-    
-    # --- Re-run the trial_balance logic ---
-    tb = []
-    total_debit = 0.0
-    total_credit = 0.0
-    for acc_code, val in agg.items():
-        acc_details = Account.query.filter_by(code=acc_code).first()
-        acc_name = acc_details.name if acc_details else f"Unknown ({acc_code})"
-        
-        if val >= 0:
-            tb.append({'code': acc_code, 'name': acc_name, 'debit': val, 'credit': 0.0})
-            total_debit += val
-        else:
-            tb.append({'code': acc_code, 'name': acc_name, 'debit': 0.0, 'credit': -val})
-            total_credit += -val
-    tb.sort(key=lambda x: x['code'])
-    # --- End of logic ---
+    statements = build_statements(start_date, end_date)
     
     output = io.StringIO()
     writer = csv.writer(output)
@@ -1048,45 +934,25 @@ def export_trial_balance():
     # --- END MODIFICATION ---
     
     writer.writerow(["Code", "Account Name", "Debit", "Credit"])
-    for row in tb:
-        writer.writerow([row['code'], row['name'], f"{row['debit']:.2f}", f"{row['credit']:.2f}"])
+    for row in statements.trial_balance:
+        writer.writerow([row.code, row.name, f"{row.debit:.2f}", f"{row.credit:.2f}"])
     writer.writerow([])
-    writer.writerow(["Totals", "", f"{total_debit:.2f}", f"{total_credit:.2f}"])
+    writer.writerow(["Totals", "", f"{statements.total_debit:.2f}", f"{statements.total_credit:.2f}"])
 
     output.seek(0)
     filename = f"trial_balance_{datetime.now().strftime('%Y%m%d')}.csv"
     return Response(output.getvalue(), mimetype="text/csv", headers={"Content-Disposition": f"attachment; filename={filename}"})
 
 
-    # --- MODIFIED: The core function now accepts dates ---
-def aggregate_account_balances(start_date=None, end_date=None):
-    """
-    Return dict: account_code -> balance (debit - credit) for a given date range.
-    """
-    agg = defaultdict(float)
-    
-    # --- MODIFIED: Create a base query ---
-    query = JournalEntry.query
-
-    # --- MODIFIED: Apply date filters if they exist ---
-    if start_date:
-        query = query.filter(JournalEntry.created_at >= start_date)
-    if end_date:
-        # Add one day to the end_date to make the filter inclusive
-        end_date_inclusive = end_date + timedelta(days=1)
-        query = query.filter(JournalEntry.created_at < end_date_inclusive)
-
-    # --- MODIFIED: Execute the filtered query ---
-    for je in query.all():
-        for line in je.entries():
-            acc_code = line.get('account_code') 
-            if not acc_code:
-                continue 
-                
-            debit = float(line.get('debit', 0) or 0)
-            credit = float(line.get('credit', 0) or 0)
-            agg[acc_code] += debit - credit
-    return dict(agg)
+@reports_bp.route('/cache-stats')
+@login_required
+@role_required('Admin')
+def report_cache_stats():
+    """Hit/miss counters of the report result cache."""
+    cache = get_report_cache()
+    if cache is None:
+        return jsonify({'enabled': False})
+    return jsonify(dict(cache.stats(), enabled=True))
 
 
 @reports_bp.route('/general-ledger')
@@ -1101,44 +967,10 @@ def general_ledger():
     end_date = parse_date(end_date_str)
     
     # Get aggregated balances
-    agg = aggregate_account_balances(start_date, end_date)
-    
-    gl_data = []
-    
-    # ✅ FIXED LOGIC
-    for acc_code, balance in agg.items():
-        acc_details = Account.query.filter_by(code=acc_code).first()
-        if not acc_details:
-            continue
-
-        # Determine account normal balance
-        is_debit_normal = acc_details.type in ['Asset', 'Expense']
-        
-        if is_debit_normal:
-            # Asset/Expense accounts: Normal balance is DEBIT
-            # Positive balance = Debit, Negative balance = Credit
-            final_debit = balance if balance >= 0 else 0.0
-            final_credit = abs(balance) if balance < 0 else 0.0
-            balance_type = 'Debit' if balance >= 0 else 'Credit'
-        else:
-            # Liability/Equity/Revenue accounts: Normal balance is CREDIT
-            # Negative balance = Credit, Positive balance = Debit (unusual)
-            final_debit = balance if balance > 0 else 0.0
-            final_credit = abs(balance) if balance < 0 else 0.0  # ✅ FIXED
-            balance_type = 'Credit' if balance < 0 else 'Debit'
-
-        gl_data.append({
-            'account': f"{acc_code} - {acc_details.name}",
-            'debit': final_debit, 
-            'credit': final_credit,
-            'balance': abs(balance),
-            'balance_type': balance_type
-        })
-        
-    gl_data.sort(key=lambda x: x['account'])
+    statements = build_statements(start_date, end_date)
     
     return render_template('general_ledger.html', 
-                           gl_data=gl_data,
+                           gl_data=statements.general_ledger,
                            start_date=start_date_str, 
                            end_date=end_date_str)
 
@@ -1146,6 +978,7 @@ def general_ledger():
 @reports_bp.route('/export/general-ledger')
 @login_required
 @role_required('Admin', 'Accountant')
+@cached_export('general_ledger_csv')
 def export_general_ledger():
     """Exports the General Ledger Summary to CSV."""
     
@@ -1154,36 +987,7 @@ def export_general_ledger():
     start_date = parse_date(start_date_str)
     end_date = parse_date(end_date_str)
 
-    agg = aggregate_account_balances(start_date, end_date)
-    
-    gl_data = []
-    
-    # ✅ SAME FIXED LOGIC AS ABOVE
-    for acc_code, balance in agg.items():
-        acc_details = Account.query.filter_by(code=acc_code).first()
-        if not acc_details:
-            continue
-
-        is_debit_normal = acc_details.type in ['Asset', 'Expense']
-        
-        if is_debit_normal:
-            final_debit = balance if balance >= 0 else 0.0
-            final_credit = abs(balance) if balance < 0 else 0.0 
-            balance_type = 'Debit' if balance >= 0 else 'Credit'
-        else:
-            final_debit = balance if balance > 0 else 0.0
-            final_credit = abs(balance) if balance < 0 else 0.0  # ✅ FIXED
-            balance_type = 'Credit' if balance < 0 else 'Debit'
-
-        gl_data.append({
-            'account': f"{acc_code} - {acc_details.name}",
-            'debit': final_debit, 
-            'credit': final_credit,
-            'balance': abs(balance),
-            'balance_type': balance_type
-        })
-        
-    gl_data.sort(key=lambda x: x['account'])
+    statements = build_statements(start_date, end_date)
 
     output = io.StringIO()
     writer = csv.writer(output)
@@ -1200,15 +1004,15 @@ def export_general_ledger():
     total_debits = 0.0
     total_credits = 0.0
     
-    for row in gl_data:
-        total_debits += row['debit']
-        total_credits += row['credit']
+    for row in statements.general_ledger:
+        total_debits += row.debit
+        total_credits += row.credit
         writer.writerow([
-            row['account'], 
-            f"{row['debit']:.2f}", 
-            f"{row['credit']:.2f}", 
-            f"{row['balance']:.2f}", 
-            row['balance_type']
+            row.account, 
+            f"{row.debit:.2f}", 
+            f"{row.credit:.2f}", 
+            f"{row.balance:.2f}", 
+            row.balance_type
         ])
     
     writer.writerow([])
@@ -0,0 +1,287 @@
+"""
+Document Number Sequence Utilities
+"""
+import atexit
+import heapq
+import os
+import socket
+import threading
+import uuid
+from datetime import datetime, timedelta
+
+from flask import current_app
+from sqlalchemy import delete, event, exc, insert, select, update
+from sqlalchemy.orm import Session
+
+from models import db, CompanyProfile, DocumentSequence, DocumentNumberLease
+
+
+# Settings for a series the first time it is used; the DocumentSequence row is authoritative after that
+SERIES_DEFAULTS = {
+    'invoice': {'block_size': 20, 'gap_free': True},
+    'consignment': {'block_size': 20, 'gap_free': False},
+}
+
+# A gap-free lease older than this is treated as orphaned by a crashed worker and may be reclaimed
+LEASE_TIMEOUT = timedelta(hours=12)
+
+
+class _SeriesAllocator:
+    """
+    Hands out one series' numbers from blocks reserved in a short transaction of
+    their own, so the DocumentSequence row is touched once per block instead of
+    being held by every sale transaction.
+    """
+
+    def __init__(self, engine, name, worker):
+        self.engine = engine
+        self.name = name
+        self.worker = worker
+        self.lock = threading.Lock()
+        self.sequence_id = None
+        self.gap_free = False
+        self.block_size = 1
+        self.available = []  # heap of (number, leased_at)
+        self.conn = None
+
+    def take(self):
+        with self.lock:
+            self._drop_expired()
+            if not self.available:
+                self._reserve()
+            return heapq.heappop(self.available)[0]
+
+    def ensure(self, count):
+        with self.lock:
+            self._drop_expired()
+            if len(self.available) < count:
+                self._reserve(count - len(self.available))
+
+    def _drop_expired(self):
+        # Leases that other workers may already be reclaiming; they come back via _reserve
+        now = datetime.utcnow()
+        while self.available and now - self.available[0][1] > LEASE_TIMEOUT:
+            heapq.heappop(self.available)
+
+    def give_back(self, number):
+        """Return a leased number whose transaction rolled back; it is handed out next."""
+        with self.lock:
+            heapq.heappush(self.available, (number, datetime.utcnow()))
+
+    def _connection(self):
+        # Kept for the allocator's lifetime: a reservation must never wait for a pooled
+        # connection while request threads holding the rest of the pool wait on self.lock
+        if self.conn is None or self.conn.closed or self.conn.invalidated:
+            self.conn = self.engine.connect()
+        return self.conn
+
+    def _reserve(self, count=0):
+        try:
+            self._reserve_block(count)
+        except exc.IntegrityError:
+            # Another worker created the series row at the same moment; reserve from its row
+            self._reserve_block(count)
+
+    def _reserve_block(self, count):
+        conn = self._connection()
+        with conn.begin():
+            sequence = self._load(conn)
+            now = datetime.utcnow()
+            numbers = []
+            if self.gap_free:
+                numbers = conn.execute(
+                    update(DocumentNumberLease)
+                    .where(DocumentNumberLease.sequence_id == self.sequence_id,
+                           DocumentNumberLease.leased_at < now - LEASE_TIMEOUT)
+                    .values(worker=self.worker, leased_at=now)
+                    .returning(DocumentNumberLease.number)
+                ).scalars().all()
+
+            needed = max(max(self.block_size, count) - len(numbers), 0)
+            if needed:
+                high = conn.execute(
+                    update(DocumentSequence)
+                    .where(DocumentSequence.id == sequence.id)
+                    .values(next_value=DocumentSequence.next_value + needed, updated_at=now)
+                    .returning(DocumentSequence.next_value)
+                ).scalar_one()
+                block = list(range(high - needed, high))
+                if self.gap_free:
+                    conn.execute(insert(DocumentNumberLease), [
+                        {'sequence_id': self.sequence_id, 'number': number,
+                         'worker': self.worker, 'leased_at': now}
+                        for number in block
+                    ])
+                numbers.extend(block)
+
+        for number in numbers:
+            heapq.heappush(self.available, (number, now))
+
+    def _load(self, conn):
+        query = select(DocumentSequence.id, DocumentSequence.block_size, DocumentSequence.gap_free) \
+            .where(DocumentSequence.name == self.name)
+        sequence = conn.execute(query).first()
+        if sequence is None:
+            _create_sequence(conn, self.name)
+            sequence = conn.execute(query).one()
+        self.sequence_id = sequence.id
+        self.gap_free = bool(sequence.gap_free)
+        self.block_size = max(int(sequence.block_size or 1), 1)
+        return sequence
+
+    def release(self):
+        """Make this worker's unused gap-free leases reclaimable right away (on shutdown)."""
+        if not self.gap_free:
+            return
+        conn = self._connection()
+        with conn.begin():
+            conn.execute(
+                update(DocumentNumberLease)
+                .where(DocumentNumberLease.worker == self.worker)
+                .values(leased_at=datetime(1970, 1, 1))
+            )
+        self.available = []
+
+
+def _legacy_start(conn, name):
+    """First number of a new series, continuing the old CompanyProfile counters."""
+    profile = conn.execute(select(
+        CompanyProfile.next_invoice_number, CompanyProfile.next_or_number,
+        CompanyProfile.next_si_number, CompanyProfile.next_consignment_number
+    )).first()
+    if profile is None:
+        return 1
+    if name == 'invoice':
+        return profile.next_invoice_number or max(profile.next_or_number or 1, profile.next_si_number or 1)
+    if name == 'consignment':
+        return profile.next_consignment_number or 1
+    return 1
+
+
+def _create_sequence(conn, name):
+    defaults = SERIES_DEFAULTS.get(name, {})
+    conn.execute(insert(DocumentSequence).values(
+        name=name,
+        next_value=_legacy_start(conn, name),
+        block_size=defaults.get('block_size', 20),
+        gap_free=defaults.get('gap_free', False),
+        updated_at=datetime.utcnow(),
+    ))
+
+
+def _allocators():
+    state = current_app.extensions.get('document_sequences')
+    if state is None:
+        state = {
+            'lock': threading.Lock(),
+            'worker': f"{socket.gethostname()}:{os.getpid()}:{uuid.uuid4().hex[:8]}",
+            'series': {},
+        }
+        current_app.extensions['document_sequences'] = state
+        atexit.register(_release_all, state)
+    return state
+
+
+def _release_all(state):
+    for allocator in state['series'].values():
+        try:
+            allocator.release()
+        except Exception:
+            pass  # Interpreter shutdown; the leases time out instead
+
+
+def _allocator(name):
+    state = _allocators()
+    with state['lock']:
+        allocator = state['series'].get(name)
+        if allocator is None:
+            allocator = _SeriesAllocator(db.engine, name, state['worker'])
+            state['series'][name] = allocator
+    return allocator
+
+
+def reserve_document_numbers(name, count):
+    """
+    Make sure this worker already holds at least `count` numbers of the series.
+    Batch callers reserve up front, before their transaction starts writing, so
+    next_document_number never needs a new block in the middle of the batch.
+    """
+    _allocator(name).ensure(count)
+
+
+def next_document_number(name):
+    """
+    Next number of the `name` series ('invoice', 'consignment', ...).
+
+    Numbers come from a block this worker has already reserved, so concurrent
+    terminals don't queue on one counter row. Normal series may skip numbers
+    when a transaction rolls back or a worker restarts. Gap-free series delete the
+    number's lease row in the caller's transaction: if it rolls back, the number
+    goes back to this worker and is issued next, so every number ends up on a
+    committed document. Each worker issues its own block in order; numbers from
+    different terminals interleave.
+
+    Take the number before the request writes anything else: a new block is
+    reserved on a separate connection, which SQLite cannot open while this
+    session holds the write lock.
+    """
+    allocator = _allocator(name)
+    while True:
+        number = allocator.take()
+        if not allocator.gap_free:
+            return number
+        claimed = db.session.execute(
+            delete(DocumentNumberLease).where(
+                DocumentNumberLease.sequence_id == allocator.sequence_id,
+                DocumentNumberLease.number == number,
+                DocumentNumberLease.worker == allocator.worker,
+            )
+        ).rowcount
+        if claimed:
+            session = db.session()
+            session.info.setdefault('document_numbers', []).append(
+                (_current_transaction(session), allocator, number)
+            )
+            return number
+        # The lease timed out and another worker reclaimed it; try the next one
+
+
+def _current_transaction(session):
+    return session.get_nested_transaction() or session.get_transaction()
+
+
+def _taken_within(taken_in, transaction):
+    while taken_in is not None and taken_in is not transaction:
+        taken_in = taken_in.parent
+    return taken_in is transaction
+
+
+@event.listens_for(Session, 'after_commit')
+def _document_numbers_committed(session):
+    session.info['document_numbers_committed'] = _current_transaction(session)
+
+
+@event.listens_for(Session, 'after_transaction_end')
+def _document_numbers_released(session, transaction):
+    """
+    Gap-free numbers taken inside a transaction or savepoint that ends without
+    committing go back to their worker. Numbers in a released savepoint stay with
+    the enclosing transaction.
+    """
+    if not (transaction.nested or transaction.parent is None):
+        return
+    committed = session.info.pop('document_numbers_committed', None) is transaction
+    taken = session.info.get('document_numbers')
+    if not taken:
+        return
+    if committed:
+        if transaction.parent is None:
+            session.info.pop('document_numbers')
+        return
+    kept = []
+    for taken_in, allocator, number in taken:
+        if _taken_within(taken_in, transaction):
+            allocator.give_back(number)
+        else:
+            kept.append((taken_in, allocator, number))
+    session.info['document_numbers'] = kept
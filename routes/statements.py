@@ -0,0 +1,404 @@
+"""
+Financial Statement Engine
+"""
+from collections import defaultdict
+from dataclasses import dataclass, field
+from datetime import datetime, timedelta
+
+from flask import current_app
+
+from models import Account, AccountingPeriod
+from routes.ledger_utils import sum_journal_lines, sum_journal_lines_by_month
+from routes.period_utils import balances_as_of, get_latest_closed_period
+from routes.report_cache import cached_report
+from routes.utils import get_system_account_code
+
+
+@cached_report('account_balances')
+def aggregate_account_balances(start_date=None, end_date=None):
+    """
+    Return dict: account_code -> balance (debit - credit) for a given date range.
+    Runs as a single GROUP BY over the indexed JournalLine table. As-of queries
+    (no start_date) roll forward from the latest closed period's balances.
+    With LEDGER_CUBE_ENABLED the in-memory ledger cube answers instead.
+    """
+    # Add one day to the end_date to make the filter inclusive
+    end_date_inclusive = end_date + timedelta(days=1) if end_date else None
+
+    if current_app.config.get('LEDGER_CUBE_ENABLED'):
+        # Imported here so NumPy is only needed where the cube is switched on
+        from routes.ledger_cube import get_ledger_cube
+        return get_ledger_cube().balances(start_date, end_date_inclusive)
+
+    if not start_date:
+        balances, _ = balances_as_of(end_date_inclusive)
+        return balances
+    return sum_journal_lines(start=start_date, end=end_date_inclusive)
+
+
+@dataclass
+class TrialBalanceRow:
+    code: str
+    name: str
+    debit: float
+    credit: float
+
+
+@dataclass
+class GeneralLedgerRow:
+    account: str
+    debit: float
+    credit: float
+    balance: float
+    balance_type: str
+
+
+@dataclass
+class IncomeStatement:
+    revenues: dict = field(default_factory=dict)   # account name -> amount
+    expenses: dict = field(default_factory=dict)   # account name -> amount (excluding COGS)
+    cogs: float = 0.0
+
+    @property
+    def total_revenue(self):
+        return sum(self.revenues.values())
+
+    @property
+    def total_expense(self):
+        return sum(self.expenses.values())
+
+    @property
+    def gross_profit(self):
+        return self.total_revenue - self.cogs
+
+    @property
+    def net_income(self):
+        return self.gross_profit - self.total_expense
+
+
+@dataclass
+class BalanceSheet:
+    assets: list = field(default_factory=list)        # (name, amount)
+    liabilities: list = field(default_factory=list)   # (name, amount)
+    equity: list = field(default_factory=list)        # (name, amount)
+
+    @property
+    def total_assets(self):
+        return sum(b for a, b in self.assets)
+
+    @property
+    def total_liabilities(self):
+        return sum(b for a, b in self.liabilities)
+
+    @property
+    def total_equity(self):
+        return sum(b for a, b in self.equity)
+
+    @property
+    def total_liabilities_and_equity(self):
+        return self.total_liabilities + self.total_equity
+
+
+@dataclass
+class FinancialStatements:
+    """Trial balance, general ledger summary and income statement for one date range."""
+    trial_balance: list = field(default_factory=list)    # TrialBalanceRow, by code
+    general_ledger: list = field(default_factory=list)   # GeneralLedgerRow, by account label
+    income_statement: IncomeStatement = field(default_factory=IncomeStatement)
+
+    @property
+    def total_debit(self):
+        return sum(r.debit for r in self.trial_balance)
+
+    @property
+    def total_credit(self):
+        return sum(r.credit for r in self.trial_balance)
+
+
+def _cogs_code():
+    try:
+        return get_system_account_code('COGS')
+    except Exception:
+        return None
+
+
+def _add_to_income_statement(income, acct_rec, bal, cogs_code):
+    """Income statement: revenue as positive, COGS on its own line."""
+    if acct_rec.type == 'Revenue':
+        income.revenues[acct_rec.name] = -bal
+    elif acct_rec.type == 'Expense':
+        if cogs_code and acct_rec.code == cogs_code:
+            income.cogs += float(bal or 0.0)
+        elif acct_rec.name.lower() in ('cogs', 'cost of goods sold') and not cogs_code:
+            # fallback if get_system_account_code failed
+            income.cogs += float(bal or 0.0)
+        else:
+            income.expenses[acct_rec.name] = float(bal or 0.0)
+
+
+def _balance_sheet(agg, accounts, closed_period=None):
+    """Lay out as-of balances as a BalanceSheet; closed_period supplies Retained Earnings."""
+    sheet = BalanceSheet()
+    net_income = 0.0
+    for acc_code, bal in agg.items():
+        acct_rec = accounts.get(acc_code)
+        if not acct_rec:
+            continue
+
+        if acct_rec.type == 'Asset':
+            sheet.assets.append((acct_rec.name, bal))
+        elif acct_rec.type == 'Liability':
+            sheet.liabilities.append((acct_rec.name, -bal))
+        elif acct_rec.type == 'Equity':
+            sheet.equity.append((acct_rec.name, -bal))
+        elif acct_rec.type in ('Revenue', 'Expense'):
+            net_income -= bal
+
+    if closed_period:
+        sheet.equity.append(("Retained Earnings", closed_period.retained_earnings))
+        net_income -= closed_period.retained_earnings
+    sheet.equity.append(("Current Period Net Income", net_income))
+    return sheet
+
+
+@cached_report('statements')
+def build_statements(start_date=None, end_date=None):
+    """
+    Build every range statement from one aggregation and one chart-of-accounts fetch.
+    The result is cached and shared, so treat it as read-only.
+    """
+    agg = aggregate_account_balances(start_date, end_date)
+    accounts = {acc.code: acc for acc in Account.query.all()}
+    cogs_code = _cogs_code()
+
+    result = FinancialStatements()
+    income = result.income_statement
+
+    for acc_code, bal in agg.items():
+        acct_rec = accounts.get(acc_code)
+
+        # --- Trial balance: every account with activity, unknown codes included ---
+        acc_name = acct_rec.name if acct_rec else f"Unknown ({acc_code})"
+        if bal >= 0:
+            result.trial_balance.append(TrialBalanceRow(acc_code, acc_name, bal, 0.0))
+        else:
+            result.trial_balance.append(TrialBalanceRow(acc_code, acc_name, 0.0, -bal))
+
+        if not acct_rec:
+            continue
+
+        # --- General ledger summary: split by the account's normal balance ---
+        if acct_rec.type in ['Asset', 'Expense']:
+            # Asset/Expense accounts: Normal balance is DEBIT
+            final_debit = bal if bal >= 0 else 0.0
+            balance_type = 'Debit' if bal >= 0 else 'Credit'
+        else:
+            # Liability/Equity/Revenue accounts: Normal balance is CREDIT
+            final_debit = bal if bal > 0 else 0.0
+            balance_type = 'Credit' if bal < 0 else 'Debit'
+        final_credit = abs(bal) if bal < 0 else 0.0
+        result.general_ledger.append(GeneralLedgerRow(
+            f"{acc_code} - {acct_rec.name}", final_debit, final_credit, abs(bal), balance_type
+        ))
+
+        _add_to_income_statement(income, acct_rec, bal, cogs_code)
+
+    result.trial_balance.sort(key=lambda r: r.code)
+    result.general_ledger.sort(key=lambda r: r.account)
+    return result
+
+
+@cached_report('balance_sheet')
+def build_balance_sheet(end_date=None):
+    """
+    Balance sheet as of end_date from one as-of aggregation and one chart-of-accounts
+    fetch. Net income of closed periods is shown as Retained Earnings.
+    """
+    agg = aggregate_account_balances(start_date=None, end_date=end_date)
+    accounts = {acc.code: acc for acc in Account.query.all()}
+    period = get_latest_closed_period(before=end_date + timedelta(days=1) if end_date else None)
+    return _balance_sheet(agg, accounts, period)
+
+
+# --- Comparative (multi-period) statements ---
+
+COMPARATIVE_GRAINS = ('month', 'quarter', 'year')
+MAX_COMPARATIVE_PERIODS = 60
+
+
+@dataclass
+class ReportPeriod:
+    label: str
+    start: datetime   # inclusive
+    end: datetime     # exclusive
+
+
+@dataclass
+class StatementLine:
+    name: str
+    values: list                 # one amount per period
+    negative: bool = False       # shown in parentheses (costs and expenses)
+
+
+@dataclass
+class StatementSection:
+    title: str = ''
+    lines: list = field(default_factory=list)   # StatementLine
+    total: StatementLine = None
+
+
+@dataclass
+class ComparativeStatement:
+    """A statement with one column per period, rendered by both the HTML and CSV routes."""
+    title: str
+    grain: str
+    periods: list                                  # ReportPeriod
+    sections: list = field(default_factory=list)   # StatementSection
+    columns: list = field(default_factory=list)    # IncomeStatement or BalanceSheet per period
+
+    @property
+    def labels(self):
+        return [p.label for p in self.periods]
+
+
+def _next_period_start(dt, grain):
+    if grain == 'month':
+        return datetime(dt.year + (dt.month == 12), dt.month % 12 + 1, 1)
+    if grain == 'quarter':
+        first_month = (dt.month - 1) // 3 * 3 + 1
+        return datetime(dt.year + (first_month == 10), (first_month + 2) % 12 + 1, 1)
+    return datetime(dt.year + 1, 1, 1)
+
+
+def _period_label(dt, grain):
+    if grain == 'month':
+        return dt.strftime('%b %Y')
+    if grain == 'quarter':
+        return f"Q{(dt.month - 1) // 3 + 1} {dt.year}"
+    return str(dt.year)
+
+
+def comparative_periods(start_date, end_date, grain):
+    """
+    Split [start_date, end_date] (inclusive dates) into calendar months, quarters
+    or years. The first and last periods are clipped to the range.
+
+    Raises:
+        ValueError: For an unknown grain, an empty range or too many periods
+    """
+    if grain not in COMPARATIVE_GRAINS:
+        raise ValueError(f"Unknown period grain: {grain}")
+    end_exclusive = end_date + timedelta(days=1)
+    if start_date >= end_exclusive:
+        raise ValueError("Start date must be on or before end date.")
+
+    periods = []
+    cursor = start_date
+    while cursor < end_exclusive:
+        next_start = _next_period_start(cursor, grain)
+        periods.append(ReportPeriod(_period_label(cursor, grain), cursor, min(next_start, end_exclusive)))
+        if len(periods) > MAX_COMPARATIVE_PERIODS:
+            raise ValueError(f"Comparative reports are limited to {MAX_COMPARATIVE_PERIODS} periods.")
+        cursor = next_start
+    return periods
+
+
+def _movements_by_period(periods):
+    """
+    One GROUP BY (account, year, month) over the whole range, bucketed into periods.
+
+    Returns:
+        list: dict account_code -> net movement, one per period
+    """
+    month_index = {}
+    for i, period in enumerate(periods):
+        cursor = datetime(period.start.year, period.start.month, 1)
+        while cursor < period.end:
+            month_index[(cursor.year, cursor.month)] = i
+            cursor = _next_period_start(cursor, 'month')
+
+    buckets = [defaultdict(float) for _ in periods]
+    for acc_code, year, month, total in sum_journal_lines_by_month(periods[0].start, periods[-1].end):
+        buckets[month_index[(year, month)]][acc_code] += total
+    return buckets
+
+
+def _union_names(mappings):
+    """Names across several ordered mappings or (name, amount) lists, in first-seen order."""
+    names = {}
+    for mapping in mappings:
+        for name in (mapping.keys() if isinstance(mapping, dict) else (n for n, _ in mapping)):
+            names.setdefault(name, None)
+    return list(names)
+
+
+@cached_report('comparative_income_statement')
+def build_comparative_income_statement(start_date, end_date, grain):
+    """Income statement with one column per month/quarter/year from a single scan."""
+    periods = comparative_periods(start_date, end_date, grain)
+    accounts = {acc.code: acc for acc in Account.query.all()}
+    cogs_code = _cogs_code()
+
+    columns = []
+    for movements in _movements_by_period(periods):
+        income = IncomeStatement()
+        for acc_code, bal in movements.items():
+            acct_rec = accounts.get(acc_code)
+            if acct_rec:
+                _add_to_income_statement(income, acct_rec, bal, cogs_code)
+        columns.append(income)
+
+    revenue_names = _union_names(c.revenues for c in columns)
+    expense_names = _union_names(c.expenses for c in columns)
+    report = ComparativeStatement('Income Statement', grain, periods, columns=columns)
+    report.sections = [
+        StatementSection('REVENUES',
+                         [StatementLine(n, [c.revenues.get(n, 0.0) for c in columns]) for n in revenue_names],
+                         StatementLine('Total Revenue', [c.total_revenue for c in columns])),
+        StatementSection('', [StatementLine('Cost of Goods Sold (COGS)', [c.cogs for c in columns], negative=True)],
+                         StatementLine('Gross Profit', [c.gross_profit for c in columns])),
+        StatementSection('EXPENSES',
+                         [StatementLine(n, [c.expenses.get(n, 0.0) for c in columns], negative=True) for n in expense_names],
+                         StatementLine('Total Expenses', [c.total_expense for c in columns], negative=True)),
+        StatementSection('', [], StatementLine('NET INCOME', [c.net_income for c in columns])),
+    ]
+    return report
+
+
+@cached_report('comparative_balance_sheet')
+def build_comparative_balance_sheet(start_date, end_date, grain):
+    """
+    Balance sheet as of the end of each month/quarter/year: one as-of aggregation
+    for the opening position plus a single scan of the range, accumulated per period.
+    """
+    periods = comparative_periods(start_date, end_date, grain)
+    accounts = {acc.code: acc for acc in Account.query.all()}
+    closed_periods = AccountingPeriod.query.order_by(AccountingPeriod.end_date).all()
+
+    running = dict(aggregate_account_balances(start_date=None, end_date=start_date - timedelta(days=1)))
+    columns = []
+    for period, movements in zip(periods, _movements_by_period(periods)):
+        for acc_code, movement in movements.items():
+            running[acc_code] = running.get(acc_code, 0.0) + movement
+        closed = None
+        for closed_period in closed_periods:
+            if closed_period.end_date <= period.end:
+                closed = closed_period
+        columns.append(_balance_sheet(running, accounts, closed))
+
+    def section(title, attr, total_label, total_attr):
+        names = _union_names(getattr(c, attr) for c in columns)
+        lines = []
+        for name in names:
+            lines.append(StatementLine(name, [dict(getattr(c, attr)).get(name, 0.0) for c in columns]))
+        return StatementSection(title, lines, StatementLine(total_label, [getattr(c, total_attr) for c in columns]))
+
+    report = ComparativeStatement('Balance Sheet', grain, periods, columns=columns)
+    report.sections = [
+        section('ASSETS', 'assets', 'TOTAL ASSETS', 'total_assets'),
+        section('LIABILITIES', 'liabilities', 'TOTAL LIABILITIES', 'total_liabilities'),
+        section('EQUITY', 'equity', 'TOTAL EQUITY', 'total_equity'),
+        StatementSection('', [], StatementLine('TOTAL LIABILITIES & EQUITY',
+                                               [c.total_liabilities_and_equity for c in columns])),
+    ]
+    return report
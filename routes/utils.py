@@ -1,7 +1,6 @@
-from flask import request, abort
+from flask import request, abort, current_app, has_request_context
 from flask_login import current_user
 from models import db, AuditLog, Account
-from functools import lru_cache
 
 
 def paginate_query(query, per_page=20):
@@ -13,31 +12,56 @@ def paginate_query(query, per_page=20):
     pagination = query.paginate(page=page, per_page=per_page, error_out=False)
     return pagination
 
-def log_action(action_description, user=None):
-    """A helper function to easily create an audit log entry."""
+def log_action(action_description, user=None, ip_address=None):
+    """
+    A helper function to easily create an audit log entry. Outside a request (the
+    sale group-commit writer) pass `user` and `ip_address` explicitly.
+    """
     # Use the provided user object first, otherwise fall back to current_user
     user_to_log = user or (current_user if current_user.is_authenticated else None)
+    if ip_address is None and has_request_context():
+        ip_address = request.remote_addr
 
     log = AuditLog(
         user_id=user_to_log.id if user_to_log else None,
         action=action_description,
-        ip_address=request.remote_addr
+        ip_address=ip_address
     )
     db.session.add(log)
 
 
+def get_system_account_map():
+    """
+    Account name -> code for the whole chart of accounts, loaded with one query
+    and kept on the app until an account is added or changed.
+    """
+    accounts = current_app.extensions.get('system_accounts')
+    if accounts is None:
+        accounts = dict(db.session.query(Account.name, Account.code).all())
+        current_app.extensions['system_accounts'] = accounts
+    return accounts
+
+
+def clear_system_account_map():
+    """Forget the preloaded account map (call after changing the chart of accounts)."""
+    current_app.extensions.pop('system_accounts', None)
+
+
 # --- NEW FUNCTION TO REMOVE MAGIC NUMBERS ---
-@lru_cache(maxsize=None) # Caches results for high performance
 def get_system_account_code(name):
     """
     Fetches the account code for a critical system account by its name.
-    Caches the result to avoid database lookups on every transaction.
+    Served from the preloaded account map to avoid database lookups on every transaction.
     If the account is not found, it will abort the request
     because the system cannot proceed without it.
     """
-    account = Account.query.filter_by(name=name).first()
-    if not account:
+    code = get_system_account_map().get(name)
+    if code is None:
+        # The account may have been created since the map was loaded
+        clear_system_account_map()
+        code = get_system_account_map().get(name)
+    if code is None:
         # Abort with a 500 error. The frontend will see this.
         # This is critical to stop a bad transaction.
         abort(500, f"Critical system account '{name}' not found. Please configure it in the Chart of Accounts.")
-    return account.code
\ No newline at end of file
+    return code
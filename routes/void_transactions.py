@@ -1,12 +1,15 @@
 from flask import Blueprint, request, flash, redirect, url_for, jsonify
 from flask_login import login_required, current_user
-from models import (db, Sale, Purchase, ARInvoice, APInvoice, Payment, 
-                   JournalEntry, StockAdjustment, Product, InventoryLot, SaleItem, InventoryTransaction)
+from models import (db, Sale, Purchase, PurchaseItem, ARInvoice, APInvoice, Payment, 
+                   JournalEntry, StockAdjustment, Product, InventoryLot, SaleItem, InventoryTransaction,
+                   AverageCost, InventoryLotArchive)
 from datetime import datetime
-import json
 from .decorators import role_required
 from .utils import log_action, get_system_account_code
 from routes.fifo_utils import reverse_inventory_consumption
+from routes.costing_utils import return_average, withdraw_average
+from routes.archive_utils import restore_archived_lots
+from routes.posting_utils import reverse_journal
 from sqlalchemy import func
 
 void_bp = Blueprint('void', __name__, url_prefix='/void')
@@ -48,27 +51,7 @@ def void_sale(sale_id):
         
         if original_je:
             # Create exact reverse
-            original_entries = original_je.entries()
-            reversed_entries = []
-            
-            for entry in original_entries:
-                reversed_entries.append({
-                    'account_code': entry['account_code'],
-                    'debit': entry.get('credit', 0),  # Swap debit/credit
-                    'credit': entry.get('debit', 0)
-                })
-            
-            reversing_je = JournalEntry(
-                description=f'[VOID] Sale #{sale.id} ({sale.document_number}) - {void_reason}',
-                entries_json=json.dumps(reversed_entries),
-                created_at=datetime.utcnow()
-            )
-            db.session.add(reversing_je)
-            
-            # Mark original as voided
-            original_je.voided_at = datetime.utcnow()
-            original_je.voided_by = current_user.id
-            original_je.void_reason = void_reason
+            reverse_journal(original_je, f'[VOID] Sale #{sale.id} ({sale.document_number}) - {void_reason}', current_user, void_reason)
         
         # 4. Mark sale as voided
         sale.voided_at = datetime.utcnow()
@@ -107,6 +90,13 @@ def void_purchase(purchase_id):
     
     try:
         # 1. Check if any inventory from this purchase has been sold
+        # (archived lots are depleted ones, so any of them means it has)
+        archived = InventoryLotArchive.query.filter_by(purchase_id=purchase.id).first()
+        if archived:
+            item = db.session.get(PurchaseItem, archived.purchase_item_id)
+            flash(f'Cannot void purchase: Inventory from this purchase has been sold (Product: {item.product_name if item else archived.product_id}).', 'danger')
+            return redirect(url_for('core.purchases'))
+
         for item in purchase.items:
             lots = InventoryLot.query.filter_by(
                 purchase_id=purchase.id,
@@ -122,6 +112,15 @@ def void_purchase(purchase_id):
                 
                 # Safe to delete the lot
                 db.session.delete(lot)
+
+            # Costed at moving average: take the receipt back out of the running totals
+            pool = db.session.get(AverageCost, item.product_id)
+            if pool is not None:
+                try:
+                    withdraw_average(pool, item.qty, round(item.qty * item.unit_cost, 2))
+                except ValueError:
+                    flash(f'Cannot void purchase: Inventory from this purchase has been sold (Product: {item.product_name}).', 'danger')
+                    return redirect(url_for('core.purchases'))
         
         # 2. Restore product quantities
         for item in purchase.items:
@@ -136,26 +135,7 @@ def void_purchase(purchase_id):
         ).filter(JournalEntry.voided_at.is_(None)).first()
         
         if original_je:
-            original_entries = original_je.entries()
-            reversed_entries = []
-            
-            for entry in original_entries:
-                reversed_entries.append({
-                    'account_code': entry['account_code'],
-                    'debit': entry.get('credit', 0),
-                    'credit': entry.get('debit', 0)
-                })
-            
-            reversing_je = JournalEntry(
-                description=f'[VOID] Purchase #{purchase.id} - {void_reason}',
-                entries_json=json.dumps(reversed_entries),
-                created_at=datetime.utcnow()
-            )
-            db.session.add(reversing_je)
-            
-            original_je.voided_at = datetime.utcnow()
-            original_je.voided_by = current_user.id
-            original_je.void_reason = void_reason
+            reverse_journal(original_je, f'[VOID] Purchase #{purchase.id} - {void_reason}', current_user, void_reason)
         
         # 4. Mark purchase as voided
         purchase.voided_at = datetime.utcnow()
@@ -212,26 +192,7 @@ def void_ar_invoice(invoice_id):
         ).filter(JournalEntry.voided_at.is_(None)).first()
         
         if original_je:
-            original_entries = original_je.entries()
-            reversed_entries = []
-            
-            for entry in original_entries:
-                reversed_entries.append({
-                    'account_code': entry['account_code'],
-                    'debit': entry.get('credit', 0),
-                    'credit': entry.get('debit', 0)
-                })
-            
-            reversing_je = JournalEntry(
-                description=f'[VOID] Billing Invoice {invoice.invoice_number} - {void_reason}',
-                entries_json=json.dumps(reversed_entries),
-                created_at=datetime.utcnow()
-            )
-            db.session.add(reversing_je)
-            
-            original_je.voided_at = datetime.utcnow()
-            original_je.voided_by = current_user.id
-            original_je.void_reason = void_reason
+            reverse_journal(original_je, f'[VOID] Billing Invoice {invoice.invoice_number} - {void_reason}', current_user, void_reason)
         
         # 4. Mark invoice as voided
         invoice.voided_at = datetime.utcnow()
@@ -278,26 +239,7 @@ def void_ap_invoice(invoice_id):
         ).filter(JournalEntry.voided_at.is_(None)).first()
         
         if original_je:
-            original_entries = original_je.entries()
-            reversed_entries = []
-            
-            for entry in original_entries:
-                reversed_entries.append({
-                    'account_code': entry['account_code'],
-                    'debit': entry.get('credit', 0),
-                    'credit': entry.get('debit', 0)
-                })
-            
-            reversing_je = JournalEntry(
-                description=f'[VOID] AP Invoice #{invoice.id} ({invoice.invoice_number}) - {void_reason}',
-                entries_json=json.dumps(reversed_entries),
-                created_at=datetime.utcnow()
-            )
-            db.session.add(reversing_je)
-            
-            original_je.voided_at = datetime.utcnow()
-            original_je.voided_by = current_user.id
-            original_je.void_reason = void_reason
+            reverse_journal(original_je, f'[VOID] AP Invoice #{invoice.id} ({invoice.invoice_number}) - {void_reason}', current_user, void_reason)
         
         invoice.voided_at = datetime.utcnow()
         invoice.voided_by = current_user.id
@@ -363,26 +305,7 @@ def void_payment(payment_id):
         ).filter(JournalEntry.voided_at.is_(None)).first()
         
         if original_je:
-            original_entries = original_je.entries()
-            reversed_entries = []
-            
-            for entry in original_entries:
-                reversed_entries.append({
-                    'account_code': entry['account_code'],
-                    'debit': entry.get('credit', 0),
-                    'credit': entry.get('debit', 0)
-                })
-            
-            reversing_je = JournalEntry(
-                description=f'[VOID] Payment #{payment.id} for {payment.ref_type} #{payment.ref_id} - {void_reason}',
-                entries_json=json.dumps(reversed_entries),
-                created_at=datetime.utcnow()
-            )
-            db.session.add(reversing_je)
-            
-            original_je.voided_at = datetime.utcnow()
-            original_je.voided_by = current_user.id
-            original_je.void_reason = void_reason
+            reverse_journal(original_je, f'[VOID] Payment #{payment.id} for {payment.ref_type} #{payment.ref_id} - {void_reason}', current_user, void_reason)
         
         payment.voided_at = datetime.utcnow()
         payment.voided_by = current_user.id
@@ -422,7 +345,8 @@ def void_stock_adjustment(adjustment_id):
         product.quantity -= adjustment.quantity_changed
         product.quantity = max(0, product.quantity)
         
-        # Remove any lots created by this adjustment
+        # Remove any lots created by this adjustment, archived ones included
+        restore_archived_lots([lot.id for lot in InventoryLotArchive.query.filter_by(adjustment_id=adjustment.id)])
         lots = InventoryLot.query.filter_by(adjustment_id=adjustment.id).all()
         for lot in lots:
             db.session.delete(lot)
@@ -431,28 +355,24 @@ def void_stock_adjustment(adjustment_id):
         original_je = JournalEntry.query.filter(
             JournalEntry.description.like(f'%Stock%{product.name}%{adjustment.reason}%')
         ).filter(JournalEntry.voided_at.is_(None)).first()
+
+        # A gain or loss costed at moving average moved the running totals by the value it was posted at
+        pool = db.session.get(AverageCost, product.id)
+        if pool is not None and adjustment.quantity_changed > 0:
+            inventory_code = get_system_account_code('Inventory')
+            posted = sum(line['debit'] for line in original_je.line_rows()
+                         if line['account_code'] == inventory_code) if original_je else 0.0
+            withdraw_average(pool, adjustment.quantity_changed,
+                             posted or adjustment.quantity_changed * pool.unit_cost)
+        elif pool is not None and adjustment.quantity_changed < 0:
+            inventory_code = get_system_account_code('Inventory')
+            posted = sum(line['credit'] for line in original_je.line_rows()
+                         if line['account_code'] == inventory_code) if original_je else 0.0
+            return_average(pool, -adjustment.quantity_changed,
+                           posted or -adjustment.quantity_changed * pool.unit_cost)
         
         if original_je:
-            original_entries = original_je.entries()
-            reversed_entries = []
-            
-            for entry in original_entries:
-                reversed_entries.append({
-                    'account_code': entry['account_code'],
-                    'debit': entry.get('credit', 0),
-                    'credit': entry.get('debit', 0)
-                })
-            
-            reversing_je = JournalEntry(
-                description=f'[VOID] Stock Adjustment #{adjustment.id} for {product.name} - {void_reason}',
-                entries_json=json.dumps(reversed_entries),
-                created_at=datetime.utcnow()
-            )
-            db.session.add(reversing_je)
-            
-            original_je.voided_at = datetime.utcnow()
-            original_je.voided_by = current_user.id
-            original_je.void_reason = void_reason
+            reverse_journal(original_je, f'[VOID] Stock Adjustment #{adjustment.id} for {product.name} - {void_reason}', current_user, void_reason)
         
         adjustment.voided_at = datetime.utcnow()
         adjustment.voided_by = current_user.id
@@ -488,27 +408,7 @@ def void_journal_entry(je_id):
     
     try:
         # Create reversing entry
-        original_entries = journal_entry.entries()
-        reversed_entries = []
-        
-        for entry in original_entries:
-            reversed_entries.append({
-                'account_code': entry['account_code'],
-                'debit': entry.get('credit', 0),
-                'credit': entry.get('debit', 0)
-            })
-        
-        reversing_je = JournalEntry(
-            description=f'[VOID] JE #{journal_entry.id} - {journal_entry.description} - {void_reason}',
-            entries_json=json.dumps(reversed_entries),
-            created_at=datetime.utcnow()
-        )
-        db.session.add(reversing_je)
-        
-        # Mark original as voided
-        journal_entry.voided_at = datetime.utcnow()
-        journal_entry.voided_by = current_user.id
-        journal_entry.void_reason = void_reason
+        reverse_journal(journal_entry, f'[VOID] JE #{journal_entry.id} - {journal_entry.description} - {void_reason}', current_user, void_reason)
         
         log_action(f'Voided Journal Entry #{journal_entry.id}. Reason: {void_reason}')
         db.session.commit()